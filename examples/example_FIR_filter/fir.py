@@ -19,11 +19,13 @@ fir_base = Bin.Bin(
         # Implement a multiplier that can multiply tap coeffs and
         # input samples. This is a serial multiplier, which means it
         # is slower but smaller than a single clock multiply.  If
-        # speed is essential, change this to a Sequence.Multiply.
+        # speed is essential, change this to a Sequence.Multiply, or
+        # pass radix=4 to take half the cycles.
         Sequence.SerialMultiply(name="mult", a=xin, b=coeff, out=mult),
 
         # Create an accumulating sequence by adding the output of the
-        # multipler with the output register.
+        # multipler with the output register.  A MultiplyAccumulate
+        # does both the multiply and the add in one Sequence.
         Sequence.Add(name="accum", a=mult, b=xout, out=xout, clamp=True),
         ]
     )
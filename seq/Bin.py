@@ -1,5 +1,8 @@
 import seq
 import Sequence
+import Writer
+import Manifest
+import Latency
 
 class Bin(object):
     """A 'Bin' reprasents a state machine that serially executes
@@ -22,20 +25,37 @@ necessary.  The 'done' signal can be registered and sent back in if
 the user want to run sequences back to back.  This means there is at
 least one cycle 'wasted' time required to change when
 starting/completing sequences.  You can implement custom Sequences,
-however, to get around this in a critical section.
+however, to get around this in a critical section.  Within a Bin,
+a Serial or Repeat starts each Sequence in the cycle the one before it
+is done, and a Bin made with 'lookahead' starts its children Bins in
+the cycle a Child Sequence starts, so a chain of Child Sequences runs
+its children back to back.
+
+A Bin made with a 'queue' instead takes 'push_seq' and 'push' inputs
+that add a seq code to a queue, and starts the Sequences in the queue
+one after the other by itself.  A new push then waits its turn rather
+than terminating the running Sequence, so the user only has to watch
+the '<name>_ready' output rather than 'done' to keep it busy.
 
 Bins execute a series of 'Sequences'.  Sequences must implement
 the Sequence interface and can be things like ChildSequence, ...
 
 """
     
-    def __init__(self, name, seqs, regs=[], children=[], register_done=True, reset_n="reset_n"):
+    def __init__(self, name, seqs, regs=[], children=[], register_done=True, reset_n="reset_n", shared_inactive=False, len1=None, mux_tree=False, share_units=False, lookahead=False, queue=0, overflow_width=8):
         """
 :param name : A string name for this bin.  The HDL writer will create a module with this name in a file with this name.  Think carefully about uniqueness.
 :param seqs : A list of Sequences that this Bin controls.  The index number of each sequence becomes the 'seq' code used by the HDL
 :param regs : A list of Signals that are the registers overwhich this Bin has control.  Any register in this list can be controlled by Sequences such as Set, Trigger, Toggle.
 :param children : A list of children Bins that this Bin controls.  Make it an empty list if this is a base Bin with no children.
-:param register_done: A boolean indicating whether the done signal from this bin is registered.  False will make the transition of child sequences faster but incure longer logic paths.  The logic can get quite long as hierarchy gets larger.  An occasional registering of the done signal can significantly reduce logic paths if the hierarchy of bins is deep.  Leave low level paths un-registered and register higher level sequences where an extra cycle delay in the transition is not critical.
+:param register_done: A boolean indicating whether the done signal from this bin is registered.  False will make the transition of child sequences faster but incure longer logic paths.  The logic can get quite long as hierarchy gets larger.  An occasional registering of the done signal can significantly reduce logic paths if the hierarchy of bins is deep.  Leave low level paths un-registered and register higher level sequences where an extra cycle delay in the transition is not critical, or have limit_logic_depth() choose where to register for a given depth of logic.
+:param shared_inactive: A boolean indicating how the Sequences that are not selected by 'seq' are held inactive.  When False, every arm of the generated state machine's case statement repeats the inactive logic of all the other Sequences, so the generated HDL grows with the square of the number of Sequences.  When True, the inactive logic of all Sequences is generated once ahead of the case statement and each arm only holds and runs its own Sequence.  This trades a little logic ahead of the case statement for HDL that grows linearly in the number of Sequences.
+:param mux_tree: A boolean indicating how the done of the selected Sequence is picked for the done of this Bin, and for the done of the Select Sequences of this Bin.  When False, it is a chain of ternaries with one (seq == i) compare per Sequence, so the logic gets as deep as the number of Sequences.  When True, it is a balanced tree of ternaries on the bits of 'seq' that is only log2 of that deep.  This trades the fan out of the bits of 'seq' for shallower done logic.
+:param share_units: A boolean indicating whether the Multiply and Add Sequences of this Bin share multipliers and adders.  When False, each of them gets its own.  When True, those under different Sequences of this Bin, which can never run at the same time, share one multiplier or adder behind muxes on 'seq' that select their operands.  Only those with operands of the same widths and signs share, and those under the same Sequence of this Bin never do.  This trades operand muxes in front of each unit for fewer multipliers and adders.
+:param lookahead: A boolean indicating how the Child Sequences of this Bin start the children Bins.  When False, the start and seq inputs of each child Bin are registered, so a child Bin starts a cycle after the Child Sequence that runs it.  When True, they are driven straight from the start of the Child Sequence, so the child Bin starts in the same cycle and a Serial or Repeat of Child Sequences hands off from one child to the next with no idle cycle.  This lengthens the logic path from the start of this Bin into its children, and every child Bin must register its done, with 'register_done' or as a Len1Bin, so that its done does not loop back to its start.
+:param queue: An int depth of a queue of seq codes in front of this Bin, or 0 for no queue.  With a queue, the 'seq' and 'start' inputs are replaced by 'push_seq' and 'push', and each 'push' adds 'push_seq' to the back of the queue.  The Bin starts the Sequence at the front of the queue as soon as it is not running, or in the cycle it is done when it is a Len1Bin, so the queued Sequences run back to back.  The '<name>_ready' and '<name>_full' outputs show whether the queue can take another push.  A push while it is full is dropped and counted by the '<name>_overflow' output, which saturates.  A push takes a cycle to reach the front of an empty queue, which latency() includes.
+:param overflow_width: The width of the '<name>_overflow' counter of the queue.
+:param len1: A boolean indicating whether this Bin produces its done and running signals as a Len1Bin does, which saves logic and makes done a registered signal a single cycle after start.  When None, this is done whenever latency() proves that every Sequence of this Bin takes a single clock cycle.  When True, an Exception is raised if that cannot be proven.  See Len1Bin.
 """
         self.name = name
         self.seqs = seqs
@@ -43,10 +63,26 @@ the Sequence interface and can be things like ChildSequence, ...
         self._child_seqs = {}
         self.register_done = register_done
         self.reset_n = reset_n
+        self.shared_inactive = shared_inactive
+        self.mux_tree = mux_tree
+        self.share_units = share_units
+        self.lookahead = lookahead
+        self.queue = queue
 
         self.regs = {}
         self.ports = {}
+
+        if type(queue) is not int or queue < 0:
+            raise Exception("The queue of Bin %s must be an int depth or 0, not %s" % (name, queue))
+        if queue:
+            self.queue_ready = seq.Signal("%s_ready" % name)
+            self.queue_full = seq.Signal("%s_full" % name)
+            self.queue_overflow = seq.Signal("%s_overflow" % name, width=overflow_width)
+            self.ports[self.queue_ready.name] = seq.Port(self.queue_ready, "output")
+            self.ports[self.queue_full.name] = seq.Port(self.queue_full, "output")
+            self.ports[self.queue_overflow.name] = seq.Port(self.queue_overflow, "output", reg=True)
         self._children_starts = {}
+        self._children_codes = {}
 
         for reg in regs:
             self.regs[reg.name] = reg
@@ -68,6 +104,10 @@ the Sequence interface and can be things like ChildSequence, ...
                 self._child_seqs[child_seq.name] = child_seq
 
             self._children_starts[child.name] = []
+            self._children_codes[child.name] = []
+
+            if lookahead and not(child.register_done or child.len1):
+                raise Exception("Bin %s runs its children with lookahead, so child Bin %s must register its done" % (name, child.name))
 
         # The self.allseqs a is flatten dict of all Sequences under
         # control of this Bin keyed off the name of each Sequence
@@ -92,8 +132,35 @@ the Sequence interface and can be things like ChildSequence, ...
         for seq_ in seqs:
             seq_.register_unique_names(self.names)
 
-    def add_child_start(self, child_bin_name, start_sig_name):
+        long_seqs = self._long_seqs()
+        if len1 is None:
+            len1 = not(long_seqs)
+        elif len1 and long_seqs:
+            raise Exception("%s is a Len1Bin but Sequences %s are not proven to take a single clock cycle" % (self.name, ", ".join(long_seqs)))
+        self.len1 = len1
+
+    def _long_seqs(self):
+        """Returns the names of the Sequences of this Bin that latency()
+        does not prove to take a single clock cycle."""
+        names = []
+        for seq_ in self.seqs:
+            try:
+                latency = seq_.latency()
+            except NotImplementedError:
+                latency = None
+            if latency is None or not(latency.exact and latency.min == 1):
+                names.append(seq_.name)
+        return names
+
+    def add_child_start(self, child_bin_name, start_sig_name, seq_=None):
+        """Adds the signal 'start_sig_name' to the signals that start
+        the child Bin 'child_bin_name'.  'seq_' is the Child Sequence
+        that drives it, which gives the seq code of the child Bin when
+        this Bin has 'lookahead'."""
+        if self.lookahead and seq_ is None:
+            raise Exception("Starts of child Bin %s in %s need the Sequence giving their seq code because it runs its children with lookahead" % (child_bin_name, self.name))
         self._children_starts[child_bin_name].append(start_sig_name)
+        self._children_codes[child_bin_name].append((start_sig_name, seq_))
         
     def register_port(self, port):
         if(not(self.ports.has_key(port.sig.name)) or (port.dir == "output") or (self.ports[port.sig.name].dir == "input")):
@@ -145,7 +212,24 @@ method on his sub-Sequences.
 
     def _vlog_gen_done(self):
         s = []
-        if(self.register_done):
+        if(self.len1):
+            # Ignore the state of self.register_done and just produce a
+            # registered done output that samples the start signal.
+            # The internal done_ signal is still generated, which can be
+            # useful to verify in simulation that all the member
+            # Sequences are indeed length 1, but synthesis will optimize
+            # it away.
+            s.extend(["  reg done_reg;",
+                      "  assign done = done_reg;",
+                      "  always @(posedge clk or negedge reset_n) begin",
+                      "    if(!reset_n) begin",
+                      "      done_reg <= 0;",
+                      "    end else begin",
+                      "      done_reg <= start;",
+                      "    end",
+                      "  end",
+                      ])
+        elif(self.register_done):
             s.extend(["  reg done_reg;",
                       "  assign done = done_reg;",
                       "  always @(posedge clk or negedge reset_n) begin",
@@ -162,6 +246,9 @@ method on his sub-Sequences.
 
 
     def _vlog_gen_running(self):
+        if(self.len1):
+            # running and done are the same
+            return [ "  assign running = done_reg;", ]
         s = [ "  reg running_reg;",
               "  assign running = running_reg;",
               "  always @(posedge clk or negedge reset_n) begin",
@@ -177,157 +264,425 @@ method on his sub-Sequences.
               "  end",  ]
         return s
 
-    def vlog_dump(self, outdir="", filename=None, recurse=False):
+    # The following sim functions mirror the vlog functions above and
+    # are used by seq.Sim to simulate the Bin.  's' is the simulation
+    # context (a seq.Sim.BinSim).
+    def _sim_done(self, s):
+        if(self.len1):
+            s.reg("done_reg", 1)
+            s.wire("done", lambda: s.get("done_reg"))
+            s.always(lambda: s.assign("done_reg", s.get("start")))
+        elif(self.register_done):
+            s.reg("done_reg", 1)
+            s.wire("done", lambda: s.get("done_reg"))
+            s.always(lambda: s.assign("done_reg", s.get("done_")))
+        else:
+            s.wire("done", lambda: s.get("done_"))
+
+    def _sim_running(self, s):
+        if(self.len1):
+            s.wire("running", lambda: s.get("done_reg"))
+            return
+        s.reg("running_reg", 1)
+        s.wire("running", lambda: s.get("running_reg"))
+        def running():
+            with s.if_(s.get("start")):
+                s.assign("running_reg", 1)
+            with s.elif_(s.get("done_")):
+                s.assign("running_reg", 0)
+        s.always(running)
+
+    def _interface_key(self):
+        """Describes the interface of this Bin as seen by a parent Bin
+        that instances it."""
+        ports = sorted([(p.sig.name, p.dir, p.reg, p.sig.width, p.sig.signed) for p in self.ports.values()])
+        return (self.name, tuple(ports), tuple([seq_.name for seq_ in self.seqs]), self._control_inputs())
+
+    def _control_inputs(self):
+        """The names of the inputs that take the seq code and start a
+        Sequence of this Bin."""
+        if self.queue:
+            return ("push_seq", "push")
+        return ("seq", "start")
+
+    def _vlog_gen_queue(self):
+        # The queue is a ring of 'queue' entries.  The Bin starts the
+        # entry at the front as it is popped and holds it in
+        # queue_seq_ while it runs.
+        depth = self.queue
+        width = seq.calc_width(len(self.seqs))
+        pw = seq.calc_width(depth)
+        cw = seq.calc_width(depth+1)
+        if self.len1:
+            idle = "(!running || done)"
+        else:
+            idle = "!running"
+        ready, full, overflow = self.queue_ready.name, self.queue_full.name, self.queue_overflow.name
+        return [ "  wire start;",
+                 "  wire [%d:0] seq;" % (width-1, ),
+                 "  reg  [%d:0] queue_mem_ [0:%d];" % (width-1, depth-1),
+                 "  reg  [%d:0] queue_seq_;" % (width-1, ),
+                 "  reg  [%d:0] queue_wr_, queue_rd_;" % (pw-1, ),
+                 "  reg  [%d:0] queue_count_;" % (cw-1, ),
+                 "  wire queue_push_ = push && !%s;" % (full, ),
+                 "  assign %s = (queue_count_ == %d);" % (full, depth),
+                 "  assign %s = !%s;" % (ready, full),
+                 "  assign start = (queue_count_ != 0) && %s;" % (idle, ),
+                 "  assign seq = start ? queue_mem_[queue_rd_] : queue_seq_;",
+                 "  always @(posedge clk or negedge reset_n) begin",
+                 "    if(!reset_n) begin",
+                 "      queue_seq_ <= 0;",
+                 "      queue_wr_ <= 0;",
+                 "      queue_rd_ <= 0;",
+                 "      queue_count_ <= 0;",
+                 "      %s <= 0;" % (overflow, ),
+                 "    end else begin",
+                 "      if(queue_push_) begin",
+                 "        queue_mem_[queue_wr_] <= push_seq;",
+                 "        queue_wr_ <= (queue_wr_ == %d) ? 0 : queue_wr_ + 1;" % (depth-1, ),
+                 "      end",
+                 "      if(start) begin",
+                 "        queue_seq_ <= seq;",
+                 "        queue_rd_ <= (queue_rd_ == %d) ? 0 : queue_rd_ + 1;" % (depth-1, ),
+                 "      end",
+                 "      if(queue_push_ && !start) begin",
+                 "        queue_count_ <= queue_count_ + 1;",
+                 "      end else if(start && !queue_push_) begin",
+                 "        queue_count_ <= queue_count_ - 1;",
+                 "      end",
+                 "      if(push && %s && !(&%s)) begin" % (full, overflow),
+                 "        %s <= %s + 1;" % (overflow, overflow),
+                 "      end",
+                 "    end",
+                 "  end",
+                 "", ]
+
+    def _sim_queue(self, s):
+        depth = self.queue
+        width = seq.calc_width(len(self.seqs))
+        ready, full, overflow = self.queue_ready.name, self.queue_full.name, self.queue_overflow.name
+        mem = [ "queue_mem_[%d]" % i for i in range(depth) ]
+        for name in mem + [ "queue_seq_" ]:
+            s.reg(name, width)
+        s.reg("queue_wr_", seq.calc_width(depth))
+        s.reg("queue_rd_", seq.calc_width(depth))
+        s.reg("queue_count_", seq.calc_width(depth+1))
+        s.reg(overflow, self.queue_overflow.width)
+        s.wire("queue_push_", lambda: s.land(s.get("push"), s.lnot(s.get(full))), 1)
+        s.wire(full, lambda: s.get("queue_count_") == depth, 1)
+        s.wire(ready, lambda: s.lnot(s.get(full)), 1)
+        def start():
+            if self.len1:
+                idle = s.lor(s.lnot(s.get("running")), s.get("done"))
+            else:
+                idle = s.lnot(s.get("running"))
+            return s.land(s.get("queue_count_") != 0, idle)
+        s.wire("start", start, 1)
+        def front():
+            v = s.get(mem[-1])
+            for i in reversed(range(depth-1)):
+                v = s.mux(s.get("queue_rd_") == i, s.get(mem[i]), v)
+            return v
+        s.wire("seq", lambda: s.mux(s.get("start"), front(), s.get("queue_seq_")), width)
+        def queue():
+            push, start = s.get("queue_push_"), s.get("start")
+            wr, rd = s.get("queue_wr_"), s.get("queue_rd_")
+            with s.if_(push):
+                for i in range(depth):
+                    with s.if_(wr == i):
+                        s.assign(mem[i], s.get("push_seq"))
+                s.assign("queue_wr_", s.mux(wr == depth-1, 0, wr + 1))
+            with s.if_(start):
+                s.assign("queue_seq_", s.get("seq"))
+                s.assign("queue_rd_", s.mux(rd == depth-1, 0, rd + 1))
+            count = s.get("queue_count_")
+            with s.if_(s.land(push, s.lnot(start))):
+                s.assign("queue_count_", count + 1)
+            with s.elif_(s.land(start, s.lnot(push))):
+                s.assign("queue_count_", count - 1)
+            ovf = s.get(overflow)
+            with s.if_(s.land(s.get("push"), s.get(full), ovf != s.mask(self.queue_overflow.width))):
+                s.assign(overflow, ovf + 1)
+        s.always(queue)
+
+    def structural_hash(self):
+        """Returns a hex digest of the structure of this linked Bin.
+The digest changes whenever the HDL generated for this Bin would
+change: it covers the registers, ports and Sequences of this Bin, the
+interfaces of its children and the source of the generator code
+itself.  It does not cover the internals of the children, which are
+generated into their own modules."""
+        import hashlib
+        key = (type(self).__name__, self.register_done, self.reset_n, self.shared_inactive, self.len1, self.mux_tree, self.share_units, self.lookahead, self.queue,
+               sorted([(r.name, r.width, r.init, r.signed) for r in self.regs.values()]),
+               self._interface_key(),
+               tuple([child._interface_key() for child in self.children]),
+               tuple([seq_.structure_key() for seq_ in self.seqs]),
+               _source_digest([type(self)] + self._seqdata.keys()))
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def descendants(self):
+        """Returns a list of all the Bins below this Bin in the
+        hierarchy.  Each Bin appears once, even when it is the child of
+        several Bins, and always after all of its own children."""
+        bins = []
+        names = {}
+        def visit(bin):
+            for child in bin.children:
+                if names.has_key(child.name):
+                    if not(names[child.name] is child):
+                        raise Exception("Bin names must be unique.  %s is a duplicate" % child.name)
+                    continue
+                visit(child)
+                names[child.name] = child
+                bins.append(child)
+        visit(self)
+        return bins
+
+    def vlog_dump(self, outdir="", filename=None, recurse=False, incremental=False, jobs=1, counters=None, counter_width=32):
         """Creates a verilog implementation of this Bin.
 
 :param outdir: path to dump file in. Should include trailing path deliminter.
 :param filename: If None, then the file will be called 'name'.v, where name is the name provided when you created this function.  Otherwise, the filename will be that specified by this parameter.
-:param recurse: If True, then recursively dump verilog for all children.  filename cannot be specified for children when using this method
+:param recurse: If True, then recursively dump verilog for all children.  filename cannot be specified for children when using this method.  Children shared by several Bins are only dumped once.
+:param incremental: If True, keep a seq.Manifest of the structural hash of each dumped Bin in outdir and skip generating and writing any Bin whose hash has not changed since it was last dumped.  The generation time and user are recorded in the manifest instead of in the generated files, so file mtimes only move when their contents do.  The files a Bin reads, such as ROM images, are recorded with it.
+:param jobs: The number of worker processes to generate Bins with when recurse is True.  Each Bin is generated whole by a single worker, so the output is identical to that of a serial dump.
+:param counters: Adds hardware performance counters to the dumped Bins when not None.  True counts the starts and the busy cycles of each of the Sequences in the 'seqs' list of each Bin and the idle cycles of each Bin.  A list of names only instruments the Sequences, at any level, and the Bins with those names.  See perf_counters().
+:param counter_width: The width of each performance counter.  The counters saturate.
 Example:
     seq_.vlog_dump("rtl_auto/")
 """
+        if not filename:
+            filename = self.name + ".v"
+        dumps = [ (self, filename) ]
         if recurse:
-            for child in self.children:
-                child.vlog_dump(outdir, recurse=True)
+            dumps = [ (child, child.name + ".v") for child in self.descendants() ] + dumps
+
+        manifest = None
+        if incremental:
+            manifest = Manifest.Manifest(outdir)
+            digests = {}
+            for bin, name in dumps:
+                digests[name] = bin.structural_hash()
+                if counters:
+                    import hashlib
+                    digests[name] = hashlib.sha1(repr((digests[name], counters, counter_width))).hexdigest()
+            # the files the Sequences read, such as ROM images, are
+            # recorded under the digest of the Bin that writes them
+            files = dict([ (name, [ x for x, lines in bin.vlog_gen_files() ]) for bin, name in dumps ])
+            dumps = [ (bin, name) for bin, name in dumps if not all([ manifest.is_current(x, digests[name]) for x in [ name ] + files[name] ]) ]
+
+        _dump_jobs[:] = [ (bin, outdir + name, manifest is None, counters, counter_width) for bin, name in dumps ]
+        try:
+            if jobs > 1 and len(_dump_jobs) > 1:
+                import multiprocessing
+                pool = multiprocessing.Pool(min(jobs, len(_dump_jobs)))
+                try:
+                    pool.map(_dump_job, range(len(_dump_jobs)), chunksize=1)
+                finally:
+                    pool.terminate()
+                    pool.join()
+            else:
+                for i in range(len(_dump_jobs)):
+                    _dump_job(i)
+        finally:
+            del _dump_jobs[:]
+
+        if manifest is not None:
+            for bin, name in dumps:
+                for x in [ name ] + files[name]:
+                    manifest.update(x, digests[name])
+            manifest.save()
+
+    def vlog_gen_module(self, w, counters=None, counter_width=32):
+        """Streams the verilog module implementing this Bin into the
+seq.Writer 'w'.  Each part of the module, such as the logic of one of
+the Sequences of this Bin, is written into the Writer as it is
+generated, so the module is never held in memory as a whole, only the
+lines of its largest part.
+'counters' and 'counter_width' add performance counters.  See
+vlog_dump."""
 
-        s = []
-        
         # Print up the module header with the port assignments
-        s = [ "module %s(" % self.name ]
-        s.append("  input clk,")
-        s.append("  input reset_n,")
+        w.write("module %s(" % self.name)
+        w.write("  input clk,")
+        w.write("  input reset_n,")
         
         for port in self.ports.values():
-            s.append("  %s," % (port.vlog_declaration(), ))
+            w.write("  %s," % (port.vlog_declaration(), ))
+        own = [ sig.name for sig, event in self._perf_events(counters, counter_width) ]
+        for sig in self.perf_counters(counters, counter_width, recurse=True):
+            w.write("  %s," % (seq.Port(sig, "output", reg=sig.name in own).vlog_declaration(), ))
     
-        s.append("\n  // control")
+        w.write("\n  // control")
         width = seq.calc_width(len(self.seqs))
-        s.append("  input [%d:0] seq," % (width-1, ))
-        s.append("  input start,")
-        s.append("  output running,")
-        s.append("  output done);\n")
+        seq_input, start_input = self._control_inputs()
+        w.write("  input [%d:0] %s," % (width-1, seq_input))
+        w.write("  input %s," % (start_input, ))
+        w.write("  output running,")
+        w.write("  output done);\n")
+
+        if self.queue:
+            w.extend(self._vlog_gen_queue())
 
-        s.append("  wire done_;")
+        w.write("  wire done_;")
 
-        s.extend(self._vlog_gen_done())
-        s.extend(self._vlog_gen_running())
+        w.extend(self._vlog_gen_done())
+        w.extend(self._vlog_gen_running())
 
         # create parameters for each state
-        s.extend(self.vlog_gen_seq_params())
+        w.extend(self.vlog_gen_seq_params())
         for child in self.children:
-            s.extend(child.vlog_gen_seq_params(prefix="child_%s" % child.name))
+            w.extend(child.vlog_gen_seq_params(prefix="child_%s" % child.name))
 
         for child in self.children:
-            s.append("  wire child_%s_done_, child_%s_running_;" % (child.name, child.name, ))
+            w.write("  wire child_%s_done_, child_%s_running_;" % (child.name, child.name, ))
             width = seq.calc_width(len(child.seqs))
-            s.append("  reg [%d:0] child_%s_seq_;" % (width-1, child.name))
-            s.append("  reg child_%s_start_;" % (child.name, ))
-        s.append("")
+            w.write("  reg [%d:0] child_%s_seq_;" % (width-1, child.name))
+            if self.lookahead:
+                w.write("  wire [%d:0] child_%s_seq_in_;" % (width-1, child.name))
+                w.write("  wire child_%s_start_;" % (child.name, ))
+            else:
+                w.write("  reg child_%s_start_;" % (child.name, ))
+        w.write("")
 
         for reg in self.regs:
             if not(reg in self.ports.keys()):
-                s.append("  %s;" % (self.regs[reg].vlog_declaration("reg")))
+                w.write("  %s;" % (self.regs[reg].vlog_declaration("reg")))
 
 
         # create subseq declaration logic
         for seq_ in self.allseqs.values():
-            s.extend(seq_.vlog_gen_declare(indent=1))
-        s.append("")
+            seq_.vlog_gen_declare(indent=1, writer=w)
+        w.write("")
 
         # create done and running signal for all seqs
         for seq_ in self.allseqs.values():
-            s.append("  wire %s;" % (seq_.done, ))
-            s.append("  reg %s;"  % (seq_.running, ))
-        s.append("")
+            w.write("  wire %s;" % (seq_.done, ))
+            w.write("  reg %s;"  % (seq_.running, ))
+        w.write("")
 
 
         # start_reg wire
+        self.wires = seq.Wires()
         for i, seq_ in enumerate(self.seqs):
-            s.extend(seq_.vlog_gen_start_wire(start="start && (seq==%d)" % i, indent=1))
-        s.append("")
+            start = seq.vlog_and("start", seq.vlog_eq("seq", seq.calc_width(len(self.seqs)), i))
+            seq_.vlog_gen_start_wire(start=start, indent=1, writer=w)
+        w.write("")
 
         # Create the done logic for each seq
-#        for i,seq in enumerate(self.seqs):
-#            s.extend(seq_.vlog_gen_done(done="(seq==%d)" % i, indent=1))
         for seq_ in self.allseqs.values():
-            s.append("  assign %s = %s;" % (seq_.done, seq_.vlog_gen_done()))
-        s.append("")
+            w.write("  assign %s = %s;" % (seq_.done, seq_.vlog_gen_done()))
+        w.write("")
 
-        s.append("\n  assign done_ = (start || !running) ? 0 : ")
-        for seq_ in self.seqs:
-            s.append("              (seq == seq_%s_) ? %s :" % (seq_.name, seq_.done, ))
-        s.append("              1;\n // default to 1 to prevent deadlocking when this bin is addressed out of range")
+        if self.mux_tree:
+            done = seq.vlog_mux_tree("seq", seq.calc_width(len(self.seqs)), [seq_.done for seq_ in self.seqs], "1")
+            w.write("\n  assign done_ = (start || !running) ? 0 : %s;" % (done, ))
+            w.write(" // default to 1 to prevent deadlocking when this bin is addressed out of range\n")
+        else:
+            w.write("\n  assign done_ = (start || !running) ? 0 : ")
+            for seq_ in self.seqs:
+                w.write("              (seq == seq_%s_) ? %s :" % (seq_.name, seq_.done, ))
+            w.write("              1;\n // default to 1 to prevent deadlocking when this bin is addressed out of range")
 
         # create subseq logic
         for seq_ in self.allseqs.values():
-            s.extend(seq_.vlog_gen_logic(indent=1))
-        s.append("")
+            seq_.vlog_gen_logic(indent=1, writer=w)
+        w.write("")
 
         # Create the seq state machine
-        s.append("  always @(posedge clk or negedge reset_n) begin")
-        s.append("    if(!reset_n) begin")
+        w.write("  always @(posedge clk or negedge reset_n) begin")
+        w.write("    if(!reset_n) begin")
         for child in self.children:
-#            s.append("      child_%s_start_   <= 0;" % (child.name, ))
-            s.append("      child_%s_seq_     <= 0;" % (child.name, ))
+            w.write("      child_%s_seq_     <= 0;" % (child.name, ))
         for name, reg in self.regs.items():
-            s.append("      %s <= %s;" % (name, str(reg.init)))
+            w.write("      %s <= %s;" % (name, str(reg.init)))
         for seq_ in self.allseqs.values():
-            s.append("      %s <= 0;" % (seq_.running, ))
-            s.extend(seq_.vlog_gen_reset(indent=3))
-        s.append("")
-        s.append("    end else begin")
+            w.write("      %s <= 0;" % (seq_.running, ))
+            seq_.vlog_gen_reset(indent=3, writer=w)
+        w.write("")
+        w.write("    end else begin")
 
         for seq_ in self.allseqs.values():
-            s.extend(seq_.vlog_gen_running(indent=3))
-        s.append("")
+            seq_.vlog_gen_running(indent=3, writer=w)
+        w.write("")
         
-        s.append("      case(seq)")
+        if self.shared_inactive:
+            # Default every Sequence to inactive here and let the
+            # selected Sequence override it in its arm of the case
+            for seq_ in self.seqs:
+                seq_.vlog_gen_inactive(indent=3, writer=w)
+            w.write("")
+
+        w.write("      case(seq)")
         for seq_ in self.seqs:
-            s.append("        seq_%s_: begin" % (seq_.name, ))
-            s.extend(seq_.vlog_gen_seq(indent=5))
-            s.append("")
-            for seq_inactive in self.seqs:
-                if not(seq_ is seq_inactive):
-                    s.extend(seq_inactive.vlog_gen_inactive(indent=5))
-            s.append("        end\n")
-        s.append("      endcase\n")
-        s.append("    end")
-        s.append("  end\n")
+            w.write("        seq_%s_: begin" % (seq_.name, ))
+            if self.shared_inactive:
+                seq_.vlog_gen_hold(indent=5, writer=w)
+            seq_.vlog_gen_seq(indent=5, writer=w)
+            w.write("")
+            if not self.shared_inactive:
+                for seq_inactive in self.seqs:
+                    if not(seq_ is seq_inactive):
+                        seq_inactive.vlog_gen_inactive(indent=5, writer=w)
+            w.write("        end\n")
+        if self.shared_inactive and 2**seq.calc_width(len(self.seqs)) > len(self.seqs):
+            # nothing is inactivated when seq is out of range
+            w.write("        default: begin")
+            for seq_ in self.seqs:
+                seq_.vlog_gen_hold(indent=5, writer=w)
+            w.write("        end\n")
+        w.write("      endcase\n")
+        w.write("    end")
+        w.write("  end\n")
 
         for seqtype, data in self._seqdata.items():
-            s.extend(getattr(seqtype, "vlog_gen_static_logic")(self._seqdata))
-        s.append("")
+            w.extend(getattr(seqtype, "vlog_gen_static_logic")(self._seqdata))
+        w.write("")
 
-        s.append("  always @(posedge clk or negedge reset_n) begin")
-        s.append("    if(!reset_n) begin")
-        for name in self._children_starts:
-            s.append("      child_%s_start_ <= 0;" % (name, ))
-        s.append("    end else begin")
-        for name, start in self._children_starts.items():
-            s.append("      child_%s_start_ <= %s;" % (name, " || ".join(start), ))
-        s.append("    end")
-        s.append("  end\n")
+        w.extend(self._vlog_gen_perf(counters, counter_width))
+
+        if self.lookahead:
+            # The child sees the seq code of a Child Sequence in the
+            # cycle it starts and child_*_seq_ holds it after that
+            for child in self.children:
+                codes = self._children_codes[child.name]
+                w.write("  assign child_%s_start_ = %s;" % (child.name, " || ".join([ x[0] for x in codes ]) or "0", ))
+                code = "".join([ "(%s) ? %s : " % (start, seq_._vlog_child_code(child)) for start, seq_ in codes ])
+                w.write("  assign child_%s_seq_in_ = %schild_%s_seq_;" % (child.name, code, child.name, ))
+            w.write("")
+        else:
+            w.write("  always @(posedge clk or negedge reset_n) begin")
+            w.write("    if(!reset_n) begin")
+            for name in self._children_starts:
+                w.write("      child_%s_start_ <= 0;" % (name, ))
+            w.write("    end else begin")
+            for name, start in self._children_starts.items():
+                w.write("      child_%s_start_ <= %s;" % (name, " || ".join(start), ))
+            w.write("    end")
+            w.write("  end\n")
         
         # Creates verilog instances of the children Bins
         for child in self.children:
-            s.append
-            s.append("  %s u_%s_(" % (child.name, child.name, ))
-            s.append("    .clk(clk),")
-            s.append("    .reset_n(reset_n),")
+            w.write("  %s u_%s_(" % (child.name, child.name, ))
+            w.write("    .clk(clk),")
+            w.write("    .reset_n(reset_n),")
             for name, port in child.ports.items():
-                s.append("    .%s(%s)," % (name, name, ))
-
-            s.append("    .seq(child_%s_seq_)," % child.name)
-            s.append("    .start(child_%s_start_)," % child.name)
-            s.append("    .running(child_%s_running_)," % child.name)
-            s.append("    .done(child_%s_done_)" % child.name)
-            s.append("  );\n")
-
-        s.append("endmodule\n")
-
-        if not filename:
-            filename = self.name + ".v"
-        dump_file(outdir + filename, s, comment="//")
+                w.write("    .%s(%s)," % (name, name, ))
+            for sig in child.perf_counters(counters, counter_width, recurse=True):
+                w.write("    .%s(%s)," % (sig.name, sig.name, ))
+
+            seq_input, start_input = child._control_inputs()
+            if self.lookahead:
+                w.write("    .%s(child_%s_seq_in_)," % (seq_input, child.name))
+            else:
+                w.write("    .%s(child_%s_seq_)," % (seq_input, child.name))
+            w.write("    .%s(child_%s_start_)," % (start_input, child.name))
+            w.write("    .running(child_%s_running_)," % child.name)
+            w.write("    .done(child_%s_done_)" % child.name)
+            w.write("  );\n")
+
+        w.write("endmodule\n")
 
     def gen_param_mapping(self, outdir="", recurse=False):
         """Dumps a parameter mapping file useful for debugging in a
@@ -341,8 +696,160 @@ Example:
             f.write("%d %s\n" % (i, seq_.name, )) # decimal representation
 #            f.write("%x %s\n" % (i, state.name, )) # hex 
         f.close()
+        self.gen_latency_report(outdir)
+
+    def gen_latency_report(self, outdir="", recurse=False):
+        """Dumps a report of the latency() of each of the Sequences of
+        this Bin next to its parameter mapping file.  Each line is the
+        'seq' code, Sequence name, min and max cycles ('-' when
+        unbounded or never done) and the closed form expression for
+        the cycles."""
+        if recurse:
+            for child in self.children:
+                child.gen_latency_report(outdir, recurse=True)
 
+        latency = self.latency()
+        f=open(outdir + self.name + ".latency", "w")
+        for i, seq_ in enumerate(self.seqs):
+            l = latency[seq_.name]
+            f.write("%d %s %s %s %s\n" % (i, seq_.name, "-" if l.min is None else l.min, "-" if l.max is None else l.max, l))
+        f.close()
 
+    def latency(self):
+        """Returns a dict keyed on Sequence name of the seq.Latency of
+        each of the Sequences of this linked Bin: the number of clock
+        cycles from the cycle 'start' is asserted with 'seq' selecting
+        it until the cycle 'done' is asserted."""
+        return dict([ (seq_.name, self._latency(seq_)) for seq_ in self.seqs ])
+
+    def done_depth(self):
+        """Returns an estimate of the levels of logic from a register to
+        the done output of this linked Bin, which is 0 when done is
+        registered.  See Sequence.done_depth()."""
+        if self.len1 or self.register_done:
+            return 0
+        return self._done_depth()
+
+    def _done_depth(self):
+        # done_ is a chain of ternaries with a term per Sequence, or a
+        # tree of them, behind a ternary on start and running
+        if self.mux_tree:
+            return max([ seq_.done_depth() for seq_ in self.seqs ]) + seq.calc_width(len(self.seqs)) + 1
+        return max([ seq_.done_depth() + i + 1 for i, seq_ in enumerate(self.seqs) ]) + 2
+
+    def logic_depth(self):
+        """Returns an estimate of the levels of logic of the deepest
+        done path in the module of this linked Bin, which runs through
+        the done of its Sequences and of the child Bins that are not
+        registered and ends at the running register."""
+        if self.len1:
+            return 1 # done_reg samples start
+        return self._done_depth() + 1
+
+    def limit_logic_depth(self, depth):
+        """Registers the done of as few of the Bins below this one as it
+        takes to keep the logic_depth() of every Bin in the hierarchy
+        within 'depth'.  Working up from the bottom of the hierarchy, a
+        child Bin is only registered once its parent would exceed
+        'depth', and then the child whose registering shortens the
+        parent the most.  Each registered done adds a clock cycle to
+        the latency of the Sequences that run the Bin.
+
+:returns: The list of Bins that had 'register_done' set.
+"""
+        registered = []
+        for bin in self.descendants() + [self]:
+            while bin.logic_depth() > depth:
+                best = None
+                for child in bin.children:
+                    if child.done_depth() == 0:
+                        continue
+                    child.register_done = True
+                    if best is None or bin.logic_depth() < best[0]:
+                        best = (bin.logic_depth(), child)
+                    child.register_done = False
+                if best is None:
+                    raise Exception("Bin %s has a logic depth of %d, which is more than %d even with the done of all its children registered" % (bin.name, bin.logic_depth(), depth))
+                best[1].register_done = True
+                registered.append(best[1])
+        return registered
+
+    def _latency(self, seq_):
+        """The latency of 'seq_' at the done output.  A 'seq_' of None
+        is a 'seq' code that selects no Sequence, which is done right
+        away."""
+        queued = int(bool(self.queue)) # a cycle through the queue
+        if self.len1:
+            return Latency.const(1 + queued)
+        elif seq_ is None:
+            return Latency.const(1 + int(self.register_done) + queued)
+        return seq_.latency() + int(self.register_done) + queued
+
+
+
+    def vlog_gen_files(self):
+        """Returns a list of (filename, lines) of the files, such as ROM
+        images, that the module of this Bin reads.  vlog_dump() writes
+        them next to the module."""
+        files = []
+        for seqtype in self._seqdata.keys():
+            files.extend(seqtype.vlog_gen_files(self._seqdata))
+        return files
+
+    def perf_counters(self, counters=True, width=32, recurse=False):
+        """Returns the seq.Signals of the performance counters that
+vlog_dump() adds to this Bin for its 'counters' and 'counter_width'
+arguments.  They are outputs of the module named:
+
+    perf_<bin>_<seq>_starts  the number of times <seq> started
+    perf_<bin>_<seq>_busy    the number of cycles <seq> was running
+    perf_<bin>_idle          the number of cycles <bin> was not running
+
+With 'recurse', the counters of the Bins below this one are included,
+which the module passes up as outputs as well."""
+        sigs = []
+        if recurse:
+            for child in self.children:
+                for sig in child.perf_counters(counters, width, recurse=True):
+                    if not(sig.name in [ x.name for x in sigs ]):
+                        sigs.append(sig)
+        return sigs + [ sig for sig, event in self._perf_events(counters, width) ]
+
+    def _perf_events(self, counters, width):
+        """Returns a (Signal, event) for each performance counter of
+        this Bin, where 'event' is the verilog expression that counts."""
+        if not counters:
+            return []
+        if counters is True:
+            seqs = self.seqs
+            idle = True
+        else:
+            seqs = [ seq_ for seq_ in self.allseqs.values() if seq_.name in counters ]
+            seqs.sort(key=lambda x: x.name)
+            idle = self.name in counters
+        events = []
+        for seq_ in seqs:
+            events.append((seq.Signal("perf_%s_%s_starts" % (self.name, seq_.name), width=width), seq_.start))
+            events.append((seq.Signal("perf_%s_%s_busy" % (self.name, seq_.name), width=width), seq_.running))
+        if idle:
+            events.append((seq.Signal("perf_%s_idle" % (self.name, ), width=width), "!running"))
+        return events
+
+    def _vlog_gen_perf(self, counters, width):
+        events = self._perf_events(counters, width)
+        if not events:
+            return []
+        s = [ "  always @(posedge clk or negedge reset_n) begin",
+              "    if(!reset_n) begin", ]
+        for sig, event in events:
+            s.append("      %s <= 0;" % (sig.name, ))
+        s.append("    end else begin")
+        for sig, event in events:
+            s.append("      if(%s && !(&%s)) %s <= %s + 1;" % (event, sig.name, sig.name, sig.name))
+        s.extend([ "    end",
+                   "  end",
+                   "", ])
+        return s
 
     def vlog_gen_seq_params(self, prefix="seq"):
         """Prints up a unique parameter and name associated with each
@@ -358,9 +865,27 @@ Example:
 
 
 
-    def vlog_gen_instance(self, outdir="", wires_filename=None, inst_filename=None):
+    def vlog_gen_instance(self, outdir="", wires_filename=None, inst_filename=None, incremental=False, counters=None, counter_width=32):
         """Creates a verilog file instancing self (useful only for the top
-level)"""
+level)
+
+:param incremental: If True, skip generating and writing the files when the interface of this Bin has not changed since they were last generated.  See vlog_dump.
+:param counters: The 'counters' the Bin was dumped with.  See vlog_dump.
+:param counter_width: The 'counter_width' the Bin was dumped with.
+"""
+        if not wires_filename:
+            wires_filename = self.name + "_wires.v"
+        if not inst_filename:
+            inst_filename = self.name + "_instance.v"
+
+        manifest = None
+        if incremental:
+            import hashlib
+            manifest = Manifest.Manifest(outdir)
+            digest = hashlib.sha1(repr(("instance", self._interface_key(), self.reset_n, counters, counter_width, _source_digest([type(self)])))).hexdigest()
+            if manifest.is_current(wires_filename, digest) and manifest.is_current(inst_filename, digest):
+                return
+
         s = []
         for name, port in self.ports.iteritems():
             if(port.dir == "output"):
@@ -369,11 +894,12 @@ level)"""
                     s.append("  wire %s;" % (name, ))
                 else:
                     s.append("  wire [%d:0] %s;" % (sig.width-1, name))
+        perf = self.perf_counters(counters, counter_width, recurse=True)
+        for sig in perf:
+            s.append("  %s;" % (sig.vlog_declaration("wire"), ))
 
         s.append("  wire %s_running, %s_done;" % (self.name, self.name,))
-        if not wires_filename:
-            wires_filename = self.name + "_wires.v"
-        dump_file(outdir + wires_filename, s)
+        dump_file(outdir + wires_filename, s, stamp=manifest is None)
 
         s = []
         s.append("  %s u_%s_(" % (self.name, self.name, ))
@@ -381,16 +907,21 @@ level)"""
         s.append("    .reset_n(%s)," % self.reset_n)
         for name, port in self.ports.items():
             s.append("    .%s(%s)," % (name, name, ))
-        s.append("    .seq(%s_seq)," % self.name)
-        s.append("    .start(%s_start)," % self.name)
+        for sig in perf:
+            s.append("    .%s(%s)," % (sig.name, sig.name, ))
+        seq_input, start_input = self._control_inputs()
+        s.append("    .%s(%s_%s)," % (seq_input, self.name, seq_input))
+        s.append("    .%s(%s_%s)," % (start_input, self.name, start_input))
         s.append("    .running(%s_running)," % self.name)
         s.append("    .done(%s_done)" % self.name)
         s.append("  );\n")
 
+        dump_file(outdir + inst_filename, s, stamp=manifest is None)
 
-        if not inst_filename:
-            inst_filename = self.name + "_instance.v"
-        dump_file(outdir + inst_filename, s)
+        if manifest is not None:
+            manifest.update(wires_filename, digest)
+            manifest.update(inst_filename, digest)
+            manifest.save()
 
 
 
@@ -406,60 +937,66 @@ not possible with the more general Bin.  Therefore, with this
 bin, the 'registered_done' condition is realized in a single
 clock cycle regardless.
 
-The onerous is upon the user to ensure the member Sequences assign to
-this bin are of length 1.  Unknown and unpredictable results
-will occur if that is not the case.
-
-Debugging hint: One way to check that all the member Sequences are
-indeed length 1 sequences is to compare the 'done' output signal with
-the 'done_' internal signal.  The internal 'done_' signal is still
-generated based on the done condition of the member Sequences, but it
-is ignored by this Bin and assumed to occur immediately.
-Therefore, this Sequncer generates its output done condition by simply
-sampling the start input.  If the internal 'done_' signal, however is
-not following the output 'done' signal, then it means this assumption
-is not valid and you are going to get unknown results.  Some Sequences
-may behave just fine if they cut short while others may not.
+A Len1Bin is a Bin with 'len1' set to True, so it raises an
+Exception when latency() cannot prove that every member Sequence is of
+length 1, such as a Stall or a Child.  A plain Bin whose Sequences are
+all proven to be of length 1, such as Set, Toggle, Nop, Reset,
+Multiply and Add, becomes a Len1Bin automatically.  A one-shot Trigger
+is not of length 1: its done follows its pulse a cycle later.
+
+The internal 'done_' signal is still generated based on the done
+condition of the member Sequences, but it is ignored by this Bin and
+assumed to occur immediately.  Therefore, this Sequncer generates its
+output done condition by simply sampling the start input.
 """
 
-    def _vlog_gen_done(self):
-        """Here we ignore the state of self.register_done and just produce a registered
-           done output that just samples the start signal.  This effectively ignores
-           the done logic of all the member Sequences, so while the internal done_ signal
-           will still be generated, it should get optimized away by synthesis tools.  Simulation
-           tools will keep the done_ signal, which can be useful to verify that all the 
-           member Sequences are indeed length 1.
-           """
-        s = []
-        s.extend(["  reg done_reg;",
-                  "  assign done = done_reg;",
-                  "  always @(posedge clk or negedge reset_n) begin",
-                  "    if(!reset_n) begin",
-                  "      done_reg <= 0;",
-                  "    end else begin",
-                  "      done_reg <= start;",
-                  "    end",
-                  "  end",
-                  ])
-        return s
-
-
-    def _vlog_gen_running(self):
-        """running and done are the same for this Bin."""
-        return  [ "  assign running = done_reg;", ]
+    def __init__(self, *args, **kw):
+        kw["len1"] = True
+        Bin.__init__(self, *args, **kw)
 
 
-def dump_file(filename, s, comment="//"):
-    f = open(filename, "w")
-    from datetime import datetime
+# The Bins being dumped by Bin.vlog_dump.  Worker processes inherit
+# this list when they are forked, so the Bins never need to be pickled.
+_dump_jobs = []
+def _dump_job(i):
+    bin, filename, stamp, counters, counter_width = _dump_jobs[i]
+    w = Writer.Writer(filename, comment="//", stamp=stamp)
+    bin.vlog_gen_module(w, counters, counter_width)
+    w.close()
     import os
-    f.write("%s %s\n" % (comment, "*"*70))
-    f.write("%s This file was automatically generated on %s by %s.\n" % (comment, datetime.now().strftime("%b %d, %Y at %H:%M"), os.environ["USER"]));
-    f.write("%s DO NOT EDIT THIS FILE BY HAND!!!!  Your changes will be overwritten\n" % (comment, ));
-    f.write("%s %s\n" % (comment, "*"*70))
-    for l in s:
-        f.write(l)
-        f.write("\n")
-    f.close()
-    
-
+    for name, lines in bin.vlog_gen_files():
+        dump_file(os.path.join(os.path.dirname(filename), name), lines, stamp=stamp)
+
+
+def dump_file(filename, s, comment="//", stamp=True):
+    w = Writer.Writer(filename, comment=comment, stamp=stamp)
+    w.extend(s)
+    w.close()
+
+
+_source_digests = {}
+def _source_digest(classes):
+    """Returns a digest of the source code of the modules defining
+    'classes' (and their base classes) along with the core generator
+    modules, so that changing the generator invalidates any structural
+    hashes computed with it."""
+    import sys, os, hashlib
+    modules = set(["seq", __name__, Writer.__name__])
+    for cls in classes:
+        for c in cls.__mro__:
+            modules.add(c.__module__)
+
+    h = hashlib.sha1()
+    for m in sorted(modules):
+        if not _source_digests.has_key(m):
+            filename = getattr(sys.modules.get(m), "__file__", None)
+            if filename is None: # builtins
+                _source_digests[m] = ""
+            else:
+                if filename.endswith(".pyc") and os.path.exists(filename[:-1]):
+                    filename = filename[:-1]
+                f = open(filename, "rb")
+                _source_digests[m] = hashlib.sha1(f.read()).hexdigest()
+                f.close()
+        h.update(m + _source_digests[m])
+    return h.hexdigest()
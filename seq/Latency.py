@@ -0,0 +1,399 @@
+class Latency(object):
+    """A Latency is a closed form expression for the number of clock
+cycles a Sequence takes to run, from the cycle its start is asserted
+until the cycle its done is asserted.  Latencies are built from
+constants and the values of the Signals that parameterize the
+Sequences, such as a Stall count or a Serial term, so
+
+    str(latency)
+
+is the closed form expression in terms of the Signal names, written
+as a verilog expression of their values as each Sequence starts, and
+
+    latency.min
+    latency.max
+
+are the fewest and most cycles it can take over all the values of the
+Signals.  'max' is None when there is no bound, such as while waiting
+on a Sync, and both are None for a Sequence that never completes.  'exact' is True when the Latency is the same for all values
+of the Signals.  eval() gives the Latency for particular values of the
+Signals.
+
+Latencies are made with the functions of this module and add and
+multiply with each other and with ints:
+
+    Latency.param(count) * 2 + 1
+"""
+    # the precedence of the expression for parenthesizing
+    prec = 3
+
+    def __init__(self, min, max):
+        self.min = min
+        self.max = max
+
+    @property
+    def exact(self):
+        return self.min is not None and self.min == self.max
+
+    def eval(self, values):
+        """Returns the number of cycles for the Signal values in the dict
+        'values', keyed on Signal name, or None if it is not known."""
+        raise NotImplementedError()
+
+    def expr(self, prec=0):
+        """Returns the expression as a string, parenthesized if it binds
+        less tightly than an operator of precedence 'prec'."""
+        s = self._expr()
+        if self.prec < prec:
+            return "(%s)" % s
+        return s
+
+    def _later(self, regs):
+        return self
+
+    def __str__(self):
+        return self.expr()
+
+    def __repr__(self):
+        return "<Latency %s min=%s max=%s>" % (self, self.min, self.max)
+
+    def __add__(self, other):
+        return add(self, other)
+
+    __radd__ = __add__
+
+    def __mul__(self, other):
+        return mul(self, other)
+
+    __rmul__ = __mul__
+
+
+def const(value):
+    """A fixed number of cycles."""
+    return Const(value)
+
+def param(sig, zero=None):
+    """The value of the Signal 'sig'.  Signals made from ints are
+    constants.  When 'zero' is given, it is the number of cycles
+    taken when the Signal is 0."""
+    if sig.name.isdigit():
+        value = int(sig.name) & 0xFFFFFFFF
+        if value == 0 and zero is not None:
+            # a literal 0 is a 32 bit constant in the HDL, so counting
+            # to it minus 1 never finishes
+            return Never()
+        return Const(value)
+    return Param(sig, zero)
+
+def wait(name):
+    """Any number of cycles spent waiting on 'name'."""
+    return Wait(name)
+
+def never():
+    """A Sequence that is never done."""
+    return Never()
+
+def add(*terms):
+    terms = [ _latency(t) for t in terms ]
+    if [t for t in terms if isinstance(t, Never)]:
+        return Never()
+    flat = []
+    const = 0
+    for t in terms:
+        for x in (t.terms if isinstance(t, Sum) else [t]):
+            if isinstance(x, Const):
+                const += x.value
+            else:
+                flat.append(x)
+    if not flat:
+        return Const(const)
+    if const:
+        flat.append(Const(const))
+    if len(flat) == 1:
+        return flat[0]
+    return Sum(flat)
+
+def mul(a, b):
+    a, b = _latency(a), _latency(b)
+    if isinstance(a, Never) or isinstance(b, Never):
+        return Never()
+    if isinstance(b, Const):
+        a, b = b, a
+    if isinstance(a, Const):
+        if isinstance(b, Const):
+            return Const(a.value * b.value)
+        if a.value == 1:
+            return b
+    return Product(a, b)
+
+def maximum(*terms):
+    """The largest of 'terms', as for Sequences run in parallel."""
+    terms = [ _latency(t) for t in terms ]
+    if [t for t in terms if isinstance(t, Never)]:
+        return Never()
+    if all([isinstance(t, Const) for t in terms]):
+        return Const(max([t.value for t in terms]))
+    if len(terms) == 1:
+        return terms[0]
+    return Maximum(terms)
+
+def choice(sig, options, default=None, lsb=0, width=None):
+    """One of 'options', indexed by the value of the Signal 'sig', or
+    of its 'width' bits from 'lsb' up when given.  'default' is taken
+    when the value is past the end of 'options'; when None, the value
+    is assumed to stay within 'options'."""
+    if width is None:
+        width = sig.width - lsb
+    options = [ _latency(x) for x in options ]
+    if default is not None:
+        default = _latency(default)
+        if (1 << width) <= len(options):
+            default = None
+    options = options[:1 << width]
+    choices = options + ([ default ] if default is not None else [])
+    strs = [ str(x) for x in choices ]
+    if all([x == strs[0] for x in strs]):
+        return choices[0]
+    return Choice(sig, options, default, lsb, width)
+
+def formula(text, min, max, fn, names=[]):
+    """A data dependent number of cycles given by the expression
+    'text' that ranges from 'min' to 'max' cycles.  'fn' is called
+    with the dict of Signal values to evaluate it.  'names' are the
+    names of the Signals it reads."""
+    return Formula(text, min, max, fn, names)
+
+def later(latency, regs):
+    """'latency' for a Sequence that starts after others have run, so
+    the registers named in 'regs' may no longer hold the values they
+    had at the start.  eval() is None for any part of it that reads
+    them."""
+    return latency._later(set(regs))
+
+
+def _latency(x):
+    if isinstance(x, Latency):
+        return x
+    return Const(x)
+
+def _add(a, b):
+    if a is None or b is None:
+        return None
+    return a + b
+
+def _mul(a, b):
+    if a is None or b is None:
+        return None
+    return a * b
+
+
+class Const(Latency):
+    def __init__(self, value):
+        Latency.__init__(self, value, value)
+        self.value = value
+
+    def eval(self, values):
+        return self.value
+
+    def _expr(self):
+        return str(self.value)
+
+
+class Param(Latency):
+    def __init__(self, sig, zero=None):
+        self.sig = sig
+        self.zero = zero
+        top = (1 << sig.width) - 1
+        if zero is None:
+            Latency.__init__(self, 0, top)
+        else:
+            Latency.__init__(self, min(1, zero) if top else zero, max(top, zero))
+        if zero is not None:
+            self.prec = 0
+
+    def eval(self, values):
+        if not values.has_key(self.sig.name):
+            return None
+        value = values[self.sig.name] & ((1 << self.sig.width) - 1)
+        if value == 0 and self.zero is not None:
+            return self.zero
+        return value
+
+    def _expr(self):
+        if self.zero is None:
+            return self.sig.name
+        return "%s ? %s : %d" % (self.sig.name, self.sig.name, self.zero)
+
+    def _later(self, regs):
+        if self.sig.name in regs:
+            return Stale(self)
+        return self
+
+
+class Never(Latency):
+    def __init__(self):
+        Latency.__init__(self, None, None)
+
+    def eval(self, values):
+        return None
+
+    def _expr(self):
+        return "never"
+
+
+class Wait(Latency):
+    def __init__(self, name):
+        Latency.__init__(self, 0, None)
+        self.name = name
+
+    def eval(self, values):
+        return None
+
+    def _expr(self):
+        return "wait(%s)" % self.name
+
+
+class Sum(Latency):
+    prec = 1
+
+    def __init__(self, terms):
+        Latency.__init__(self, reduce(_add, [t.min for t in terms]), reduce(_add, [t.max for t in terms]))
+        self.terms = terms
+
+    def eval(self, values):
+        return reduce(_add, [t.eval(values) for t in self.terms])
+
+    def _later(self, regs):
+        return add(*[t._later(regs) for t in self.terms])
+
+    def _expr(self):
+        return " + ".join([t.expr(1) for t in self.terms])
+
+
+class Product(Latency):
+    prec = 2
+
+    def __init__(self, a, b):
+        if a.max is None or b.max is None:
+            top = None
+            if a.max == 0 or b.max == 0:
+                top = 0
+        else:
+            top = a.max * b.max
+        Latency.__init__(self, _mul(a.min, b.min), top)
+        self.a = a
+        self.b = b
+
+    def eval(self, values):
+        a, b = self.a.eval(values), self.b.eval(values)
+        if a is None or b is None:
+            return None
+        return a * b
+
+    def _later(self, regs):
+        return mul(self.a._later(regs), self.b._later(regs))
+
+    def _expr(self):
+        return "%s*%s" % (self.a.expr(2), self.b.expr(3))
+
+
+class Maximum(Latency):
+    def __init__(self, terms):
+        tops = [t.max for t in terms]
+        mins = [t.min for t in terms]
+        Latency.__init__(self, None if None in mins else max(mins), None if None in tops else max(tops))
+        self.terms = terms
+
+    def eval(self, values):
+        v = [t.eval(values) for t in self.terms]
+        if None in v:
+            return None
+        return max(v)
+
+    def _later(self, regs):
+        return maximum(*[t._later(regs) for t in self.terms])
+
+    def _expr(self):
+        return "max(%s)" % ", ".join([t.expr() for t in self.terms])
+
+
+class Choice(Latency):
+    prec = 0
+
+    def __init__(self, sig, options, default, lsb, width):
+        choices = options + ([ default ] if default is not None else [])
+        tops = [x.max for x in choices]
+        mins = [ x.min for x in choices if x.min is not None ]
+        Latency.__init__(self, min(mins) if mins else None, None if None in tops else max(tops))
+        self.sig = sig
+        self.options = options
+        self.default = default
+        self.lsb = lsb
+        self.width = width
+
+    def eval(self, values):
+        if not values.has_key(self.sig.name):
+            return None
+        value = (values[self.sig.name] >> self.lsb) & ((1 << self.width) - 1)
+        if value < len(self.options):
+            return self.options[value].eval(values)
+        elif self.default is not None:
+            return self.default.eval(values)
+        return None
+
+    def _later(self, regs):
+        default = self.default
+        if default is not None:
+            default = default._later(regs)
+        latency = choice(self.sig, [x._later(regs) for x in self.options], default, self.lsb, self.width)
+        if self.sig.name in regs:
+            return Stale(latency)
+        return latency
+
+    def _expr(self):
+        s = []
+        last = self.default
+        options = self.options
+        if last is None:
+            last = options[-1]
+            options = options[:-1]
+        name = self.sig.name
+        if self.width != self.sig.width:
+            name = "%s[%d:%d]" % (name, self.lsb + self.width - 1, self.lsb)
+        for i, x in enumerate(options):
+            s.append("(%s == %d) ? %s : " % (name, i, x.expr(1)))
+        return "".join(s) + last.expr(1)
+
+
+class Formula(Latency):
+    def __init__(self, text, min, max, fn, names):
+        Latency.__init__(self, min, max)
+        self.text = text
+        self.fn = fn
+        self.names = names
+
+    def eval(self, values):
+        return self.fn(values)
+
+    def _later(self, regs):
+        if regs.intersection(self.names):
+            return Stale(self)
+        return self
+
+    def _expr(self):
+        return self.text
+
+
+class Stale(Latency):
+    """A Latency reading registers whose values at its start are not
+    known."""
+    def __init__(self, latency):
+        Latency.__init__(self, latency.min, latency.max)
+        self.latency = latency
+        self.prec = latency.prec
+
+    def eval(self, values):
+        return None
+
+    def _expr(self):
+        return self.latency._expr()
@@ -0,0 +1,59 @@
+import os
+
+class Manifest(object):
+    """A Manifest records the structural hash of each file generated
+into an output directory along with when and by whom it was
+generated.  It is used for incremental regeneration: when the hash of
+the Bin that produced a file has not changed since the last
+generation, the file is neither regenerated nor rewritten, so its
+mtime stays put and downstream synthesis and simulation flows do not
+rebuild it.  Because the generation time lives here rather than in
+the generated files themselves, the generated files are a pure
+function of their Bin.
+
+The manifest is a small text file with one line per generated file::
+
+    <filename> <hash> <date> <user>
+"""
+
+    def __init__(self, outdir="", filename=".seq_manifest"):
+        """
+:param outdir: The output directory the manifest describes.  Should include trailing path deliminter.
+:param filename: The name of the manifest file within outdir.
+"""
+        self.outdir = outdir
+        self.filename = outdir + filename
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        f = open(self.filename)
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, digest, date, user = line.split("\t")
+            self.entries[name] = (digest, date, user)
+        f.close()
+
+    def save(self):
+        f = open(self.filename, "w")
+        f.write("# seq generation manifest.  DO NOT EDIT THIS FILE BY HAND!!!!\n")
+        for name in sorted(self.entries):
+            f.write("%s\t%s\t%s\t%s\n" % ((name,) + self.entries[name]))
+        f.close()
+
+    def is_current(self, name, digest):
+        """Returns True when the file 'name' exists and was last
+        generated from something with structural hash 'digest'."""
+        return (self.entries.has_key(name) and
+                self.entries[name][0] == digest and
+                os.path.exists(self.outdir + name))
+
+    def update(self, name, digest):
+        """Records that file 'name' was just generated from something
+        with structural hash 'digest'."""
+        from datetime import datetime
+        self.entries[name] = (digest, datetime.now().strftime("%Y-%m-%dT%H:%M:%S"), os.environ.get("USER", "unknown"))
@@ -1,8 +1,238 @@
 import seq
-from seq import Bin, Sequence as Seq
+from seq import Bin, Latency, Sequence as Seq
 import nitro
 
-class Set(Seq.Set):
+def add_counters(terminal, bin, counters=True, counter_width=32):
+    """Adds a read only register to the terminal for each of the
+performance counters that bin.vlog_dump() adds to 'bin' and the Bins
+below it when it is called with the same 'counters' and
+'counter_width'.  Each register is named after its counter, so the
+terminal reads the outputs of the top Bin.  See Bin.perf_counters.
+
+Example:
+
+    SeqNitro.add_counters(term, top, counters=["prog", "top"], counter_width=16)
+    top.vlog_dump(recurse=True, counters=["prog", "top"], counter_width=16)
+"""
+    for sig in bin.perf_counters(counters, counter_width, recurse=True):
+        terminal.add_child(nitro.Register(name=sig.name,
+                                          comment="Autogenerated performance counter",
+                                          type="int",
+                                          mode="read",
+                                          width=sig.width,
+                                          ))
+
+
+class _InternalChild(Seq.Child):
+    """A programmable Child Sequence whose Signal is driven inside the
+Bin, such as the word a SerialRAM reads from its RAM, rather than by
+an input port."""
+    def link(self, bin, parent, data):
+        Seq.Child.link(self, bin, parent, data)
+        del self.bin.ports[self.child_seq.name]
+
+
+class _Shadow(object):
+    """Double buffers the registers a SeqNitro Sequence adds to the
+terminal.  With 'shadow', the host writes the registers as before, but
+they are shadow copies that the Sequence does not use.  The Sequence
+uses active copies of them that are all loaded from the shadow copies
+in the same cycle, so the host can reprogram the Sequence while it
+runs without it ever seeing some of the registers updated and not the
+others.
+
+When 'shadow' is "commit", a '<name>_commit' trigger register is added
+to the terminal and the active copies are loaded once it is written.
+When 'shadow' is "done", they are loaded each time the Sequence is
+done.  Either way, they are only loaded in a cycle the Sequence is not
+starting and is either done or not running, so a run of the Sequence
+always sees one program.  A commit is held until then."""
+    def _shadow_init(self, shadow):
+        if not(shadow in [ False, "commit", "done" ]):
+            raise Exception("shadow argument of %s must be False, 'commit' or 'done'. You provided %s." % (self.di_reg_name, shadow,))
+        self.shadow = shadow
+        self.shadows = [] # the (active, shadow) Signal pairs
+        if shadow == "commit":
+            self.commit = seq.Signal(name="%s_commit" % (self.di_reg_name,), width=1)
+
+    def _shadow_signal(self, name, width=1, init=0):
+        """Returns the Signal the Sequence uses for the register 'name'
+        the host writes, which is an active copy of it with 'shadow'."""
+        sig = seq.Signal(name=name, width=width, init=init)
+        if not self.shadow:
+            return sig
+        active = seq.Signal(name="%s_active_" % (name,), width=width, init=init)
+        self.shadows.append((active, sig))
+        return active
+
+    def _shadow_name(self, name):
+        return "shadow_%s_%s_" % (self.name, name)
+
+    def _shadow_link(self):
+        """Swaps the ports of the active copies out for those of the
+        shadow copies once the Sequence is linked."""
+        if not self.shadow:
+            return
+        for active, sig in self.shadows:
+            sig.width = active.width
+            if self.bin.ports.has_key(active.name):
+                del self.bin.ports[active.name]
+            self.bin.register_port(seq.Port(sig, "input"))
+        if self.shadow == "commit":
+            self.terminal.add_child(nitro.Register(name=self.commit.name,
+                                                   comment="Autogenerated commit of the shadow registers of %s Sequence" % (self.name,),
+                                                   type="trigger",
+                                                   mode="write",
+                                                   ))
+            self.bin.register_port(seq.Port(self.commit, "input"))
+
+    def _vlog_shadow_declare(self):
+        if not self.shadow:
+            return []
+        s = [ "%s;" % active.vlog_declaration("reg") for active, sig in self.shadows ]
+        s.append("wire %s;" % self._shadow_name("swap"))
+        if self.shadow == "commit":
+            s.append("reg  %s;" % self._shadow_name("pending"))
+        return s
+
+    def _vlog_shadow_logic(self):
+        if not self.shadow:
+            return []
+        swap = self._shadow_name("swap")
+        if self.shadow == "commit":
+            want = "(%s || %s)" % (self.commit.name, self._shadow_name("pending"))
+            s = [ "assign %s = %s && !%s && (!%s || %s);" % (swap, want, self.start, self.running, self.done) ]
+        else:
+            s = [ "assign %s = %s && !%s;" % (swap, self.done, self.start) ]
+        s += [ "always @(posedge clk or negedge reset_n) begin",
+               "  if(!reset_n) begin", ]
+        for active, sig in self.shadows:
+            s.append("    %s <= %d;" % (active.name, active.init))
+        if self.shadow == "commit":
+            s.append("    %s <= 0;" % (self._shadow_name("pending"), ))
+        s.append("  end else begin")
+        if self.shadow == "commit":
+            s.append("    %s <= %s && !%s;" % (self._shadow_name("pending"), want, swap))
+        s.append("    if(%s) begin" % (swap, ))
+        for active, sig in self.shadows:
+            s.append("      %s <= %s;" % (active.name, sig.name))
+        s.extend([ "    end",
+                   "  end",
+                   "end" ])
+        return s
+
+    def _sim_shadow_declare(self, s):
+        if not self.shadow:
+            return
+        for active, sig in self.shadows:
+            s.reg(active.name, active.width, active.init)
+        if self.shadow == "commit":
+            s.reg(self._shadow_name("pending"), 1)
+
+    def _sim_shadow_logic(self, s):
+        if not self.shadow:
+            return
+        swap = self._shadow_name("swap")
+        want = lambda: s.lor(s.get(self.commit.name), s.get(self._shadow_name("pending")))
+        if self.shadow == "commit":
+            s.wire(swap, lambda: s.land(want(), s.lnot(s.get(self.start)), s.lor(s.lnot(s.get(self.running)), s.get(self.done))), 1)
+        else:
+            s.wire(swap, lambda: s.land(s.get(self.done), s.lnot(s.get(self.start))), 1)
+        def load():
+            if self.shadow == "commit":
+                s.assign(self._shadow_name("pending"), s.land(want(), s.lnot(s.get(swap))))
+            with s.if_(s.get(swap)):
+                for active, sig in self.shadows:
+                    s.assign(active.name, s.get(sig.name))
+        s.always(load)
+
+
+class _Program(object):
+    """Compiles programs for a programmable Serial on the host.  A
+program is a list of the names of the child Sequences to run, and its
+image is a tuple of the values of the registers that run it, in the
+order of 'program_regs', which lists the (register, subreg or array
+index) each value is written to.  program_image() caches the images on
+the linked encoding, so the same program is only ever encoded once,
+and program_images() encodes any number of programs at once with NumPy.
+
+Example:
+
+    image = ser.program_image(["abc2", "abc3"])
+    for reg, field, value in ser.program_writes(["abc3", "abc3"], image):
+        ...
+"""
+    def program_image(self, names):
+        """Returns the register image of the list of Sequence names 'names'."""
+        names = tuple(names)
+        key = (self._program_key, names)
+        if not _images.has_key(key):
+            steps = len(self.program_regs) - 1
+            if not(0 < len(names) <= steps):
+                raise Exception("A program of %s must have 1 to %d Sequences, not %d" % (self.name, steps, len(names)))
+            try:
+                codes = [ self.valuemap[x] for x in names ]
+            except KeyError, e:
+                raise Exception("%s cannot run unknown Sequence %s" % (self.name, e.args[0]))
+            _images[key] = tuple(codes + [ 0 ] * (steps - len(names)) + [ len(names) - self._program_term_offset ])
+        return _images[key]
+
+    def program_images(self, programs):
+        """Returns the images of the list of programs 'programs' as the
+        rows of a NumPy array.  The names of all the programs are looked
+        up in the valuemap at once, rather than a program at a time."""
+        import numpy
+        steps = len(self.program_regs) - 1
+        images = numpy.zeros((len(programs), steps + 1), dtype="int64")
+        lens = numpy.array([ len(x) for x in programs ], dtype="int64")
+        bad = (lens < 1) | (lens > steps)
+        if bad.any():
+            raise Exception("A program of %s must have 1 to %d Sequences, not %d" % (self.name, steps, lens[bad][0]))
+        if len(programs) == 0:
+            return images
+        names = numpy.array([ x for program in programs for x in program ])
+        keys = numpy.array(sorted(self.valuemap.keys()))
+        index = numpy.searchsorted(keys, names).clip(max=len(keys) - 1)
+        unknown = keys[index] != names
+        if unknown.any():
+            raise Exception("%s cannot run unknown Sequence %s" % (self.name, names[unknown][0]))
+        codes = numpy.array([ self.valuemap[x] for x in keys ], dtype="int64")
+        # the step of each name within its program
+        starts = numpy.repeat(numpy.cumsum(lens) - lens, lens)
+        images[numpy.repeat(numpy.arange(len(programs)), lens), numpy.arange(len(names)) - starts] = codes[index]
+        images[:, steps] = lens - self._program_term_offset
+        return images
+
+    def program_writes(self, names, current=None):
+        """Returns the (register, field, value) writes that load the
+        program 'names' over the loaded image 'current', which are only
+        those of the registers that change.  If 'current' is None, all
+        of them are returned.  A Serial with shadow="commit" runs them
+        once its '<name>_commit' register is written after them."""
+        image = self.program_image(names)
+        if current is None:
+            current = [ None ] * len(image)
+        return [ reg + (value,) for reg, value, old in zip(self.program_regs, image, current) if value != old ]
+
+    def program_changes(self, images, current):
+        """Returns a NumPy array of the number of register writes it
+        takes to load each row of 'images', from program_images(), over
+        the loaded image 'current'."""
+        import numpy
+        return (numpy.asarray(images) != numpy.asarray(current)).sum(axis=-1)
+
+    def _program_link(self, regs, term_offset):
+        """Sets the registers of the images once the encoding is known.
+        The last one holds the length of the program less 'term_offset'."""
+        self.program_regs = regs
+        self._program_term_offset = term_offset
+        self._program_key = (tuple(regs), term_offset, tuple(sorted(self.valuemap.items())))
+
+# program images keyed on the encoding and the program.  See _Program.
+_images = {}
+
+
+class Set(_Shadow, Seq.Set):
     """This Sequence extends the Seq.Set Sequence and will swap a
 static 'set' dict out for a completely programmable one whose
 default settings are the original static dict.  If a value in
@@ -43,23 +273,25 @@ This adds the following to the DI file:
                        ],
              ),
 """
-    def __init__(self, terminal, name, set, **kw):
+    def __init__(self, terminal, name, set, shadow=False, **kw):
         """
 :param terminal:  A nitro terminal object
 :param name:  The name of this Sequence and the name of the register created in the terminal. 
 :param set:   See Seq.Set documentation
+:param shadow: False, "commit" or "done" to double buffer the register.  See _Shadow.
 """
         kw["name"] = name
         self.init = set
         self.terminal = terminal
         self.di_reg_name = name
+        self._shadow_init(shadow)
         newset = {}
 
         self.dont_swap = []
         for k,v in set.items():
             if type(v) is int:
                 # swap out the ints for seq.Signals
-                newset[k] = seq.Signal(name="%s_%s" % (self.di_reg_name, k,)) # width will get set correctly during linking
+                newset[k] = self._shadow_signal("%s_%s" % (self.di_reg_name, k,), init=v) # width will get set correctly during linking
             else:
                 self.dont_swap.append(k)
                 newset[k] = v
@@ -78,9 +310,24 @@ This adds the following to the DI file:
             self.terminal.add_child(nitro.Register(name=self.di_reg_name, comment="Autogenerated Set register", type="int", mode="write", subregs=subregs))
 
         Seq.Set.link(self, bin, parent, data)
+        self._shadow_link()
+
+    def _vlog_gen_declare(self):
+        return Seq.Set._vlog_gen_declare(self) + self._vlog_shadow_declare()
+
+    def _vlog_gen_logic(self):
+        return Seq.Set._vlog_gen_logic(self) + self._vlog_shadow_logic()
+
+    def _sim_declare(self, s):
+        Seq.Set._sim_declare(self, s)
+        self._sim_shadow_declare(s)
+
+    def _sim_logic(self, s):
+        Seq.Set._sim_logic(self, s)
+        self._sim_shadow_logic(s)
                              
 
-class Serial(Seq.Serial):
+class Serial(_Shadow, _Program, Seq.Serial):
     """This Sequence extends the Seq.Serial Sequence and will swap a
 static serial sequence out for a completely programmable one whose
 default settings are the original static sequence.  It adds registers
@@ -88,31 +335,37 @@ to the terminal as necessary.  See Seq.Serial params.  A
 termination register will be automatically added with a suffix '_stop_num'
 in the  terminal list.  Set this to the number of the last register
 is used by this sequence to know when to terminate."""
-    def __init__(self, terminal, name, subseqs, set={}, extra=0, **kw):
+    def __init__(self, terminal, name, subseqs, set={}, extra=0, shadow=False, **kw):
         """:param extra: int. Number of extra sequences to append to the end of this sequence.
+:param shadow: False, "commit" or "done" to double buffer the registers.  See _Shadow.
 All other params are the same as the Seq.Serial Sequence"""
 
         kw["name"] = name
         self.init = subseqs
         self.di_reg_name = name
         self.terminal = terminal
+        self._shadow_init(shadow)
         newsubseqs = []
+        if shadow:
+            Child = _InternalChild
+        else:
+            Child = Seq.Child
 
         # create the termination Signal
-        terminate = seq.Signal(name="%s_term_num" % (self.di_reg_name,), width=seq.calc_width(len(subseqs)+extra), init=len(subseqs)-1)
+        terminate = self._shadow_signal("%s_term_num" % (self.di_reg_name,), width=seq.calc_width(len(subseqs)+extra), init=len(subseqs)-1)
 
         for i, subseq in enumerate(subseqs):
             if not(type(subseq) is str):
                 raise Exception("Cannot make Sequence %s programmable.  Only strings accepted in subseqs list. You provided a type=%s" % (str(subseq),type(subseq)))
             
             # swap out the strings for Signals
-            psig = seq.Signal(name="%s_%s%d" % (self.di_reg_name, self.di_reg_name, i,), width=1)# correct width is set during linking
-            pseq = Seq.Child(sequence=psig)
+            psig = self._shadow_signal("%s_%s%d" % (self.di_reg_name, self.di_reg_name, i,), width=1)# correct width is set during linking
+            pseq = Child(sequence=psig)
             newsubseqs.append(pseq)
 
         for j in range(extra): # append any extra sequences specified
             i+=1
-            newsubseqs.append(Seq.Child(sequence=seq.Signal(name="%s_%s%d" % (self.di_reg_name, self.di_reg_name, i,), width=1)))
+            newsubseqs.append(Child(sequence=self._shadow_signal("%s_%s%d" % (self.di_reg_name, self.di_reg_name, i,), width=1)))
             self.init.append(0) # append address 0 as the initial condition for the extra registers
 
         Seq.Serial.__init__(self, subseqs=newsubseqs, set=set, term=terminate, **kw)
@@ -142,6 +395,8 @@ All other params are the same as the Seq.Serial Sequence"""
         for i, sig in enumerate(self.subseqs):
             s = sig.child_seq
             s.width = self.sig_width
+            if type(self.init[i]) is str:
+                s.init = self.valuemap[self.init[i]] # the reset value of an active copy
             subregs.append(nitro.SubReg(name=self.di_reg_name+str(i),
                                         init=self.init[i],
                                         width=self.sig_width,
@@ -163,4 +418,175 @@ All other params are the same as the Seq.Serial Sequence"""
                              )
 
         self.terminal.add_child(reg)
+        self._program_link([ (self.di_reg_name, self.di_reg_name+str(i)) for i in range(len(self.subseqs)) ] + [ (self.di_reg_name, "term_num") ], 1)
         Seq.Serial.link(self, bin, parent, data)
+        self._shadow_link()
+
+    def _vlog_gen_declare(self):
+        return Seq.Serial._vlog_gen_declare(self) + self._vlog_shadow_declare()
+
+    def _vlog_gen_logic(self):
+        return Seq.Serial._vlog_gen_logic(self) + self._vlog_shadow_logic()
+
+    def _sim_declare(self, s):
+        Seq.Serial._sim_declare(self, s)
+        self._sim_shadow_declare(s)
+
+    def _sim_logic(self, s):
+        Seq.Serial._sim_logic(self, s)
+        self._sim_shadow_logic(s)
+
+
+class SerialRAM(_Program, Seq.Repeat):
+    """This Sequence is a programmable Serial like the Serial above, but
+it keeps its program in a RAM rather than in a register per step.  The
+RAM is added to the terminal as a single array register, so the host
+reloads a whole program with one burst write and the length of the
+program is not bounded by the number of registers.  Each word of the
+RAM is encoded like the registers of the Serial, with the valuemap
+from the Sequence names.
+
+A '<name>_len' register sets the number of steps to run.  As with the
+'count' of a Repeat, a value of 0 is not valid.  Steps past the end of
+the RAM, when '<name>_len' is larger than 'depth', read a word of 0,
+which runs the first Sequence of the first child Bin.
+
+The Bin takes the writes to the RAM on the '<name>_we',
+'<name>_waddr', and '<name>_wdata' inputs, which the terminal drives
+when the '<name>' register is written.  The default program is
+written to a '<bin>_<name>.hex' file next to the module when the Bin
+is dumped and loaded into the RAM with $readmemh.
+
+Example:
+
+    SerialRAM(terminal=term, name="prog", subseqs=["abc2", "abc3"], depth=64)
+"""
+    _reads_counter = True # to address the RAM
+
+    def __init__(self, terminal, name, subseqs, depth=None, **kw):
+        """:param subseqs: A list of the names of the child Sequences of the default program.
+:param depth: The number of words in the RAM.  If None, it is the length of 'subseqs'.
+"""
+        for subseq in subseqs:
+            if not(type(subseq) is str):
+                raise Exception("Cannot make Sequence %s programmable.  Only strings accepted in subseqs list. You provided a type=%s" % (str(subseq),type(subseq)))
+        if depth is None:
+            depth = len(subseqs)
+        if depth < max(len(subseqs), 1):
+            raise Exception("depth of SerialRAM %s must hold at least the %d subseqs" % (name, len(subseqs)))
+
+        kw["name"] = name
+        self.init = subseqs
+        self.di_reg_name = name
+        self.terminal = terminal
+        self.depth = depth
+
+        self.word = seq.Signal(name="%s_word_" % name, width=1) # correct width is set during linking
+        count = seq.Signal(name="%s_len" % name, width=seq.calc_width(depth+1), init=len(subseqs))
+        Seq.Repeat.__init__(self, subseq=_InternalChild(name="%s_step" % name, sequence=self.word), count=count, **kw)
+
+    def link(self, bin, parent, data):
+        # calculate the width of the programmable sequence
+        if(len(bin.children) <= 1):
+            self.bin_addr_width = 0
+        else:
+            self.bin_addr_width = int(seq.calc_width(len(bin.children)))
+
+        self.sequence_addr_width=1
+        for child in bin.children:
+            w = int(seq.calc_width(len(child.seqs)))
+            if(w > self.sequence_addr_width): self.sequence_addr_width = w
+
+        self.valuemap = {}
+        for j, child in enumerate(bin.children):
+            for i, child_seq in enumerate(child.seqs):
+                self.valuemap[child_seq.name] = (j << self.sequence_addr_width) + i
+
+        self.sig_width = self.bin_addr_width + self.sequence_addr_width
+        self.word.width = self.sig_width
+        self.addr_width = seq.calc_width(self.depth)
+        self.we    = seq.Signal(name="%s_we" % self.di_reg_name, width=1)
+        self.waddr = seq.Signal(name="%s_waddr" % self.di_reg_name, width=self.addr_width)
+        self.wdata = seq.Signal(name="%s_wdata" % self.di_reg_name, width=self.sig_width)
+
+        self.terminal.add_child(nitro.Register(name=self.di_reg_name,
+                                               comment="Autogenerated program memory for SerialRAM %s Sequence" % (self.name,),
+                                               type="int",
+                                               mode="write",
+                                               width=self.sig_width,
+                                               array=self.depth,
+                                               valuemap=self.valuemap,
+                                               ))
+        self.terminal.add_child(nitro.Register(name=self.count.name,
+                                               comment="Autogenerated program length for SerialRAM %s Sequence.  This number controls how many Sequences are executed" % (self.name,),
+                                               type="int",
+                                               mode="write",
+                                               width=self.count.width,
+                                               init=self.count.init,
+                                               ))
+
+        self._program_link([ (self.di_reg_name, i) for i in range(self.depth) ] + [ (self.count.name, None) ], 0)
+        Seq.Repeat.link(self, bin, parent, data)
+        for sig in [ self.we, self.waddr, self.wdata ]:
+            self.bin.register_port(seq.Port(sig, "input"))
+
+    def _latency(self):
+        # each step runs the word read for it, which is only known at
+        # its start, so only the bounds of the steps are known ahead
+        count = Latency.param(self.count, zero=1 << self.counter.width)
+        return count * Latency.later(self._later(self.subseqs[0].latency()), [ self.word.name ])
+
+    def _ram(self, name):
+        return "ram_%s_%s_" % (self.name, name)
+
+    def _vlog_gen_declare(self):
+        return Seq.Repeat._vlog_gen_declare(self) + [
+            "reg  [%d:0] %s [0:%d];" % (self.sig_width-1, self._ram("mem"), self.depth-1),
+            "initial $readmemh(\"%s_%s.hex\", %s);" % (self.bin.name, self.name, self._ram("mem")),
+            "wire [%d:0] %s;" % (self.count.width-1, self._ram("addr")),
+            "wire [%d:0] %s;" % (self.sig_width-1, self.word.name), ]
+
+    def _vlog_gen_logic(self):
+        # the Child holds the word of the loop number, which must be
+        # read ahead as the loop number moves on
+        return Seq.Repeat._vlog_gen_logic(self) + [
+            "/* verilator lint_off WIDTH */",
+            "assign %s = (%s) ? 0 : (%s) ? %s + 1 : %s;" % (self._ram("addr"), self.start, self.subseqs[0].done, self.counter.name, self.counter.name),
+            "assign %s = (%s < %d) ? %s[%s] : 0;" % (self.word.name, self._ram("addr"), self.depth, self._ram("mem"), self._ram("addr")),
+            "/* verilator lint_on WIDTH */",
+            "always @(posedge clk) if(%s) %s[%s] <= %s;" % (self.we.name, self._ram("mem"), self.waddr.name, self.wdata.name), ]
+
+    def _words(self):
+        return [ self.valuemap[x] for x in self.init ] + [ 0 ] * (self.depth - len(self.init))
+
+    @staticmethod
+    def vlog_gen_files(data):
+        files = []
+        for inst in data[SerialRAM]["insts"]:
+            digits = (inst.sig_width + 3) / 4
+            lines = [ "%0*x" % (digits, word) for word in inst._words() ]
+            files.append(("%s_%s.hex" % (inst.bin.name, inst.name), lines))
+        return files
+
+    def _sim_declare(self, s):
+        Seq.Repeat._sim_declare(self, s)
+        for i, word in enumerate(self._words()):
+            s.reg(self._ram("mem%d" % i), self.sig_width, word)
+
+    def _sim_logic(self, s):
+        Seq.Repeat._sim_logic(self, s)
+        s.wire(self._ram("addr"), lambda: s.mux(s.get(self.start), 0, s.get(self.counter.name) + s.get(self.subseqs[0].done)), self.count.width)
+        def word():
+            addr = s.get(self._ram("addr"))
+            v = 0 # past the end of the RAM
+            for i in reversed(range(self.depth)):
+                v = s.mux(addr == i, s.get(self._ram("mem%d" % i)), v)
+            return v
+        s.wire(self.word.name, word, self.sig_width)
+        def write():
+            waddr = s.get(self.waddr.name)
+            with s.if_(s.get(self.we.name)):
+                for i in range(self.depth):
+                    with (s.elif_ if i else s.if_)(waddr == i):
+                        s.assign(self._ram("mem%d" % i), s.get(self.wdata.name))
+        s.always(write)
@@ -1,4 +1,90 @@
+import copy
 import seq
+import Latency
+
+def _and_depth(n):
+    """The levels of logic of a balanced AND or OR of 'n' terms."""
+    return seq.calc_width(n) if n > 1 else 0
+
+def _top_index(seq_):
+    """The index in the seqs of its Bin of the Sequence 'seq_' is under."""
+    while not(seq_.parent is seq_.bin):
+        seq_ = seq_.parent
+    for i, x in enumerate(seq_.bin.seqs):
+        if x is seq_:
+            return i
+
+def _vlog_gen_shared_units(insts, prefix, op):
+    """Generates the multipliers or adders shared by the Multiply or Add
+    Sequences 'insts' of a Bin with 'share_units' set.  Each Sequence
+    of the Bin only runs its own arm of the case(seq) statement, so the
+    instances under different Sequences of the Bin never need the
+    operator at the same time, and 'seq' selects their operands.  Each
+    instance declares the wire its _shared_target() names, and it is
+    assigned from the low bits of the shared result."""
+    def operand(sig):
+        # ints are signed in verilog, so they take a bit more as a
+        # signed operand
+        if sig.name.isdigit():
+            return sig.width+1, "signed"
+        return sig.width, sig.signed
+    units = [] # (operand widths and signs, dict of instances keyed on their Sequence of the Bin)
+    for inst in insts:
+        key = tuple([ operand(x) for x in inst.ab ])
+        top = _top_index(inst)
+        for ukey, members in units:
+            if ukey == key and not(members.has_key(top)):
+                members[top] = inst
+                break
+        else:
+            units.append((key, { top : inst }))
+
+    bin = insts[0].bin
+    sel_width = seq.calc_width(len(bin.seqs))
+    s = [ "  /* verilator lint_off WIDTH */", ]
+    for u, (key, members) in enumerate(units):
+        name = "shared_%s_%d_" % (prefix, u)
+        tops = sorted(members.keys())
+        for j in range(2):
+            operands = [ members[top].ab[j].name for top in tops ]
+            last = operands[-1]
+            if operands.count(last) == len(operands):
+                mux = last
+            elif bin.mux_tree:
+                values = [ last ] * len(bin.seqs)
+                for top, x in zip(tops, operands):
+                    values[top] = x
+                mux = seq.vlog_mux_tree("seq", sel_width, values, last, sel_width)
+            else:
+                mux = "".join([ "(seq==%d) ? %s : " % (top, x) for top, x in zip(tops, operands) if x != last ]) + last
+            width, signed = key[j]
+            s.append("  wire %s [%d:0] %s%s_ = %s;" % (signed, width-1, name, "ab"[j], mux))
+        targets = [ members[top]._shared_target() for top in tops ]
+        width = max([ w for target, w in targets ])
+        s.append("  wire [%d:0] %s = %sa_ %s %sb_;" % (width-1, name, name, op, name))
+        for target, w in targets:
+            s.append("  assign %s = %s[%d:0];" % (target, name, w-1))
+    s.append("  /* verilator lint_on WIDTH */" )
+    return s
+
+def _walk(seq_):
+    """The Sequence 'seq_' and all the Sequences under it."""
+    seqs = [ seq_ ]
+    for x in seq_.subseqs:
+        seqs.extend(_walk(x))
+    return seqs
+
+def _check_unroll(seq_):
+    """Raises an Exception if the unlinked Sequence 'seq_' cannot be
+    copied into the lanes of an unrolled Repeat."""
+    if not(isinstance(seq_, Sequence)):
+        raise Exception("Repeat cannot unroll %s as it would share a child Bin between the lanes" % (seq_,))
+    if isinstance(seq_, Child):
+        raise Exception("Repeat cannot unroll %s as it would share a child Bin between the lanes" % (seq_,))
+    if seq_._export_sigs:
+        raise Exception("Repeat cannot unroll %s as each lane would export the same signals" % (seq_,))
+    for x in seq_.subseqs:
+        _check_unroll(x)
 
 def auto_dispatch(f):
     def wrapper(self, *args, **kw):
@@ -9,6 +95,22 @@ def auto_dispatch(f):
         else:
             indent = 0
 
+        # strip out the writer keyword if it is present.  When a
+        # seq.Writer is provided, the lines are written into it at the
+        # requested indent rather than returned.  The Sequence still
+        # builds them, and those of its sub-Sequences, as a list.
+        if kw.has_key("writer"):
+            writer = kw["writer"]
+            del kw["writer"]
+        else:
+            writer = None
+
+        if writer is not None:
+            with writer.indent(indent):
+                writer.extend(f(self, *args, **kw))
+                writer.extend(getattr(self, "_" + f.func_name)(*args, **kw))
+            return None
+
         s = f(self, *args, **kw)
         s.extend(getattr(self, "_" + f.func_name)(*args, **kw))
 
@@ -19,6 +121,26 @@ def auto_dispatch(f):
         return s
     return wrapper
 
+def _structure(v, bin):
+    """Describes value 'v' from a Sequence in 'bin' as a nested tuple.
+    See Sequence.structure_key()."""
+    if isinstance(v, Sequence):
+        if v.bin is bin:
+            return v.structure_key()
+        return ("ref", v.bin.name, v.name) # a Sequence in another Bin
+    elif isinstance(v, seq.Signal):
+        return ("Signal", v.name, v.width, v.init, v.signed)
+    elif type(v) in [list, tuple]:
+        return tuple([_structure(x, bin) for x in v])
+    elif type(v) is dict:
+        return tuple(sorted([(_structure(k, bin), _structure(x, bin)) for k, x in v.items()]))
+    elif type(v) in [str, int, long, float, bool, type(None)]:
+        return v
+    elif hasattr(v, "name"):
+        return (type(v).__name__, v.name) # Bins and other named objects
+    else:
+        return type(v).__name__
+
 ################################################################################
 class Sequence(object):
     """A Sequence is an abstract class that provides a common interface
@@ -118,6 +240,30 @@ same amount of time but not actually set the registers.
     def __repr__(self):
         return "<%s %s>" % (type(self), self.name)
 
+    def structure_key(self):
+        """Returns a nested tuple that completely describes the
+        structure of this linked Sequence and its sub-Sequences.  Two
+        Sequences with equal keys generate identical HDL.  Used by
+        Bin.structural_hash().  The default implementation walks the
+        attributes of the Sequence, so derived classes only need to
+        override this if they keep state that does not affect the
+        generated HDL or that cannot be described this way."""
+        items = []
+        for k, v in sorted(self.__dict__.items()):
+            if k in ["bin", "parent"]:
+                continue
+            items.append((k, _structure(v, self.bin)))
+        return (type(self).__module__, type(self).__name__, tuple(items))
+
+    def _rename(self, name):
+        """Renames this Sequence before it is linked, along with the
+        names of the signals derived from its name."""
+        self.name = name
+        self.start  = "seq_%s_start_" % self.name
+        self.done   = "seq_%s_done_" % self.name
+        self.running= "seq_%s_running_" % self.name
+        self._unique_names = [ self.name ]
+
     def register_unique_names(self, names):
         """:param names: A dict keyed on strings of unique names.  Subclasses of this module should set the self._unique_names list so this function can register them.  If a unique name is already registered, then this function will raise and Exception.  Recursively calls this method on Children as well"""
 
@@ -187,6 +333,10 @@ same amount of time but not actually set the registers.
     def vlog_gen_inactive(self):
         return []
 
+    @auto_dispatch
+    def vlog_gen_hold(self):
+        return []
+
     @auto_dispatch
     def vlog_gen_running(self):
         return []
@@ -198,6 +348,13 @@ same amount of time but not actually set the registers.
     def vlog_gen_static_logic(data):
         return []
 
+    @staticmethod
+    def vlog_gen_files(data):
+        """Returns a list of (filename, lines) of the files the HDL of
+        the Sequences of this type reads, such as ROM images.  Bin
+        writes them next to the module when it is dumped."""
+        return []
+
     # The following methods provide default implementations that can
     # be overridden as necessary
     def _vlog_gen_declare(self):
@@ -213,9 +370,9 @@ same amount of time but not actually set the registers.
         return []
 
     def _vlog_gen_start_wire(self, start):
-        s = [ "wire %s = %s;" % (self.start, start) ]
+        s = [ self.bin.wires.wire(self.start, start) ]
         for i, seq in enumerate(self.subseqs):
-            s.extend(seq.vlog_gen_start_wire(start=start, indent=0))
+            s.extend(seq.vlog_gen_start_wire(start=self.start, indent=0))
         return s
 
     def _vlog_gen_inactive(self):
@@ -224,9 +381,126 @@ same amount of time but not actually set the registers.
             s.extend(seq.vlog_gen_inactive(indent=0))
         return s
 
+    def _vlog_gen_hold(self):
+        """Holds the registers that _vlog_gen_inactive() clears at
+        their current value.  Sequences that override
+        _vlog_gen_inactive() must override this as well."""
+        s = [ ]
+        for seq in self.subseqs:
+            s.extend(seq.vlog_gen_hold(indent=0))
+        return s
+
     def _vlog_gen_running(self):
         return [ "if(%s) %s <= 1; else if(%s || start) %s <= 0;" % (self.start, self.running, self.done, self.running)]
 
+    # The following sim functions mirror the vlog functions above and
+    # are used by seq.Sim to simulate the Sequence without generating
+    # any HDL.  's' is the simulation context (a seq.Sim.BinSim).  As
+    # with the vlog functions, these should not be overridden.  Derived
+    # classes implement the same function prefixed with an '_'.
+    # Register reset values are given when they are declared, so there
+    # is no sim equivalent of vlog_gen_reset().
+
+    def sim_declare(self, s):
+        self._sim_declare(s)
+
+    def sim_logic(self, s):
+        for name, sig in self._export_sigs.items():
+            s.wire(sig.name, lambda name=name: s.get(name))
+        self._sim_logic(s)
+
+    def sim_seq(self, s):
+        self._sim_seq(s)
+
+    def sim_start_wire(self, s, start):
+        """:param start: A function returning the value of this Sequence's start"""
+        self._sim_start_wire(s, start)
+
+    def sim_inactive(self, s):
+        self._sim_inactive(s)
+
+    def sim_hold(self, s):
+        self._sim_hold(s)
+
+    def sim_running(self, s):
+        self._sim_running(s)
+
+    def sim_done(self, s):
+        return self._sim_done(s)
+
+    @staticmethod
+    def sim_static_logic(s, data):
+        pass
+
+    def _sim_declare(self, s):
+        pass
+
+    def _sim_logic(self, s):
+        pass
+
+    def _sim_seq(self, s):
+        pass
+
+    def _sim_start_wire(self, s, start):
+        s.wire(self.start, start, 1)
+        for seq in self.subseqs:
+            seq.sim_start_wire(s, lambda: s.get(self.start))
+
+    def _sim_inactive(self, s):
+        for seq in self.subseqs:
+            seq.sim_inactive(s)
+
+    def _sim_hold(self, s):
+        for seq in self.subseqs:
+            seq.sim_hold(s)
+
+    def _sim_running(self, s):
+        with s.if_(s.get(self.start)):
+            s.assign(self.running, 1)
+        with s.elif_(s.lor(s.get(self.done), s.get("start"))):
+            s.assign(self.running, 0)
+
+    def _sim_done(self, s):
+        raise NotImplementedError("%s does not support simulation" % (self, ))
+
+    def _sim_dryrun(self, s):
+        """Returns a block that is taken unless this Sequence is
+        doing a dryrun.  See the 'dryrun' argument."""
+        if(self.dryrun):
+            return s.if_(s.lnot(s.value(self.dryrun)))
+        return s.if_(1)
+
+    def latency(self):
+        """Returns the seq.Latency of this linked Sequence: the number of
+        clock cycles from the cycle its start is asserted until the
+        cycle its done is asserted.  This assumes no other Sequence
+        interrupts it, such as by restarting a shared counter."""
+        return self._latency()
+
+    def _latency(self):
+        raise NotImplementedError("%s does not support latency analysis" % (self, ))
+
+    def done_depth(self):
+        """Returns an estimate of the levels of logic from a register to
+        the done signal of this linked Sequence.  Each operator in the
+        done logic counts as a level, except that wide ANDs and ORs
+        count as a balanced tree, and the done of a child Bin that is
+        not registered counts with the levels inside the child."""
+        return self._done_depth()
+
+    def _done_depth(self):
+        # a gate on the done of the subseqs
+        return 1 + max([0] + [x.done_depth() for x in self.subseqs])
+
+    def _later(self, latency):
+        """Returns 'latency' for when it starts after other Sequences
+        have had a chance to change the registers of this Bin or of its
+        children."""
+        regs = self.bin.regs.keys()
+        for bin in self.bin.descendants():
+            regs.extend(bin.regs.keys())
+        return Latency.later(latency, regs)
+
     def find_reg(self, reg):
         """This will lookup the reg and return the Signal reference to it.
 :param reg: str"""
@@ -237,7 +511,8 @@ same amount of time but not actually set the registers.
         it is an internal register only.  
 :param reg: str"""
         r = self.find_reg(reg)
-        del self.bin.ports[reg]
+        if self.bin.ports.has_key(reg): # unless another Sequence uses it too
+            del self.bin.ports[reg]
         return r
             
 ################################################################################
@@ -313,6 +588,25 @@ You can also set them to Signals.  For example:
 
     def _vlog_gen_done(self):
         return self.running
+
+    def _sim_seq(self, s):
+        if(self.mapping):
+            with self._sim_dryrun(s):
+                with s.if_(s.get(self.done if self.set_at_end else self.start)):
+                    for sig, val in self.mapping.iteritems():
+                        s.assign(sig, s.value(val))
+
+    def _sim_running(self, s):
+        s.assign(self.running, s.get(self.start))
+
+    def _sim_done(self, s):
+        return s.get(self.running)
+
+    def _latency(self):
+        return Latency.const(1)
+
+    def _done_depth(self):
+        return 0 # running is a register
 ################################################################################
 
 ################################################################################
@@ -425,6 +719,41 @@ class Stall(Set):
                   "  end\n",
                   ])
         return s
+
+    def _sim_done(self, s):
+        return s.get(self.running) & s.get("stall_done_%s_" % self.name)
+
+    def _sim_running(self, s):
+        Sequence._sim_running(self, s)
+
+    def _latency(self):
+        # stall_count_ restarts at 0 the cycle after start and is
+        # compared against count-1, so a count of 0 waits for the
+        # shared counter to saturate
+        return Latency.param(self.stop_count, zero=1 << self.bin._seqdata[Stall]["max_width"])
+
+    def _done_depth(self):
+        return 2 # a compare and an AND with running
+
+    @staticmethod
+    def sim_static_logic(s, data):
+        width = data[Stall]["max_width"]
+        insts = data[Stall]["insts"]
+        s.reg("stall_count_", width)
+        s.wire("start_stall_count_", lambda: s.lor(*[s.get(inst.start) for inst in insts]), 1)
+        def next_stall_count():
+            count = s.get("stall_count_")
+            return s.mux(s.get("start_stall_count_"), 0, s.mux(count == s.mask(width), count, count + 1))
+        s.wire("next_stall_count_", next_stall_count, width)
+        def stall_stop(inst):
+            # the subtraction is as wide as the widest operand
+            stop, stop_width, signed = s.operand(inst.stop_count)
+            w = max(width, stop_width, inst.stop_count.width)
+            return (stop - 1) & s.mask(w)
+        for inst in insts:
+            s.wire("stall_done_%s_" % inst.name, lambda inst=inst: s.get("stall_count_") >= stall_stop(inst), 1)
+        s.always(lambda: s.assign("stall_count_", s.get("next_stall_count_")))
+        s.counter("stall_count_", lambda: [ s.mask(width) ] + [ stall_stop(inst) for inst in insts ])
 ################################################################################
 
 ################################################################################
@@ -532,6 +861,64 @@ active low.
     def vlog_gen_static_logic(data):
         return []
 
+    def _sim_seq(self, s):
+        if not(self.stop_count is None):
+            Stall._sim_seq(self, s)
+        if(self.active_high): 
+            hi = s.mask(self.reg.width)
+            lo = 0
+        else:
+            hi = 0
+            lo = s.mask(self.reg.width)
+
+        with self._sim_dryrun(s):
+            with s.if_(s.get(self.start)):
+                s.assign(self.reg.name, hi)
+            if self.stop_count is None:
+                with s.else_():
+                    s.assign(self.reg.name, lo)
+            else:
+                with s.elif_(s.get(self.done)):
+                    s.assign(self.reg.name, lo)
+
+    def _sim_running(self, s):
+        if self.stop_count is None:
+            if(self.active_high):
+                active = 1
+            else:
+                active = 0
+            s.assign(self.running, s.lor(s.get(self.start), s.get(self.reg.name) == active))
+        else:
+            Stall._sim_running(self, s)
+
+    def _sim_done(self, s):
+        if self.stop_count is None:
+            if(self.active_high):
+                active = 0
+            else:
+                active = 1
+            return s.land(s.get(self.running), s.get(self.reg.name) == active)
+        else:
+            return Stall._sim_done(self, s)
+
+    def _latency(self):
+        if self.stop_count is None:
+            # one cycle to set the reg and one to clear it, but running
+            # only stays up while the reg is a single active bit
+            if self.reg.width == 1:
+                latency = Latency.const(2)
+            else:
+                latency = Latency.never()
+            if self.dryrun:
+                # the reg is left inactive, which is done right away
+                return Latency.choice(seq.Signal(self.dryrun, width=1), [ latency, 1 ])
+            return latency
+        return Stall._latency(self)
+
+    @staticmethod
+    def sim_static_logic(s, data):
+        pass
+
 ################################################################################
 
 ################################################################################
@@ -565,6 +952,23 @@ class Toggle(Sequence):
 
     def _vlog_gen_done(self):
         return self.running
+
+    def _sim_seq(self, s):
+        with self._sim_dryrun(s):
+            with s.if_(s.get(self.start)):
+                s.assign(self.reg.name, s.get(self.reg.name) ^ s.mask(self.reg.width))
+
+    def _sim_running(self, s):
+        s.assign(self.running, s.get(self.start))
+
+    def _sim_done(self, s):
+        return s.get(self.running)
+
+    def _latency(self):
+        return Latency.const(1)
+
+    def _done_depth(self):
+        return 0
 ################################################################################
 
 
@@ -610,6 +1014,21 @@ sync are high.  Otherwise waits until they are all low.
 
     def _vlog_gen_running(self):
         return [ "if(%s) %s <= 1; else if(%s || start) %s <= 0;" % (self.start, self.running, self.done, self.running)]
+
+    def _sim_done(self, s):
+        if(self.active_high):
+            return s.get(self.running) & (s.get(self.sync.name) == s.mask(self.sync.width))
+        else:
+            return s.get(self.running) & (s.get(self.sync.name) == 0)
+
+    def _sim_running(self, s):
+        Sequence._sim_running(self, s)
+
+    def _latency(self):
+        return Latency.wait(self.sync.name) + 1
+
+    def _done_depth(self):
+        return _and_depth(self.sync.width) + 1
 ################################################################################
 
 ################################################################################
@@ -657,7 +1076,7 @@ programmable"""
             try:
                 self.child_bin = bin.get_child_bin(self.child_seq)
                 self.assign = [ "child_%s_seq_ <= child_%s_%s_;" % (self.child_bin.name, self.child_bin.name, self.child_seq)]
-                self.bin.add_child_start(self.child_bin.name, self.start)
+                self.bin.add_child_start(self.child_bin.name, self.start, self)
                 self.done_name = "child_%s_done_" % self.child_bin.name
             except KeyError:
                 raise Exception("Cannot find requested child sequence by name %s in bin" % self.child_seq)
@@ -665,7 +1084,7 @@ programmable"""
             # When child_seq is a sequence, no need to lookup beceause have the sequence
             self.child_bin = self.child_seq.bin
             self.assign = [ "child_%s_seq_ <= child_%s_%s_;" % (self.child_bin.name, self.child_bin.name, self.child_seq.name)]
-            self.bin.add_child_start(self.child_bin.name, self.start)
+            self.bin.add_child_start(self.child_bin.name, self.start, self)
             self.done_name = "child_%s_done_" % self.child_bin.name
 
         elif type(self.child_seq) is seq.Signal:
@@ -699,7 +1118,7 @@ programmable"""
             if(bin_addr_width == 0):
                 self.child_bin = bin.children[0]
                 self.assign = [ "child_%s_seq_ <= %s;" % (self.child_bin.name, self.child_seq.name)]
-                self.bin.add_child_start(self.child_bin.name, self.start)
+                self.bin.add_child_start(self.child_bin.name, self.start, self)
                 self.done_name = "child_%s_done_" % self.child_bin.name
 
             else:
@@ -717,7 +1136,7 @@ programmable"""
                     self.edeclare.append("wire %s;" % ( start,))
                     self.elogic.append("assign %s = %s & (%s[%d:%d] == %d);" % (start, self.start, self.child_seq.name, self.child_seq.width-1, self.child_seq.width-bin_addr_width, i))
                     done.append("(child_%s_done_ & (seq_%s_child_sel_ == %d))" % (child.name, self.name, i, ))
-                    self.bin.add_child_start(child.name, start)
+                    self.bin.add_child_start(child.name, start, self)
                 self.elogic.append("assign seq_%s_done_sel_ = %s;" % (self.name, " || ".join(done)))
                 self.done_name = "seq_%s_done_sel_" % self.name
                 self.assign.append("endcase")
@@ -756,11 +1175,112 @@ programmable"""
 
     def _vlog_gen_seq(self):
         return self.assign + Set._vlog_gen_seq(self)
+
+    def _vlog_child_code(self, child):
+        """The seq code this Sequence runs in the child Bin 'child',
+        which a Bin with lookahead feeds to the child as it starts."""
+        if type(self.child_seq) is seq.Signal:
+            if len(self.bin.children) <= 1:
+                return self.child_seq.name
+            return "seq_%s_seq_sel_[%d:0]" % (self.name, seq.calc_width(len(child.seqs))-1)
+        return "child_%s_%s_" % (child.name, self._child_seq_name())
+
+    def _child_seq_name(self):
+        if type(self.child_seq) is str:
+            return self.child_seq
+        return self.child_seq.name
+
+    def _sim_child_code(self, s, child):
+        if type(self.child_seq) is seq.Signal:
+            if len(self.bin.children) <= 1:
+                return s.get(self.child_seq.name)
+            return s.get("seq_%s_seq_sel_" % self.name)
+        return [x.name for x in child.seqs].index(self._child_seq_name())
+
+    def _sim_logic(self, s):
+        if type(self.child_seq) is seq.Signal and len(self.bin.children) > 1:
+            # see the programmable state selection logic in link()
+            sig = self.child_seq
+            bin_addr_width = seq.calc_width(len(self.bin.children))
+            child_sel = "seq_%s_child_sel_" % self.name
+            s.wire(child_sel, lambda: s.get(sig.name) >> (sig.width-bin_addr_width), bin_addr_width)
+            s.wire("seq_%s_seq_sel_" % self.name, lambda: s.get(sig.name), sig.width-bin_addr_width)
+            for i, child in enumerate(self.bin.children):
+                s.wire("%s%s_" % (self.start, child.name), lambda i=i: s.get(self.start) & (s.get(child_sel) == i), 1)
+            s.wire(self.done_name, lambda: s.lor(*[s.get("child_%s_done_" % child.name) & (s.get(child_sel) == i) for i, child in enumerate(self.bin.children)]), 1)
+        Set._sim_logic(self, s)
+
+    def _sim_done(self, s):
+        not_detached_done = s.land(s.get(self.done_name), s.get(self.running))
+        if self.detach is True:
+            return Set._sim_done(self, s)
+        elif self.detach is False:
+            return not_detached_done
+        else:
+            return s.mux(s.get(self.detach.name), Set._sim_done(self, s), not_detached_done)
+
+    def _sim_running(self, s):
+        Sequence._sim_running(self, s)
+
+    def _sim_seq(self, s):
+        if type(self.child_seq) is seq.Signal:
+            if len(self.bin.children) <= 1:
+                s.assign("child_%s_seq_" % self.child_bin.name, s.get(self.child_seq.name))
+            else:
+                child_sel = s.get("seq_%s_child_sel_" % self.name)
+                for i, child in enumerate(self.bin.children):
+                    with (s.elif_ if i else s.if_)(child_sel == i):
+                        s.assign("child_%s_seq_" % child.name, s.get("seq_%s_seq_sel_" % self.name))
+        else:
+            s.assign("child_%s_seq_" % self.child_bin.name, self._sim_child_code(s, self.child_bin))
+        Set._sim_seq(self, s)
+
+    def _latency(self):
+        # the child sees the start a cycle later through child_*_start_
+        # unless the Bin starts it with lookahead
+        handoff = int(not self.bin.lookahead)
+        if type(self.child_seq) is seq.Signal:
+            sig = self.child_seq
+            def child_latency(child, lsb):
+                w = seq.calc_width(len(child.seqs))
+                return handoff + Latency.choice(sig, [ child._latency(x) for x in child.seqs ], child._latency(None), lsb=lsb, width=w)
+            if len(self.bin.children) <= 1:
+                attached = child_latency(self.child_bin, 0)
+            else:
+                # the MSBs select the child Bin, which is assumed to exist
+                bin_addr_width = seq.calc_width(len(self.bin.children))
+                lsb = sig.width - bin_addr_width
+                attached = Latency.choice(sig, [ child_latency(child, 0) for child in self.bin.children ], lsb=lsb, width=bin_addr_width)
+        else:
+            name = self._child_seq_name()
+            child_seq = [x for x in self.child_bin.seqs if x.name == name][0]
+            attached = handoff + self.child_bin._latency(child_seq)
+
+        if self.detach is True:
+            return Set._latency(self)
+        elif self.detach is False:
+            return attached
+        else:
+            return Latency.choice(self.detach, [ attached, Set._latency(self) ])
+
+    def _done_depth(self):
+        if type(self.child_seq) is seq.Signal and len(self.bin.children) > 1:
+            # the done of the selected child Bin
+            children = self.bin.children
+            depth = max([x.done_depth() for x in children]) + 1 + _and_depth(len(children))
+        else:
+            depth = self.child_bin.done_depth()
+        if self.detach is True:
+            return Set._done_depth(self)
+        elif self.detach is False:
+            return depth + 1
+        return depth + 2 # a ternary on detach
 ################################################################################
 
 ################################################################################
 class Serial(Set):
-    """Runs provided Sequences in list 'subseqs' in series.  Sets via the 'set' dict"""
+    """Runs provided Sequences in list 'subseqs' in series.  Sets via the 'set' dict.
+    See Microcode for long programs of Sets, Stalls and Triggers."""
     def __init__(self, subseqs, set={}, term=None, **kw):
         """:param subseqs: List of Sequences to run serially.
 
@@ -780,6 +1300,11 @@ run.  When set to 1, the first 2 Sequences will run, etc.
         self.next_addr = "next_%s" % self.addr
         self.term = term
 
+    def _rename(self, name):
+        Set._rename(self, name)
+        self.addr = "%s_addr_" % self.name
+        self.next_addr = "next_%s" % self.addr
+
     def link(self, bin, parent, data):
         Set.link(self, bin, parent, data)
         if self.term:
@@ -811,13 +1336,12 @@ run.  When set to 1, the first 2 Sequences will run, etc.
         return s + Set._vlog_gen_reset(self)
 
     def _vlog_gen_start_wire(self, start):
-        s = [ "wire %s = %s;" % (self.start, start) ]
-        for i, seq in enumerate(self.subseqs):
-            s.extend(seq.vlog_gen_start_wire(start=start, indent=0))
-            if self.term:
-                start = "%s & (%s==%d) & (!seq_%s_term_)" % (seq.done, self.addr, i, self.name)
-            else:
-                start = "%s & (%s==%d)" % (seq.done, self.addr, i)
+        s = [ self.bin.wires.wire(self.start, start) ]
+        start = self.start
+        width = seq.calc_width(len(self.subseqs))
+        for i, subseq in enumerate(self.subseqs):
+            s.extend(subseq.vlog_gen_start_wire(start=start, indent=0))
+            start = seq.vlog_and(subseq.done, seq.vlog_eq(self.addr, width, i), "!seq_%s_term_" % self.name if self.term else "1")
         return s
 
     def _vlog_gen_seq(self):
@@ -846,6 +1370,354 @@ run.  When set to 1, the first 2 Sequences will run, etc.
         for seq in self.subseqs:
             s.extend(seq.vlog_gen_inactive(indent=0))
         return s
+
+    def _vlog_gen_hold(self):
+        s = [ "%s <= %s;" % (self.addr, self.addr) ]
+        for seq in self.subseqs:
+            s.extend(seq.vlog_gen_hold(indent=0))
+        return s
+
+    def _sim_declare(self, s):
+        s.reg(self.addr, seq.calc_width(len(self.subseqs)))
+        Set._sim_declare(self, s)
+
+    def _sim_logic(self, s):
+        width = seq.calc_width(len(self.subseqs))
+        if(len(self.subseqs)>1):
+            def next_addr():
+                addr = s.get(self.addr)
+                return s.mux(s.get(self.start), 0, s.mux(s.lor(*[s.get(x.start) for x in self.subseqs[1:]]), addr + 1, addr))
+            s.wire(self.next_addr, next_addr, width)
+        else:
+            s.wire(self.next_addr, lambda: s.get(self.addr), width)
+        if self.term:
+            s.wire("seq_%s_term_" % self.name, lambda: s.get(self.addr) >= s.get(self.term.name), 1)
+        Set._sim_logic(self, s)
+
+    def _sim_start_wire(self, s, start):
+        s.wire(self.start, start, 1)
+        start = lambda: s.get(self.start)
+        for i, seq in enumerate(self.subseqs):
+            seq.sim_start_wire(s, start)
+            if self.term:
+                start = lambda i=i, seq=seq: s.get(seq.done) & (s.get(self.addr) == i) & s.lnot(s.get("seq_%s_term_" % self.name))
+            else:
+                start = lambda i=i, seq=seq: s.get(seq.done) & (s.get(self.addr) == i)
+
+    def _sim_seq(self, s):
+        Set._sim_seq(self, s)
+        next_addr = s.get(self.next_addr)
+        s.assign(self.addr, next_addr)
+        for i, seq in enumerate(self.subseqs):
+            with (s.elif_ if i else s.if_)(next_addr == i):
+                seq.sim_seq(s)
+
+    def _sim_done(self, s):
+        if self.term:
+            return s.land(s.get(self.running), s.lor(s.land(s.lor(*[s.get(x.done) for x in self.subseqs]), s.get("seq_%s_term_" % self.name)), s.get(self.subseqs[-1].done)))
+        else:
+            return s.land(s.get(self.subseqs[-1].done), s.get(self.running))
+
+    def _sim_running(self, s):
+        Sequence._sim_running(self, s)
+
+    def _sim_inactive(self, s):
+        s.assign(self.addr, 0)
+        Set._sim_inactive(self, s)
+
+    def _sim_hold(self, s):
+        s.assign(self.addr, s.get(self.addr))
+        Set._sim_hold(self, s)
+
+    def _latency(self):
+        # each subseq starts the cycle the previous one is done
+        sums = []
+        total = Latency.const(0)
+        for i, x in enumerate(self.subseqs):
+            latency = x.latency()
+            if i:
+                latency = self._later(latency)
+            total = total + latency
+            sums.append(total)
+        if self.term:
+            return Latency.choice(self.term, sums, total)
+        return total
+
+    def _done_depth(self):
+        last = self.subseqs[-1].done_depth()
+        if self.term:
+            # any subseq done gated by the term, or the last one done
+            any = max([x.done_depth() for x in self.subseqs]) + _and_depth(len(self.subseqs)) + 1
+            return max(any, last) + 2
+        return last + 1
+################################################################################
+
+################################################################################
+class Microcode(Sequence):
+    """Runs a long program of Set, Nop, Stall and Trigger Sequences in
+series like a Serial, but compiles the program into a ROM rather than
+into a state for each step.  Each word of the ROM holds the duration
+of a step and the register values it writes, and the Sequence steps
+through the ROM with a program counter and a duration counter, so the
+logic stays the same size no matter how many steps the program has.
+Use it in place of a Serial when the program runs to hundreds of steps.
+
+The ROM is written to a '<bin>_<name>.hex' file next to the module
+when the Bin is dumped and is loaded with $readmemh, so the file must be
+found at that path relative to where the HDL is simulated or
+synthesized.
+
+Only programs known when the HDL is generated compile into the ROM.
+The steps may be Set and Nop Sequences setting registers to ints, Stalls
+with int counts and sets, Triggers with int counts (one-shot Triggers
+must be on a register of width 1), and Serials and Microcodes of these
+without a 'term'.  None of them may use 'dryrun' or export signals.
+The register values a Stall with 'set_at_end' sets, and those a counted
+Trigger restores when its pulse ends, are written as the next step
+starts.
+
+Example::
+
+    Microcode([ Set(dict(X=1)), Stall(10, set=dict(Y=2)), Trigger("Z", count=3) ])
+"""
+    def __init__(self, subseqs, set={}, **kw):
+        """:param subseqs: List of Sequences to run serially.
+
+:param set: A dict of registers and the ints to set them to when the
+Sequence starts.  See Set.
+"""
+        if not(type(subseqs) in [ list, tuple ]):
+            raise Exception("'subseqs' argument must be a list or tuple")
+        if not(type(set) is dict):
+            raise Exception("'set' argument must be a dict")
+        Sequence.__init__(self, **kw)
+        self._source = subseqs
+        self._set = set
+
+    def link(self, bin, parent, data):
+        Sequence.link(self, bin, parent, data)
+        # the source Sequences are never linked, so they are dropped
+        # once they are compiled into steps
+        steps = self._flatten(self._source)
+        del self._source
+        if not steps:
+            raise Exception("Microcode %s has no steps" % (self.name, ))
+        mapping = self._values(self, self._set)
+        mapping.update(steps[0][1])
+        steps[0][1] = mapping
+
+        # a step writes the values set at its end along with its own
+        for i in range(1, len(steps)):
+            mapping = dict(steps[i-1][2])
+            mapping.update(steps[i][1])
+            steps[i][1] = mapping
+        self.durations = [ d for d, mapping, end in steps ]
+        self.mappings = [ mapping for d, mapping, end in steps ]
+        self.end = steps[-1][2]
+
+        # the fields of a ROM word, starting from the LSB: the last
+        # flag, the duration less one, and an enable and value for
+        # each register written
+        self.count_width = seq.calc_width(max(self.durations))
+        self.fields = []
+        lsb = 1 + self.count_width
+        for name in sorted(set([ k for mapping in self.mappings for k in mapping ])):
+            width = self.bin.regs[name].width
+            self.fields.append((name, lsb, width))
+            lsb += 1 + width
+        self.word_width = lsb
+
+    def _flatten(self, seqs):
+        """Returns the steps of the unlinked Sequences 'seqs' as a list
+        of [duration, values set at the start, values set at the end]."""
+        steps = []
+        for x in seqs:
+            if not(type(x) in [ Serial, Microcode, Set, Nop, Stall, Trigger ]):
+                raise Exception("Microcode %s cannot compile %s.  Only Set, Nop, Stall, Trigger, Serial and Microcode Sequences are supported" % (self.name, x))
+            if x.dryrun or x._export_sigs:
+                raise Exception("Microcode %s cannot compile %s as it uses dryrun or exports signals" % (self.name, x))
+            if type(x) in [ Serial, Microcode ]:
+                if type(x) is Serial:
+                    if x.term:
+                        raise Exception("Microcode %s cannot compile %s as it has a term" % (self.name, x))
+                    inner = self._flatten(x.subseqs)
+                else:
+                    inner = self._flatten(x._source)
+                mapping = self._values(x, x._set)
+                if inner:
+                    mapping.update(inner[0][1])
+                    inner[0][1] = mapping
+                steps.extend(inner)
+            elif type(x) in [ Set, Nop ]:
+                steps.append([ 1, self._values(x, x._set), {} ])
+            elif type(x) is Stall:
+                if not(type(x.stop_count) in [ int, long ]) or x.stop_count < 1:
+                    raise Exception("Microcode %s cannot compile %s as its count is not a positive int" % (self.name, x))
+                if x.set_at_end:
+                    steps.append([ x.stop_count, {}, self._values(x, x._set) ])
+                else:
+                    steps.append([ x.stop_count, self._values(x, x._set), {} ])
+            elif type(x) is Trigger:
+                reg = x.reg
+                if type(reg) is str:
+                    reg = self.find_reg(reg)
+                if not(self.bin.regs.has_key(reg.name)):
+                    raise Exception("Parent does not have a register called %s in Sequence %s %s" % (reg.name, x.name, x))
+                hi = (1 << reg.width) - 1 if x.active_high else 0
+                lo = 0 if x.active_high else (1 << reg.width) - 1
+                if x.stop_count is None:
+                    if reg.width != 1:
+                        raise Exception("Microcode %s cannot compile the one-shot %s on %s as it is wider than 1 bit" % (self.name, x, reg.name))
+                    steps.append([ 1, { reg.name : hi }, {} ])
+                    steps.append([ 1, { reg.name : lo }, {} ])
+                elif type(x.stop_count) in [ int, long ] and x.stop_count >= 1:
+                    steps.append([ x.stop_count, { reg.name : hi }, { reg.name : lo } ])
+                else:
+                    raise Exception("Microcode %s cannot compile %s as its count is not a positive int" % (self.name, x))
+        return steps
+
+    def _values(self, x, set_):
+        """Returns the 'set' dict of Sequence 'x' with its values
+        masked to the width of their registers."""
+        values = {}
+        for k, v in set_.items():
+            if not(self.bin.regs.has_key(k)):
+                raise Exception("Parent does not have a register called %s in Sequence %s %s" % (k, x.name, x))
+            if not(type(v) in [ int, long ]):
+                raise Exception("Microcode %s cannot compile %s as it sets %s to %s rather than an int" % (self.name, x, k, v))
+            values[k] = v & ((1 << self.bin.regs[k].width) - 1)
+        return values
+
+    def _ucode(self, name):
+        return "ucode_%s_%s_" % (self.name, name)
+
+    def _words(self):
+        words = []
+        for i, (duration, mapping) in enumerate(zip(self.durations, self.mappings)):
+            word = int(i == len(self.durations)-1) | ((duration-1) << 1)
+            for name, lsb, width in self.fields:
+                if mapping.has_key(name):
+                    word |= (1 | (mapping[name] << 1)) << lsb
+            words.append(word)
+        return words
+
+    def _vlog_gen_declare(self):
+        addr_width = seq.calc_width(len(self.durations))
+        return [ "reg  [%d:0] %s [0:%d];" % (self.word_width-1, self._ucode("rom"), len(self.durations)-1),
+                 "initial $readmemh(\"%s_%s.hex\", %s);" % (self.bin.name, self.name, self._ucode("rom")),
+                 "reg  [%d:0] %s;" % (addr_width-1, self._ucode("pc")),
+                 "reg  [%d:0] %s, %s;" % (self.count_width-1, self._ucode("count"), self._ucode("limit")),
+                 "reg  %s;" % (self._ucode("last"), ),
+                 "wire [%d:0] %s;" % (addr_width-1, self._ucode("addr")),
+                 "wire [%d:0] %s;" % (self.word_width-1, self._ucode("word")),
+                 "wire %s, %s;" % (self._ucode("step_done"), self._ucode("issue")), ]
+
+    def _vlog_gen_logic(self):
+        return [ "assign %s = (%s) ? 0 : %s;" % (self._ucode("addr"), self.start, self._ucode("pc")),
+                 "assign %s = %s[%s];" % (self._ucode("word"), self._ucode("rom"), self._ucode("addr")),
+                 "assign %s = %s && (%s == %s);" % (self._ucode("step_done"), self.running, self._ucode("count"), self._ucode("limit")),
+                 "assign %s = %s || (%s && !%s);" % (self._ucode("issue"), self.start, self._ucode("step_done"), self._ucode("last")), ]
+
+    def _vlog_gen_reset(self):
+        return [ "%s <= 0;" % self._ucode(x) for x in [ "pc", "count", "limit", "last" ] ]
+
+    def _vlog_gen_seq(self):
+        word = self._ucode("word")
+        s = [ "if(%s) begin" % self._ucode("issue"),
+              "  %s <= %s + 1'b1;" % (self._ucode("pc"), self._ucode("addr")),
+              "  %s <= 0;" % (self._ucode("count"), ),
+              "  %s <= %s[%d:1];" % (self._ucode("limit"), word, self.count_width),
+              "  %s <= %s[0];" % (self._ucode("last"), word), ]
+        if(self.dryrun):
+            s.append("  if(!(%s)) begin" % self.dryrun)
+        for name, lsb, width in self.fields:
+            if width == 1:
+                value = "%s[%d]" % (word, lsb+1)
+            else:
+                value = "%s[%d:%d]" % (word, lsb+width, lsb+1)
+            s.append("  if(%s[%d]) %s <= %s;" % (word, lsb, name, value))
+        if(self.dryrun):
+            s.append("  end")
+        s.extend([ "end else if(%s && !%s) begin" % (self.running, self._ucode("step_done")),
+                   "  %s <= %s + 1'b1;" % (self._ucode("count"), self._ucode("count")),
+                   "end" ])
+        if self.end:
+            if(self.dryrun):
+                s.append("if(%s && !(%s)) begin" % (self.done, self.dryrun))
+            else:
+                s.append("if(%s) begin" % (self.done, ))
+            for name, value in sorted(self.end.items()):
+                s.append("  %s <= %d;" % (name, value))
+            s.append("end")
+        return s
+
+    def _vlog_gen_done(self):
+        return "%s && %s" % (self._ucode("step_done"), self._ucode("last"))
+
+    @staticmethod
+    def vlog_gen_files(data):
+        files = []
+        for inst in data[Microcode]["insts"]:
+            digits = (inst.word_width + 3) / 4
+            lines = [ "%0*x" % (digits, word) for word in inst._words() ]
+            files.append(("%s_%s.hex" % (inst.bin.name, inst.name), lines))
+        return files
+
+    def _sim_declare(self, s):
+        s.reg(self._ucode("pc"), seq.calc_width(len(self.durations)))
+        s.reg(self._ucode("count"), self.count_width)
+        s.reg(self._ucode("limit"), self.count_width)
+        s.reg(self._ucode("last"), 1)
+
+    def _sim_roms(self):
+        """Returns a dict of the fields of the ROM words, each as a ROM
+        of its own as deep as the pc can address.  The enable and value
+        of a register are keyed on its name."""
+        addr_width = seq.calc_width(len(self.durations))
+        pad = [ 0 ] * ((1 << addr_width) - len(self.durations))
+        roms = dict(limit = [ d - 1 for d in self.durations ] + pad,
+                    last  = [ 0 ] * (len(self.durations)-1) + [ 1 ] + pad)
+        for name, lsb, width in self.fields:
+            roms[name] = ([ int(m.has_key(name)) for m in self.mappings ] + pad,
+                          [ m.get(name, 0) for m in self.mappings ] + pad)
+        return roms
+
+    def _sim_logic(self, s):
+        addr_width = seq.calc_width(len(self.durations))
+        s.wire(self._ucode("addr"), lambda: s.mux(s.get(self.start), 0, s.get(self._ucode("pc"))), addr_width)
+        s.wire(self._ucode("step_done"), lambda: s.land(s.get(self.running), s.get(self._ucode("count")) == s.get(self._ucode("limit"))), 1)
+        s.wire(self._ucode("issue"), lambda: s.lor(s.get(self.start), s.land(s.get(self._ucode("step_done")), s.lnot(s.get(self._ucode("last"))))), 1)
+        s.counter(self._ucode("count"), lambda: [ s.get(self._ucode("limit")) ])
+
+    def _sim_seq(self, s):
+        roms = self._sim_roms()
+        addr = s.get(self._ucode("addr"))
+        with s.if_(s.get(self._ucode("issue"))):
+            s.assign(self._ucode("pc"), addr + 1)
+            s.assign(self._ucode("count"), 0)
+            s.assign(self._ucode("limit"), s.rom(roms["limit"], addr))
+            s.assign(self._ucode("last"), s.rom(roms["last"], addr))
+            with self._sim_dryrun(s):
+                for name, lsb, width in self.fields:
+                    enable, values = roms[name]
+                    with s.if_(s.rom(enable, addr)):
+                        s.assign(name, s.rom(values, addr))
+        with s.elif_(s.land(s.get(self.running), s.lnot(s.get(self._ucode("step_done"))))):
+            s.assign(self._ucode("count"), s.get(self._ucode("count")) + 1)
+        if self.end:
+            with self._sim_dryrun(s):
+                with s.if_(s.get(self.done)):
+                    for name, value in sorted(self.end.items()):
+                        s.assign(name, value)
+
+    def _sim_done(self, s):
+        return s.land(s.get(self._ucode("step_done")), s.get(self._ucode("last")))
+
+    def _latency(self):
+        return Latency.const(sum(self.durations))
+
+    def _done_depth(self):
+        return 3 # a compare and an AND with running and last
 ################################################################################
 
 ################################################################################
@@ -887,6 +1759,23 @@ class Parallel(Sequence):
 
     def _vlog_gen_running(self):
         return [ "%s <= %s || %s;" % (self.running, self.start, " || ".join([x.running for x in self.subseqs]),)]
+
+    def _sim_seq(self, s):
+        for seq in self.subseqs:
+            seq.sim_seq(s)
+
+    def _sim_done(self, s):
+        return s.lnot(s.lor(*[s.get(x.running) for x in self.subseqs])) & s.get(self.running)
+
+    def _sim_running(self, s):
+        s.assign(self.running, s.lor(s.get(self.start), *[s.get(x.running) for x in self.subseqs]))
+
+    def _latency(self):
+        # done waits for the running of the last subseq to clear
+        return Latency.maximum(*[x.latency() for x in self.subseqs]) + 1
+
+    def _done_depth(self):
+        return _and_depth(len(self.subseqs)) + 2 # only on runnings
 ################################################################################
 
 ################################################################################
@@ -909,16 +1798,34 @@ class Select(Sequence):
         return s
 
     def _vlog_gen_logic(self):
+        if self.bin.mux_tree:
+            return [ "assign select_%s_done_ = %s;" % (self.name, self._vlog_mux_tree()) ]
         s = ["assign select_%s_done_ =" % (self.name,) ]
         for j, seq in enumerate(self.subseqs[:-1]):
             s.append(" "*10+"(%s==%d) ? %s :" % (self.sel.name, j, seq.done))
         s.append(" "*10+"%s;" % (self.subseqs[-1].done,))
         return s
         
+    def _vlog_mux_tree(self):
+        """The done of the selected subseq as a balanced tree, where any
+        'sel' past the end selects the last subseq as the chain does.
+        The tree only covers the bits of 'sel' and the subseqs they
+        can reach."""
+        last = self.subseqs[-1].done
+        dones = [x.done for x in self.subseqs[:1 << self.sel.width]]
+        width = min(self.sel.width, seq.calc_width(len(self.subseqs)))
+        if len(dones) == 1:
+            return dones[0]
+        tree = seq.vlog_mux_tree(self.sel.name, width, dones, last, self.sel.width)
+        if self.sel.width > width:
+            return "(|%s[%d:%d]) ? %s : (%s)" % (self.sel.name, self.sel.width-1, width, last, tree)
+        return tree
+
     def _vlog_gen_start_wire(self, start):
-        s = [ "wire %s = %s;" % (self.start, start) ]
-        for i, seq in enumerate(self.subseqs):
-            s.extend(seq.vlog_gen_start_wire(start="%s & (%s==%d)" % (start, self.sel.name, i), indent=0))
+        s = [ self.bin.wires.wire(self.start, start) ]
+        for i, subseq in enumerate(self.subseqs):
+            start = seq.vlog_and(self.start, seq.vlog_eq(self.sel.name, self.sel.width, i))
+            s.extend(subseq.vlog_gen_start_wire(start=start, indent=0))
         return s
 
     def _vlog_gen_seq(self):
@@ -932,12 +1839,66 @@ class Select(Sequence):
 
     def _vlog_gen_done(self):
         return "%s & select_%s_done_" % (self.running, self.name)
+
+    def _sim_logic(self, s):
+        def select_done():
+            sel = s.get(self.sel.name)
+            done = s.get(self.subseqs[-1].done)
+            for j in reversed(range(len(self.subseqs)-1)):
+                done = s.mux(sel == j, s.get(self.subseqs[j].done), done)
+            return done
+        s.wire("select_%s_done_" % self.name, select_done, 1)
+
+    def _sim_start_wire(self, s, start):
+        s.wire(self.start, start, 1)
+        for i, seq in enumerate(self.subseqs):
+            seq.sim_start_wire(s, lambda i=i: s.get(self.start) & (s.get(self.sel.name) == i))
+
+    def _sim_seq(self, s):
+        sel = s.get(self.sel.name)
+        for i, seq in enumerate(self.subseqs):
+            with (s.elif_ if i else s.if_)(sel == i):
+                seq.sim_seq(s)
+
+    def _sim_done(self, s):
+        return s.get(self.running) & s.get("select_%s_done_" % self.name)
+
+    def _latency(self):
+        # 'sel' is assumed to select one of the subseqs
+        return Latency.choice(self.sel, [x.latency() for x in self.subseqs])
+
+    def _done_depth(self):
+        # a ternary per subseq before the last, or a tree of them, and
+        # an AND with running
+        n = len(self.subseqs)
+        if self.bin.mux_tree and n > 1:
+            # only the subseqs 'sel' can reach are in the tree
+            width = min(self.sel.width, seq.calc_width(n))
+            return max([ x.done_depth() for x in self.subseqs[:1 << self.sel.width] ]) + width + int(self.sel.width > width) + 1
+        return max([ x.done_depth() + min(i + 1, n - 1) for i, x in enumerate(self.subseqs) ]) + 1
 ################################################################################
 
 ################################################################################
 class Repeat(Sequence):
-    """A Sequence that runs the specified sequence a specified number of times"""
-    def __init__(self, subseq, count, counter=None, **kw):
+    """A Sequence that runs the specified sequence a specified number of times.
+When the sequence is a Multiply with a 'pipeline' of N cycles, it is
+started again every cycle instead of when it is done, so 'count'
+results take 'count'+N-1 cycles and the counter counts the starts.
+
+With 'unroll' set to K, the sequence is copied into K lanes that run
+at the same time.  Lane i runs loops i, i+K, i+2K, ... on its own
+counter, so the lanes of the last round past 'count' do not run, and
+this Sequence is done when every lane is.  The copies are named after
+the sequence with '_<name>_lane<i>' appended, where <name> is the name
+of the Repeat.  As they run at the same time,
+they should use their counter to pick the data they work on rather
+than write the same registers, and they cannot start Child Sequences,
+which would share the child Bin."""
+    # True in derived classes whose logic reads the loop number, so it
+    # is not just a counter compared against the count
+    _reads_counter = False
+
+    def __init__(self, subseq, count, counter=None, unroll=1, **kw):
         """:param subseq: The Sequence or string referring to child sequence to repeat.
 :param count: A seq.Signal that tells this sequence how many tims
     to execute 'subseq' Sequence.  It can also be an integer if the
@@ -948,14 +1909,30 @@ class Repeat(Sequence):
 
 :param counter: A seq.Signal that is not in the reg list of the parent
 bin that will be assigned to the current loop number.  If None, then 
-current loop number is not exported and kept internal.
+current loop number is not exported and kept internal.  With 'unroll',
+a list of a Signal per lane.
+
+:param unroll: The number of lanes to run loops in at the same time.
 """
+        if not(type(unroll) is int) or unroll < 1:
+            raise Exception("unroll argument must be an int of at least 1. You provided %s." % (unroll,))
         kw["subseqs"] = [subseq]
         self.count = count
         self.output = counter
+        self.unroll = unroll
 
         Sequence.__init__(self, **kw)
 
+        if unroll > 1:
+            _check_unroll(subseq)
+            if not(counter is None or (type(counter) in [ list, tuple ] and len(counter) == unroll)):
+                raise Exception("counter argument must be a list of a Signal per lane when unrolled")
+            for i in range(1, unroll):
+                lane = copy.deepcopy(subseq)
+                for x in _walk(lane):
+                    x._rename("%s_%s_lane%d" % (x.name, self.name, i))
+                self.subseqs.append(lane)
+
     def link(self, bin, parent, data):
         Sequence.link(self, bin, parent, data)
 
@@ -968,35 +1945,75 @@ current loop number is not exported and kept internal.
         else:
             raise Exception("Argument 'count' provided is not an int or Signal or str in the reg list")
 
-        if self.output:
+        if self.unroll > 1:
+            if self.count.name == "0":
+                raise Exception("Repeat %s cannot be unrolled with a count of 0" % self.name)
+            for sig in self.output or []:
+                bin.register_port(seq.Port(sig, "output"))
+            self.counters = [ seq.Signal(name="seq_%s_counter%s_"% (self.name, i or ""), width=self.count.width) for i in range(self.unroll) ]
+        elif self.output:
             bin.register_port(seq.Port(self.output, "output"))
 
         self.counter = seq.Signal(name="seq_%s_counter_"% (self.name,), width=self.count.width)
+        # a pipelined subseq is issued every cycle
+        subseq = self.subseqs[0]
+        self.overlap = isinstance(subseq, Multiply) and subseq.pipeline > 1 and self.unroll == 1
             
 
     def _vlog_gen_declare(self):
+        if self.unroll > 1:
+            return self._vlog_gen_declare_lanes()
         s = ["reg [%d:0] %s;" % (self.counter.width-1, self.counter.name,),
              "wire repeat_%s_done_;" % self.name, ]
+        if self.overlap:
+            s.append("wire repeat_%s_issue_;" % self.name)
         return s
 
     def _vlog_gen_logic(self):
-        s = ["assign repeat_%s_done_ = %s && (%s >= (%s-%d'd1));" % (self.name, self.subseqs[0].done, self.counter.name, self.count.name, self.count.width) ]
+        if self.unroll > 1:
+            return self._vlog_gen_logic_lanes()
+        last = "(%s >= (%s-%d'd1))" % (self.counter.name, self.count.name, self.count.width)
+        if self.overlap:
+            # done with the last start once no other is in flight
+            s = ["assign repeat_%s_issue_ = %s && !%s;" % (self.name, self.running, last),
+                 "assign repeat_%s_done_ = %s && !%s && %s;" % (self.name, self.subseqs[0].done, self.subseqs[0]._vlog_busy(), last) ]
+        else:
+            s = ["assign repeat_%s_done_ = %s && %s;" % (self.name, self.subseqs[0].done, last) ]
         if(self.output):
             s.append("assign %s = %s;" % (self.output.name, self.counter.name,))
         return s
         
     def _vlog_gen_start_wire(self, start):
-        s = [ "wire %s = %s;" % (self.start, start) ]
-        s.extend(self.subseqs[0].vlog_gen_start_wire(start = "%s || (%s && !%s)" % (self.start, self.subseqs[0].done, self.done)))
+        s = [ self.bin.wires.wire(self.start, start) ]
+        if self.unroll > 1:
+            for i, subseq in enumerate(self.subseqs):
+                run = self._vlog_runs(i)
+                if run == "1":
+                    first = self.start
+                elif run == "0":
+                    first = "0"
+                else:
+                    first = "(%s && %s)" % (self.start, run)
+                s.extend(subseq.vlog_gen_start_wire(start = "%s || (%s && !repeat_%s_last%d_)" % (first, subseq.done, self.name, i)))
+            return s
+        if self.overlap:
+            start = "%s || repeat_%s_issue_" % (self.start, self.name)
+        else:
+            start = "%s || (%s && !%s)" % (self.start, self.subseqs[0].done, self.done)
+        s.extend(self.subseqs[0].vlog_gen_start_wire(start = start))
         return s
 
     def _vlog_gen_reset(self):
+        if self.unroll > 1:
+            return [ "%s <= 0;" % x.name for x in self.counters ] + [ "repeat_%s_fin%d_ <= 0;" % (self.name, i) for i in range(self.unroll) ]
         return [ "%s <= 0;" % self.counter.name ]
 
     def _vlog_gen_seq(self):
+        if self.unroll > 1:
+            return self._vlog_gen_seq_lanes()
         s = [ "if(%s) begin" % self.start,
               "  %s <= 0;" % self.counter.name,
-              "end else if(%s) begin" % self.subseqs[0].done,
+              "end else if(%s) begin" % ("repeat_%s_issue_" % self.name if self.overlap else self.subseqs[0].done),
               "  %s <= %s+1;" % (self.counter.name, self.counter.name, ),
               "end" ]
 
@@ -1005,6 +2022,167 @@ current loop number is not exported and kept internal.
     def _vlog_gen_done(self):
         return "%s & repeat_%s_done_" % (self.running, self.name)
 
+    def _vlog_total(self):
+        """The number of loops, as an expression one bit wider than
+        'count' so a 0 count is the max number of loops."""
+        if self.count.name.isdigit():
+            return self.count.name
+        return "{(%s == 0), %s}" % (self.count.name, self.count.name)
+
+    def _vlog_runs(self, lane):
+        """Whether lane 'lane' runs any loops: "1", "0", or the name of
+        the wire telling."""
+        if lane == 0:
+            return "1"
+        if self.count.name.isdigit():
+            return "1" if lane < int(self.count.name) else "0"
+        return "repeat_%s_runs%d_" % (self.name, lane)
+
+    def _vlog_gen_declare_lanes(self):
+        s = []
+        for i, counter in enumerate(self.counters):
+            s.append("reg [%d:0] %s;" % (counter.width-1, counter.name))
+            s.append("reg repeat_%s_fin%d_;" % (self.name, i))
+            s.append("wire repeat_%s_last%d_;" % (self.name, i))
+            if not(self._vlog_runs(i) in [ "0", "1" ]):
+                s.append("wire %s;" % self._vlog_runs(i))
+        s.append("wire repeat_%s_done_;" % self.name)
+        return s
+
+    def _vlog_gen_logic_lanes(self):
+        total = self._vlog_total()
+        done = []
+        s = [ "/* verilator lint_off WIDTH */" ]
+        for i, (counter, subseq) in enumerate(zip(self.counters, self.subseqs)):
+            # a lane is on its last loop when its next one is past the count
+            s.append("assign repeat_%s_last%d_ = (%s + %d) >= %s;" % (self.name, i, counter.name, self.unroll, total))
+            if not(self._vlog_runs(i) in [ "0", "1" ]):
+                s.append("assign %s = %s > %d;" % (self._vlog_runs(i), total, i))
+            done.append("(repeat_%s_fin%d_ || (%s && repeat_%s_last%d_))" % (self.name, i, subseq.done, self.name, i))
+        s.append("/* verilator lint_on WIDTH */")
+        s.append("assign repeat_%s_done_ = %s;" % (self.name, " && ".join(done)))
+        for sig, counter in zip(self.output or [], self.counters):
+            s.append("assign %s = %s;" % (sig.name, counter.name))
+        return s
+
+    def _vlog_gen_seq_lanes(self):
+        s = []
+        for i, (counter, subseq) in enumerate(zip(self.counters, self.subseqs)):
+            run = self._vlog_runs(i)
+            s.extend([ "if(%s) begin" % self.start,
+                       "  %s <= %d;" % (counter.name, i & ((1 << counter.width) - 1)),
+                       "  repeat_%s_fin%d_ <= %s;" % (self.name, i, "!%s" % run if not(run in [ "0", "1" ]) else str(1 - int(run))),
+                       "end else if(%s) begin" % subseq.done,
+                       "  if(repeat_%s_last%d_) repeat_%s_fin%d_ <= 1;" % (self.name, i, self.name, i),
+                       "  else %s <= %s + %d;" % (counter.name, counter.name, self.unroll),
+                       "end" ])
+        for subseq in self.subseqs:
+            s.extend(subseq.vlog_gen_seq(indent=0))
+        return s
+
+    def _sim_declare(self, s):
+        if self.unroll > 1:
+            for i, counter in enumerate(self.counters):
+                s.reg(counter.name, counter.width)
+                s.reg("repeat_%s_fin%d_" % (self.name, i), 1)
+            return
+        s.reg(self.counter.name, self.counter.width)
+
+    def _sim_total(self, s):
+        count, count_width, signed = s.operand(self.count)
+        count = count & s.mask(self.count.width)
+        return s.mux(count == 0, 1 << self.count.width, count)
+
+    def _sim_logic_lanes(self, s):
+        for i, (counter, subseq) in enumerate(zip(self.counters, self.subseqs)):
+            s.wire("repeat_%s_last%d_" % (self.name, i), lambda counter=counter: s.get(counter.name) + self.unroll >= self._sim_total(s), 1)
+            s.wire("repeat_%s_runs%d_" % (self.name, i), lambda i=i: self._sim_total(s) > i, 1)
+        def done():
+            return s.land(*[ s.lor(s.get("repeat_%s_fin%d_" % (self.name, i)), s.land(s.get(subseq.done), s.get("repeat_%s_last%d_" % (self.name, i))))
+                             for i, subseq in enumerate(self.subseqs) ])
+        s.wire("repeat_%s_done_" % self.name, done, 1)
+        for sig, counter in zip(self.output or [], self.counters):
+            s.wire(sig.name, lambda counter=counter: s.get(counter.name), sig.width)
+
+    def _sim_logic(self, s):
+        if self.unroll > 1:
+            return self._sim_logic_lanes(s)
+        def last():
+            # the subtraction is as wide as the widest operand
+            count, count_width, signed = s.operand(self.count)
+            w = max(self.counter.width, count_width)
+            return (count - 1) & s.mask(w)
+        if self.overlap:
+            s.wire("repeat_%s_issue_" % self.name, lambda: s.land(s.get(self.running), s.lnot(s.get(self.counter.name) >= last())), 1)
+            s.wire("repeat_%s_done_" % self.name, lambda: s.land(s.get(self.subseqs[0].done), s.lnot(self.subseqs[0]._sim_busy(s)),
+                                                                 s.get(self.counter.name) >= last()), 1)
+        else:
+            s.wire("repeat_%s_done_" % self.name, lambda: s.land(s.get(self.subseqs[0].done), s.get(self.counter.name) >= last()), 1)
+        if(self.output):
+            s.wire(self.output.name, lambda: s.get(self.counter.name), self.output.width)
+        elif not(self._reads_counter): # the exported loop number could be used for anything
+            s.counter(self.counter.name, lambda: [ last(), s.mask(self.counter.width) ])
+
+    def _sim_start_wire(self, s, start):
+        s.wire(self.start, start, 1)
+        if self.unroll > 1:
+            for i, subseq in enumerate(self.subseqs):
+                subseq.sim_start_wire(s, lambda i=i, subseq=subseq: s.lor(s.land(s.get(self.start), s.get("repeat_%s_runs%d_" % (self.name, i))),
+                                                                      s.land(s.get(subseq.done), s.lnot(s.get("repeat_%s_last%d_" % (self.name, i))))))
+            return
+        if self.overlap:
+            self.subseqs[0].sim_start_wire(s, lambda: s.lor(s.get(self.start), s.get("repeat_%s_issue_" % self.name)))
+        else:
+            self.subseqs[0].sim_start_wire(s, lambda: s.lor(s.get(self.start), s.land(s.get(self.subseqs[0].done), s.lnot(s.get(self.done)))))
+
+    def _sim_seq(self, s):
+        if self.unroll > 1:
+            for i, (counter, subseq) in enumerate(zip(self.counters, self.subseqs)):
+                fin = "repeat_%s_fin%d_" % (self.name, i)
+                with s.if_(s.get(self.start)):
+                    s.assign(counter.name, i)
+                    s.assign(fin, s.lnot(s.get("repeat_%s_runs%d_" % (self.name, i))))
+                with s.elif_(s.get(subseq.done)):
+                    with s.if_(s.get("repeat_%s_last%d_" % (self.name, i))):
+                        s.assign(fin, 1)
+                    with s.else_():
+                        s.assign(counter.name, s.get(counter.name) + self.unroll)
+            for subseq in self.subseqs:
+                subseq.sim_seq(s)
+            return
+        with s.if_(s.get(self.start)):
+            s.assign(self.counter.name, 0)
+        with s.elif_(s.get("repeat_%s_issue_" % self.name if self.overlap else self.subseqs[0].done)):
+            s.assign(self.counter.name, s.get(self.counter.name) + 1)
+        self.subseqs[0].sim_seq(s)
+
+    def _sim_done(self, s):
+        return s.get(self.running) & s.get("repeat_%s_done_" % self.name)
+
+    def _latency(self):
+        count = Latency.param(self.count, zero=1 << self.counter.width)
+        if self.unroll > 1:
+            # the lanes run rounds of K loops at the same time
+            k = self.unroll
+            if isinstance(count, Latency.Const):
+                rounds = Latency.const((count.value + k - 1) // k)
+            else:
+                rounds = Latency.formula("ceil((%s)/%d)" % (count, k), 1, (count.max + k - 1) // k,
+                                         lambda values: None if count.eval(values) is None else (count.eval(values) + k - 1) // k, [ self.count.name ])
+            return rounds * self._later(self.subseqs[0].latency())
+        if self.overlap:
+            # a start every cycle and the last one done 'pipeline' cycles later
+            return count + (self.subseqs[0].pipeline - 1)
+        # the subseq restarts the cycle it is done
+        return count * self._later(self.subseqs[0].latency())
+
+    def _done_depth(self):
+        # count-1 and a compare, an AND with the subseq done and with running
+        if self.unroll > 1:
+            # and an OR with the lane finished and an AND of the lanes
+            return max(self.subseqs[0].done_depth(), 2) + 3 + _and_depth(self.unroll)
+        return max(self.subseqs[0].done_depth(), 2) + 2
+
 
 
 ################################################################################
@@ -1069,6 +2247,56 @@ accounted for, so it is safe to set the stop param to zero."""
 
     def _vlog_gen_done(self):
         return "%s & count_down_%s_next_ <= %s" % (self.running, self.name, self.stop.name, )
+
+    def _sim_logic(self, s):
+        w = self.reg.width
+        pre = "count_down_%s_next_pre_" % self.name
+        s.wire(pre, lambda: s.get(self.reg.name) - s.operand(self.skip)[0], w+1)
+        s.wire("count_down_%s_next_" % self.name, lambda: s.mux(s.get(pre) >> w, 0, s.get(pre)), w)
+
+    def _sim_seq(self, s):
+        next = s.get("count_down_%s_next_" % self.name)
+        with s.if_(s.land(s.get(self.running), next >= s.operand(self.stop)[0])):
+            s.assign(self.reg.name, next)
+
+    def _sim_done(self, s):
+        return s.get(self.running) & (s.get("count_down_%s_next_" % self.name) <= s.operand(self.stop)[0])
+
+    def _latency(self):
+        # reg steps down by skip a cycle until the next step would pass stop
+        def cycles(reg, stop, skip):
+            if reg <= stop:
+                return 1
+            elif skip == 0:
+                return None
+            return max(1, (reg - stop + skip - 1) // skip)
+        # the most cycles are taken from the max reg to the min stop
+        # and a programmable skip of 0 never gets there
+        skip = self._bound(self.skip, None)
+        most = None if not skip else cycles((1 << self.reg.width) - 1, self._bound(self.stop, 0), skip)
+        return Latency.formula("max(1, ceil((%s - %s)/%s))" % tuple([ self._bound(x, x.name) for x in [self.reg, self.stop, self.skip] ]), 1, most, self._eval(cycles), [ x.name for x in [self.reg, self.stop, self.skip] ])
+
+    def _bound(self, sig, default):
+        """Returns the value of an int Signal, which is a 32 bit literal
+        in the HDL, or else 'default'."""
+        if sig.name.isdigit():
+            return int(sig.name) & 0xFFFFFFFF
+        return default
+
+    def _eval(self, cycles):
+        """Returns a function evaluating cycles(reg, stop, skip) given
+        a dict of Signal values."""
+        def eval(values):
+            sigs = [self.reg, self.stop, self.skip]
+            v = [ self._bound(sig, values.get(sig.name)) for sig in sigs ]
+            if None in v:
+                return None
+            return cycles(*[ x & ((1 << sig.width) - 1) for x, sig in zip(v, sigs) ])
+        return eval
+
+    def _done_depth(self):
+        # the step, the clamp, the compare and an AND with running
+        return 4
 ################################################################################
 
 ################################################################################
@@ -1095,6 +2323,36 @@ accounted for, so it is safe to set the stop param to max value."""
 
     def _vlog_gen_done(self):
         return "%s & count_up_%s_next_ >= %s" % (self.running, self.name, self.stop.name, )
+
+    def _sim_logic(self, s):
+        w = self.reg.width
+        pre = "count_up_%s_next_pre_" % self.name
+        s.wire(pre, lambda: s.get(self.reg.name) + s.operand(self.skip)[0], w+1)
+        s.wire("count_up_%s_next_" % self.name, lambda: s.mux(s.get(pre) >> w, s.mask(w), s.get(pre)), w)
+
+    def _sim_seq(self, s):
+        next = s.get("count_up_%s_next_" % self.name)
+        with s.if_(s.land(s.get(self.running), next <= s.operand(self.stop)[0])):
+            s.assign(self.reg.name, next)
+
+    def _sim_done(self, s):
+        return s.get(self.running) & (s.get("count_up_%s_next_" % self.name) >= s.operand(self.stop)[0])
+
+    def _latency(self):
+        # reg steps up by skip a cycle, saturating, until it would pass stop
+        top = (1 << self.reg.width) - 1
+        def cycles(reg, stop, skip):
+            if stop > top:
+                return None
+            elif reg >= stop:
+                return 1
+            elif skip == 0:
+                return None
+            return max(1, (stop - reg + skip - 1) // skip)
+        # the most cycles are taken from 0 to the max stop
+        skip = self._bound(self.skip, None)
+        most = None if not skip else cycles(0, self._bound(self.stop, (1 << self.stop.width) - 1), skip)
+        return Latency.formula("max(1, ceil((%s - %s)/%s))" % tuple([ self._bound(x, x.name) for x in [self.stop, self.reg, self.skip] ]), 1, most, self._eval(cycles), [ x.name for x in [self.reg, self.stop, self.skip] ])
 ################################################################################
 
 ################################################################################
@@ -1126,6 +2384,12 @@ currently implemented.
 :param b: Signal or int that is the second input to be multiplied.
 :param out: reg (signal or string) to save the result in.
 :param justify: str that is either "left" or "right"
+:param radix: 2 to handle one bit of 'b' per clock cycle, or 4 to
+    handle two bits of 'b' per clock cycle with Booth recoding, which
+    takes half the cycles for an adder/subtractor 2 bits wider than
+    'out' and 2 more register bits.  Unsigned 'b' gets a 0 sign bit to
+    recode, so an unsigned 'b' of even width takes one cycle more than
+    half its width.  Both give the same result.
 
 Unsigned Example::
 
@@ -1153,12 +2417,15 @@ Signed Example::
         )
     test2.vlog_dump()
 """
-    def __init__(self, a, b, out, justify="left", **kw):
+    def __init__(self, a, b, out, justify="left", radix=2, **kw):
         self.ab = [a,b]
         self.out = out
         self.justify = justify
+        self.radix = radix
         if not(justify in ["right", "left"]):
             raise Exception("justify argument must be 'right' or 'left'. You provided %s." % justify)
+        if not(radix in [2, 4]):
+            raise Exception("radix argument must be 2 or 4. You provided %s." % radix)
 
         Sequence.__init__(self, **kw)
 
@@ -1195,14 +2462,39 @@ Signed Example::
         if(self.ab[0].signed != self.out.signed):
             raise Exception("a and out must match in term of signs (signed or unsigned)")
 
-        if data[SerialMultiply].has_key("max_b_width"):
-            if(data[SerialMultiply]["max_b_width"] < self.ab[1].width):
-                data[SerialMultiply]["max_b_width"] = self.ab[1].width;
+        # the number of cycles it takes, one per bit or Booth digit of 'b'
+        if self.radix == 2:
+            self.steps = self.ab[1].width
+        elif self.out.signed:
+            self.steps = (self.ab[1].width+1)/2
         else:
-            data[SerialMultiply]["max_b_width"] = self.ab[1].width;
+            self.steps = self.ab[1].width/2 + 1
+
+        # the shared counter is as wide as the most steps, which is
+        # enough to count them
+        if data[SerialMultiply].has_key("max_steps"):
+            if(data[SerialMultiply]["max_steps"] < self.steps):
+                data[SerialMultiply]["max_steps"] = self.steps;
+        else:
+            data[SerialMultiply]["max_steps"] = self.steps;
+
+    def _booth(self):
+        """Returns the shift of 'a' into the accumulator of the radix 4
+        multiply, the number of bits the accumulator keeps below 'out',
+        and the width of the accumulator.  The accumulator shifts right
+        2 bits a step, so after the last step it holds 'a' times 'b'
+        shifted down just as the radix 2 multiply leaves it in 'out'.
+        It is 2 bits wider than 'out' to hold the partial products,
+        which are signed even for unsigned multiplies."""
+        a, b, out = self.ab[0], self.ab[1], self.out
+        shift = out.width - a.width - b.width + 2*self.steps - 2
+        frac = max(0, -shift)
+        return shift + frac, frac, out.width + 2 + frac
 
     def _vlog_gen_declare(self):
         s = [ "wire serial_mult_done_%s_;" % (self.name, ), ]
+        if self.radix == 4:
+            return s + self._vlog_gen_declare_booth()
         if(self.out.signed):
             s.append("wire [%d:0] %s_%s_ = {%s[%d], %s, {%d{1'b0}}};" % (self.out.width-1, self.ab[0].name, self.name, self.ab[0].name, self.ab[0].width-1, self.ab[0].name, self.ab[1].width-1+(self.out.width-self.ab[0].width-self.ab[1].width)))
             s.append("wire [%d:0] %s_%s_by_2_ = { %s[%d], %s[%d:1] };" % (self.out.width-1, self.out.name, self.name, self.out.name, self.out.width-1, self.out.name, self.out.width-1))
@@ -1211,7 +2503,52 @@ Signed Example::
             s.append("wire [%d:0] %s_%s_by_2_ = %s >> 1;" % (self.out.width-1, self.out.name, self.name, self.out.name))
         return s;
 
+    def _vlog_gen_declare_booth(self):
+        a, b, out = self.ab[0], self.ab[1], self.out
+        shift, frac, width = self._booth()
+        acc = "serial_mult_acc_%s_" % self.name
+        booth = "serial_mult_booth_%s_" % self.name
+        a_shifted = "%s_%s_" % (a.name, self.name)
+        if out.signed:
+            a_sign, b_sign = [ "%s[%d]" % (x.name, x.width-1) if x.width > 1 else x.name for x in self.ab ]
+        else:
+            a_sign, b_sign = "1'b0", "1'b0"
+        s = [ "reg [1:0] serial_mult_hi_%s_;" % self.name ]
+        lo = ""
+        if frac:
+            s.append("reg [%d:0] serial_mult_lo_%s_;" % (frac-1, self.name))
+            lo = ", serial_mult_lo_%s_" % self.name
+        s.append("wire signed [%d:0] %s = {{%d{%s}}, %s%s};" % (width-1, a_shifted, width-a.width-shift, a_sign, a.name, ", {%d{1'b0}}" % shift if shift else ""))
+
+        # the Booth digit of each step is bits 2*count+1 down to
+        # 2*count-1 of 'b', with a 0 below 'b' and 'b' sign extended
+        b_ext = 2*self.steps - b.width
+        s.append("wire [%d:0] serial_mult_b_%s_ = {%s%s, 1'b0};" % (2*self.steps, self.name, "{%d{%s}}, " % (b_ext, b_sign) if b_ext else "", b.name))
+        s.append("/* verilator lint_off WIDTH */")
+        s.append("wire [2:0] %s = serial_mult_b_%s_ >> (2*serial_multiply_count_);" % (booth, self.name))
+        s.append("/* verilator lint_on WIDTH */")
+        s.append("wire signed [%d:0] %s = {serial_mult_hi_%s_, %s%s};" % (width-1, acc, self.name, out.name, lo))
+        s.append("wire signed [%d:0] serial_mult_pp_%s_ = (%s == 3'b011) ? (%s <<< 1) : (%s == 3'b100) ? -(%s <<< 1) :" % (width-1, self.name, booth, a_shifted, booth, a_shifted))
+        s.append("        (%s == 3'b001 || %s == 3'b010) ? %s : (%s == 3'b101 || %s == 3'b110) ? -%s : 0;" % (booth, booth, a_shifted, booth, booth, a_shifted))
+        s.append("wire signed [%d:0] serial_mult_next_%s_ = (%s >>> 2) + serial_mult_pp_%s_;" % (width-1, self.name, acc, self.name))
+        return s
+
+    def _vlog_gen_reset(self):
+        if self.radix == 2:
+            return []
+        s = [ "serial_mult_hi_%s_ <= 0;" % self.name ]
+        if self._booth()[1]:
+            s.append("serial_mult_lo_%s_ <= 0;" % self.name)
+        return s
+
     def _vlog_gen_seq(self, set_at_end=False):
+        if self.radix == 4:
+            acc = "{serial_mult_hi_%s_, %s%s}" % (self.name, self.out.name, ", serial_mult_lo_%s_" % self.name if self._booth()[1] else "")
+            return [ 'if(start) begin',
+                     '   %s <= 0;' % acc,
+                     'end else if(running) begin',
+                     '   %s <= serial_mult_next_%s_;' % (acc, self.name),
+                     'end' ]
         s = []
         signed = ""
         if(self.ab[0].signed):
@@ -1245,12 +2582,12 @@ Signed Example::
     def vlog_gen_static_logic(data):
         start = [inst.start for inst in data[SerialMultiply]["insts"]]
         
-        s = ["  reg  [%d:0] serial_multiply_count_;" % (data[SerialMultiply]["max_b_width"]-1, ),
+        s = ["  reg  [%d:0] serial_multiply_count_;" % (data[SerialMultiply]["max_steps"]-1, ),
              "  wire start_serial_multiply_ = %s;" % (" || ".join(start)),
-             "  wire [%d:0] next_serial_multiply_count_ = (start_serial_multiply_) ? 0 : (&serial_multiply_count_) ? serial_multiply_count_ : serial_multiply_count_ + 1;" % (data[SerialMultiply]["max_b_width"]-1, ),
+             "  wire [%d:0] next_serial_multiply_count_ = (start_serial_multiply_) ? 0 : (&serial_multiply_count_) ? serial_multiply_count_ : serial_multiply_count_ + 1;" % (data[SerialMultiply]["max_steps"]-1, ),
              "  /* verilator lint_off WIDTH */", ]
         for inst in data[SerialMultiply]["insts"]:
-            s.append("  assign serial_mult_done_%s_ = serial_multiply_count_ >= (%s-1);" % (inst.name, inst.ab[1].width,))
+            s.append("  assign serial_mult_done_%s_ = serial_multiply_count_ >= (%s-1);" % (inst.name, inst.steps,))
         s.append("  /* verilator lint_on WIDTH */" )
         s.extend(["  always @(posedge clk or negedge reset_n) begin",
                   "    if(!reset_n) begin",
@@ -1261,6 +2598,107 @@ Signed Example::
                   "  end\n",
                   ])
         return s
+
+    def _sim_declare(self, s):
+        if self.radix == 4:
+            s.reg("serial_mult_hi_%s_" % self.name, 2)
+            frac = self._booth()[1]
+            if frac:
+                s.reg("serial_mult_lo_%s_" % self.name, frac)
+
+    def _sim_logic(self, s):
+        if self.radix == 4:
+            return self._sim_logic_booth(s)
+        a, b, out = self.ab[0], self.ab[1], self.out
+        shift = out.width - a.width - 1
+        if(out.signed):
+            s.wire("%s_%s_" % (a.name, self.name), lambda: ((((s.operand(a)[0] >> (a.width-1)) & 1) << a.width) | (s.operand(a)[0] & s.mask(a.width))) << shift, out.width)
+            s.wire("%s_%s_by_2_" % (out.name, self.name), lambda: (s.get(out.name) & (1 << (out.width-1))) | (s.get(out.name) >> 1), out.width)
+        else:
+            s.wire("%s_%s_" % (a.name, self.name), lambda: (s.operand(a)[0] & s.mask(a.width)) << shift, out.width)
+            s.wire("%s_%s_by_2_" % (out.name, self.name), lambda: s.get(out.name) >> 1, out.width)
+
+    def _sim_logic_booth(self, s):
+        a, b, out = self.ab[0], self.ab[1], self.out
+        shift, frac, width = self._booth()
+        def operand(sig):
+            value = s.operand(sig)[0] & s.mask(sig.width)
+            if out.signed:
+                return s.to_signed(value, sig.width)
+            return value
+        s.wire("%s_%s_" % (a.name, self.name), lambda: operand(a) << shift, width)
+        def booth():
+            # shifting the 2*steps+1 bits of 'b' any further leaves 0
+            count = s.get("serial_multiply_count_")
+            return s.mux(count > self.steps, 0, ((operand(b) << 1) & s.mask(2*self.steps+1)) >> (2*count))
+        s.wire("serial_mult_booth_%s_" % self.name, booth, 3)
+        s.wire("serial_mult_acc_%s_" % self.name, lambda: (s.get("serial_mult_hi_%s_" % self.name) << (out.width+frac)) | (s.get(out.name) << frac) |
+               (s.get("serial_mult_lo_%s_" % self.name) if frac else 0), width)
+        def next_acc():
+            booth = s.get("serial_mult_booth_%s_" % self.name)
+            digit = (booth & 1) + ((booth >> 1) & 1) - 2*(booth >> 2)
+            acc = s.to_signed(s.get("serial_mult_acc_%s_" % self.name), width)
+            return (acc >> 2) + digit * s.to_signed(s.get("%s_%s_" % (a.name, self.name)), width)
+        s.wire("serial_mult_next_%s_" % self.name, next_acc, width)
+
+    def _sim_seq(self, s):
+        if self.radix == 4:
+            return self._sim_seq_booth(s)
+        # like the verilog, this runs off the start and running of the Bin
+        a_shifted = s.get("%s_%s_" % (self.ab[0].name, self.name))
+        out_by_2 = s.get("%s_%s_by_2_" % (self.out.name, self.name))
+        count = s.get("serial_multiply_count_")
+        with s.if_(s.get("start")):
+            s.assign(self.out.name, 0)
+        with s.elif_(s.get("running")):
+            with s.if_((s.operand(self.ab[1])[0] >> count) & 1):
+                if(self.out.signed):
+                    with s.if_(count == self.ab[1].width-1):
+                        s.assign(self.out.name, out_by_2 - a_shifted)
+                    with s.else_():
+                        s.assign(self.out.name, out_by_2 + a_shifted)
+                else:
+                    s.assign(self.out.name, out_by_2 + a_shifted)
+            with s.else_():
+                s.assign(self.out.name, out_by_2)
+
+    def _sim_seq_booth(self, s):
+        frac = self._booth()[1]
+        def assign(acc):
+            s.assign("serial_mult_hi_%s_" % self.name, acc >> (self.out.width+frac))
+            s.assign(self.out.name, acc >> frac)
+            if frac:
+                s.assign("serial_mult_lo_%s_" % self.name, acc)
+        with s.if_(s.get("start")):
+            assign(0)
+        with s.elif_(s.get("running")):
+            assign(s.get("serial_mult_next_%s_" % self.name))
+
+    def _sim_done(self, s):
+        return s.get(self.running) & s.get("serial_mult_done_%s_" % self.name)
+
+    def _latency(self):
+        return Latency.const(self.steps) # a cycle per bit, or pair of bits, of 'b'
+
+    def _done_depth(self):
+        return 2
+
+    def _sim_running(self, s):
+        Sequence._sim_running(self, s)
+
+    @staticmethod
+    def sim_static_logic(s, data):
+        width = data[SerialMultiply]["max_steps"]
+        insts = data[SerialMultiply]["insts"]
+        s.reg("serial_multiply_count_", width)
+        s.wire("start_serial_multiply_", lambda: s.lor(*[s.get(inst.start) for inst in insts]), 1)
+        def next_serial_multiply_count():
+            count = s.get("serial_multiply_count_")
+            return s.mux(s.get("start_serial_multiply_"), 0, s.mux(count == s.mask(width), count, count + 1))
+        s.wire("next_serial_multiply_count_", next_serial_multiply_count, width)
+        for inst in insts:
+            s.wire("serial_mult_done_%s_" % inst.name, lambda inst=inst: s.get("serial_multiply_count_") >= inst.steps-1, 1)
+        s.always(lambda: s.assign("serial_multiply_count_", s.get("next_serial_multiply_count_")))
 ################################################################################
 
 ################################################################################
@@ -1277,12 +2715,22 @@ output results (when 'a' and 'b' are unsigned). An optional argument
 'justify' can be used when the output is not wide enough and
 truncation needs to occur. If 'justify' is "left", then the output is
 left justified and LSB's are dropped. If 'justify is 'right', then
-MSB's are dropped.
+MSB's are dropped.  Set 'share_units' on the Bin to have the Multiply
+Sequences under different Sequences of the Bin share multipliers.
+
+With 'pipeline' set to N greater than 1, the product is registered
+and the clamp and justification are done in the following stages, so
+'out' is written and done is asserted exactly N cycles after start.
+Each stage only holds the data of one start, so the Multiply can be
+started again every cycle while earlier results are still in flight.
+A Repeat of a pipelined Multiply does so and produces a result per
+cycle.
 
 :param a: Signal or int that is the first input to be multiplied.
 :param b: Signal or int that is the second input to be multiplied.
 :param out: reg (signal or string) to save the result in.
 :param justify: str that is either "left" or "right"
+:param pipeline: int number of clock cycles from start to done.
 
 Unsigned Example::
 
@@ -1310,13 +2758,16 @@ Signed Example::
         )
     test2.vlog_dump()
 """
-    def __init__(self, a, b, out, justify="left", clamp=False, **kw):
+    def __init__(self, a, b, out, justify="left", clamp=False, pipeline=1, **kw):
         self.ab = [a,b]
         self.out = out
         self.justify = justify
         self.clamp = clamp
+        self.pipeline = pipeline
         if not(justify in ["right", "left"]):
             raise Exception("justify argument must be 'right' or 'left'. You provided %s." % justify)
+        if not(type(pipeline) is int) or pipeline < 1:
+            raise Exception("pipeline argument must be an int of at least 1. You provided %s." % (pipeline,))
 
         Sequence.__init__(self, **kw)
 
@@ -1349,7 +2800,17 @@ Signed Example::
             signed = "signed"
         s = []
         raw_name = "%s_%s_raw_" % (self.out.name, self.name,)
-        s.append("wire %s [%d:0] %s = %s * %s;" % (signed, w-1, raw_name, self.ab[0].name, self.ab[1].name))
+        if self.bin.share_units:
+            s.append("wire %s [%d:0] %s; // from the shared multiplier" % (signed, w-1, raw_name))
+        else:
+            s.append("wire %s [%d:0] %s = %s * %s;" % (signed, w-1, raw_name, self.ab[0].name, self.ab[1].name))
+        if self.pipeline > 1:
+            # clamp and justify the registered product
+            s.append("reg %s [%d:0] mult_pipe1_%s_;" % (signed, w-1, self.name))
+            for i in range(2, self.pipeline):
+                s.append("reg %s [%d:0] mult_pipe%d_%s_;" % (signed, self.out.width-1, i, self.name))
+            s.append("reg [%d:0] mult_valid_%s_;" % (self.pipeline-1, self.name))
+            raw_name = "mult_pipe1_%s_" % self.name
 
         if w > self.out.width: # need to clamp if output width isn't sufficient
             if(self.justify == "left"):
@@ -1369,14 +2830,132 @@ Signed Example::
                 s.append( "wire %s [%d:0] %s_%s_ = { %s, {%d{1'b0}}};" % (signed, self.out.width-1, self.out.name, self.name, raw_name, self.out.width-w))
         return s;
 
+    def _shared_target(self):
+        return "%s_%s_raw_" % (self.out.name, self.name,), self.ab[0].width + self.ab[1].width
+
+    def _pipe_out(self):
+        """The name of the value written to 'out' from the last stage."""
+        if self.pipeline > 2:
+            return "mult_pipe%d_%s_" % (self.pipeline-1, self.name)
+        return "%s_%s_" % (self.out.name, self.name)
+
+    def _vlog_gen_reset(self):
+        if self.pipeline == 1:
+            return []
+        return [ "mult_pipe%d_%s_ <= 0;" % (i, self.name) for i in range(1, self.pipeline) ] + [ "mult_valid_%s_ <= 0;" % self.name ]
+
     def _vlog_gen_seq(self, set_at_end=False):
+        if self.pipeline > 1:
+            return ["  if(mult_valid_%s_[%d]) %s <= %s;" % (self.name, self.pipeline-2, self.out.name, self._pipe_out())]
         return ["  if(%s) %s <= %s_%s_;" % (self.start, self.out.name, self.out.name, self.name)]
     
     def _vlog_gen_running(self):
+        if self.pipeline > 1:
+            # the stages shift every cycle so a start can be taken
+            # while earlier ones are still in flight
+            s = [ "mult_valid_%s_ <= { mult_valid_%s_[%d:0], %s };" % (self.name, self.name, self.pipeline-2, self.start),
+                  "mult_pipe1_%s_ <= %s_%s_raw_;" % (self.name, self.out.name, self.name) ]
+            if self.pipeline > 2:
+                s.append("mult_pipe2_%s_ <= %s_%s_;" % (self.name, self.out.name, self.name))
+            for i in range(3, self.pipeline):
+                s.append("mult_pipe%d_%s_ <= mult_pipe%d_%s_;" % (i, self.name, i-1, self.name))
+            s.append("%s <= %s || %s;" % (self.running, self.start, self._vlog_busy()))
+            return s
         return [ "%s <= %s;" % (self.running, self.start,) ]
 
+    def _vlog_busy(self):
+        """Whether a start before the one now done is still in flight."""
+        return "(|mult_valid_%s_[%d:0])" % (self.name, self.pipeline-2)
+
     def _vlog_gen_done(self):
+        if self.pipeline > 1:
+            return "mult_valid_%s_[%d]" % (self.name, self.pipeline-1)
         return self.running
+
+    @staticmethod
+    def vlog_gen_static_logic(data):
+        insts = data[Multiply]["insts"]
+        if not(insts[0].bin.share_units):
+            return []
+        return _vlog_gen_shared_units(insts, "mult", "*")
+
+    def _sim_logic(self, s):
+        w = self.ab[0].width + self.ab[1].width
+        ow = self.out.width
+        raw_name = "%s_%s_raw_" % (self.out.name, self.name,)
+        def raw():
+            a, b = s.operands(*self.ab)
+            return a * b
+        s.wire(raw_name, raw, w)
+        if self.pipeline > 1:
+            raw_name = "mult_pipe1_%s_" % self.name
+
+        def out():
+            raw = s.get(raw_name)
+            if w > ow: # need to clamp if output width isn't sufficient
+                if(self.justify == "left"):
+                    return raw >> (w-ow)
+                elif(self.clamp): # right justify and clamp
+                    upper = raw >> (ow-1) # raw[w-1:ow-1]
+                    if(self.out.signed):
+                        sign = upper >> (w-ow)
+                        upper = upper & s.mask(w-ow)
+                        return s.mux(s.land(s.lnot(sign), upper != 0), 2**(ow-1)-1,
+                                     s.mux(s.land(sign, upper != s.mask(w-ow)), -(2**(ow-1)), raw))
+                    else:
+                        return s.mux(upper >> 1, 2**ow-1, raw)
+                else: # right justify, no clamp, output smaller than calculation
+                    return raw
+            else: # output is wider than calculation
+                if(self.out.signed):
+                    raw = s.to_signed(raw, w)
+                if(w == ow or self.justify == "right"):
+                    return raw
+                else: # left justify
+                    return raw << (ow-w)
+        s.wire("%s_%s_" % (self.out.name, self.name), out, ow)
+
+    def _sim_declare(self, s):
+        if self.pipeline > 1:
+            s.reg("mult_pipe1_%s_" % self.name, self.ab[0].width + self.ab[1].width)
+            for i in range(2, self.pipeline):
+                s.reg("mult_pipe%d_%s_" % (i, self.name), self.out.width)
+            s.reg("mult_valid_%s_" % self.name, self.pipeline)
+
+    def _sim_seq(self, s):
+        if self.pipeline > 1:
+            with s.if_((s.get("mult_valid_%s_" % self.name) >> (self.pipeline-2)) & 1):
+                s.assign(self.out.name, s.get(self._pipe_out()))
+            return
+        with s.if_(s.get(self.start)):
+            s.assign(self.out.name, s.get("%s_%s_" % (self.out.name, self.name)))
+
+    def _sim_running(self, s):
+        if self.pipeline > 1:
+            valid = "mult_valid_%s_" % self.name
+            s.assign(valid, (s.get(valid) << 1) | s.get(self.start))
+            s.assign("mult_pipe1_%s_" % self.name, s.get("%s_%s_raw_" % (self.out.name, self.name)))
+            if self.pipeline > 2:
+                s.assign("mult_pipe2_%s_" % self.name, s.get("%s_%s_" % (self.out.name, self.name)))
+            for i in range(3, self.pipeline):
+                s.assign("mult_pipe%d_%s_" % (i, self.name), s.get("mult_pipe%d_%s_" % (i-1, self.name)))
+            s.assign(self.running, s.lor(s.get(self.start), self._sim_busy(s)))
+            return
+        s.assign(self.running, s.get(self.start))
+
+    def _sim_busy(self, s):
+        return (s.get("mult_valid_%s_" % self.name) & s.mask(self.pipeline-1)) != 0
+
+    def _sim_done(self, s):
+        if self.pipeline > 1:
+            return (s.get("mult_valid_%s_" % self.name) >> (self.pipeline-1)) & 1
+        return s.get(self.running)
+
+    def _latency(self):
+        return Latency.const(self.pipeline)
+
+    def _done_depth(self):
+        return 0
 ################################################################################
 
 ################################################################################
@@ -1386,7 +2965,9 @@ This sequence will add two signals together. If the 'out' signal is
 not sufficiently wide to store the output, then you can specify a the
 'clamp' option to prevent overflow. If the output is signed, then 2's
 compliment clamping is used to clamp most negative and most positive,
-otherwise just most positive is clamped.
+otherwise just most positive is clamped.  Set 'share_units' on the Bin
+to have the Add Sequences under different Sequences of the Bin share
+adders.
 
 :param a: Signal or int that is the first input to be added
 :param b: Signal or int that is the second input to be added
@@ -1464,15 +3045,26 @@ Example::
         s = []
         if self.clamp and w >= self.out.width: # no need to clamp if output width is sufficient
             raw_name = "%s_%s_raw_" % (self.out.name, self.name,)
-            s.append("wire [%d:0] %s = %s + %s;" % (w, raw_name, self.ab[0].name, self.ab[1].name))
+            if self.bin.share_units:
+                s.append("wire [%d:0] %s; // from the shared adder" % (w, raw_name))
+            else:
+                s.append("wire [%d:0] %s = %s + %s;" % (w, raw_name, self.ab[0].name, self.ab[1].name))
             if(self.out.signed):
                 s.append("wire [%d:0] %s_%s_ = (!%s[%d] & |%s[%d:%d]) ? %d : (%s[%d] & !(&%s[%d:%d])) ? %d : %s[%d:0]; //clamp adder output" % (self.out.width-1, self.out.name, self.name, raw_name, w, raw_name, w-1, self.out.width-1, 2**(self.out.width-1)-1, raw_name, w, raw_name, w-1, self.out.width-1, -(2**(self.out.width-1)), raw_name, self.out.width-1))
             else:
                 s.append("wire [%d:0] %s_%s_ = (|%s[%d:%d]) ? %d : %s[%d:0]; //clamp adder output" % (self.out.width-1, self.out.name, self.name, raw_name, w,self.out.width, 2**self.out.width-1, raw_name, self.out.width-1))
+        elif self.bin.share_units:
+            s.append( "wire [%d:0] %s_%s_; // from the shared adder" % (self.out.width-1, self.out.name, self.name))
         else:
             s.append( "wire [%d:0] %s_%s_ = %s + %s;" % (self.out.width-1, self.out.name, self.name, self.ab[0].name, self.ab[1].name))
         return s;
 
+    def _shared_target(self):
+        w = max(self.ab[0].width, self.ab[1].width)
+        if self.clamp and w >= self.out.width:
+            return "%s_%s_raw_" % (self.out.name, self.name,), w+1
+        return "%s_%s_" % (self.out.name, self.name), self.out.width
+
     def _vlog_gen_seq(self, set_at_end=False):
         return ["  if(%s) %s <= %s_%s_;" % (self.start, self.out.name, self.out.name, self.name)]
     
@@ -1481,4 +3073,351 @@ Example::
 
     def _vlog_gen_done(self):
         return self.running
+
+    @staticmethod
+    def vlog_gen_static_logic(data):
+        insts = data[Add]["insts"]
+        if not(insts[0].bin.share_units):
+            return []
+        return _vlog_gen_shared_units(insts, "add", "+")
+
+    def _sim_logic(self, s):
+        w = max(self.ab[0].width, self.ab[1].width)
+        ow = self.out.width
+        def add():
+            a, b = s.operands(*self.ab)
+            return a + b
+        if self.clamp and w >= ow: # no need to clamp if output width is sufficient
+            raw_name = "%s_%s_raw_" % (self.out.name, self.name,)
+            s.wire(raw_name, add, w+1)
+            def out():
+                raw = s.get(raw_name)
+                upper = raw >> (ow-1) # raw[w:ow-1]
+                if(self.out.signed):
+                    sign = upper >> (w-ow+1)
+                    upper = upper & s.mask(w-ow+1)
+                    return s.mux(s.land(s.lnot(sign), upper != 0), 2**(ow-1)-1,
+                                 s.mux(s.land(sign, upper != s.mask(w-ow+1)), -(2**(ow-1)), raw))
+                else:
+                    return s.mux(upper >> 1, 2**ow-1, raw)
+            s.wire("%s_%s_" % (self.out.name, self.name), out, ow)
+        else:
+            s.wire("%s_%s_" % (self.out.name, self.name), add, ow)
+
+    def _sim_seq(self, s):
+        with s.if_(s.get(self.start)):
+            s.assign(self.out.name, s.get("%s_%s_" % (self.out.name, self.name)))
+
+    def _sim_running(self, s):
+        s.assign(self.running, s.get(self.start))
+
+    def _sim_done(self, s):
+        return s.get(self.running)
+
+    def _latency(self):
+        return Latency.const(1)
+
+    def _done_depth(self):
+        return 0
+################################################################################
+
+################################################################################
+class MultiplyAccumulate(Sequence):
+    """
+The MultiplyAccumulate sequence adds the product of two signals to the
+'out' register, as in out += a*b, so a Repeat of it runs a tap of a
+filter or dot product per iteration without handing off between a
+Multiply and an Add.  The product is justified to 'out' as for
+Multiply: if 'justify' is "left" the product is shifted to the MSB's
+of 'out', dropping LSB's when 'out' is narrower, and if 'justify' is
+"right" it is added in full.  The sum is clamped to the range of
+'out' when 'clamp' is True and wraps otherwise.  If 'clear' is
+nonzero, the product is stored in 'out' rather than added to it, which
+starts a new accumulation.
+
+By default the product is formed in a single clock cycle with the '*'
+operator.  With 'serial' True, it is formed one bit of 'b' per clock
+cycle by an adder/shifter as in SerialMultiply and accumulated on the
+last one, so the Sequence takes as many cycles as the width of 'b'
+and 'a', 'b' and 'clear' must be held until it is done.  Like
+SerialMultiply, the serial form takes the signed multiply from 'out'
+being signed, so the three must agree in sign.  Both give the same
+result.
+
+:param a: Signal or int that is the first input to be multiplied.
+:param b: Signal or int that is the second input to be multiplied.
+:param out: reg (signal or string) to accumulate the products in.
+:param justify: str that is either "left" or "right"
+:param clamp: should the sum be clamped if overflow is possible.
+:param clear: Signal, reg name, or int that clears the accumulation
+    when nonzero.  None never clears.
+:param serial: True to form the product serially.
+
+Example::
+
+    xin = seq.Signal("xin", width=8, signed=True)
+    coeff = seq.Signal("coeff", width=8, signed=True)
+    first = seq.Signal("first", width=1)
+    acc = seq.Signal("acc", width=20, signed=True)
+    mac = Bin.Bin(
+        name = "mac",
+        regs = [ acc, ],
+        seqs = [ Sequence.MultiplyAccumulate(a=xin, b=coeff, out=acc, justify="right", clamp=True, clear=first), ]
+        )
+    mac.vlog_dump()
+"""
+    def __init__(self, a, b, out, justify="left", clamp=False, clear=None, serial=False, **kw):
+        self.ab = [a,b]
+        self.out = out
+        self.justify = justify
+        self.clamp = clamp
+        self.clear = clear
+        self.serial = serial
+        if not(justify in ["right", "left"]):
+            raise Exception("justify argument must be 'right' or 'left'. You provided %s." % justify)
+
+        Sequence.__init__(self, **kw)
+
+    def link(self, bin, parent, data):
+        Sequence.link(self, bin, parent, data)
+
+        for i,ab in enumerate(self.ab):
+            if type(ab) is str: # replace string with reg Signal
+                self.ab[i] = self.use_reg(ab)
+            elif(type(ab) is int):
+                self.ab[i] = seq.Signal(str(ab), width=seq.calc_width(ab+1), init=0)
+            elif type(ab) is seq.Signal:
+                self.bin.register_port(seq.Port(ab, "input")) # create as in input port as it must be supplied externally
+            else:
+                raise Exception("Unknown type=%s for a/b argument" % type(ab))
+
+        if type(self.out) is str:
+            self.out = self.find_reg(self.out)
+        elif type(self.out) is seq.Signal:
+            if not(self.out.name in self.bin.regs):
+                raise Exception("Parent does not have a register called %s in Sequence %s %s" % (self.out.name, self.name, self))
+        else:
+            raise Exception("Unknown type=%s for out argument" % type(self.out))
+
+        if self.clear is None:
+            pass
+        elif type(self.clear) is str: # replace string with reg Signal
+            self.clear = self.use_reg(self.clear)
+        elif type(self.clear) is int:
+            self.clear = seq.Signal(str(self.clear), width=seq.calc_width(self.clear+1), init=0)
+        elif type(self.clear) is seq.Signal:
+            self.bin.register_port(seq.Port(self.clear, "input"))
+        else:
+            raise Exception("Unknown type=%s for clear argument" % type(self.clear))
+
+        if self.serial:
+            width = self.ab[1].width
+            if not(data[MultiplyAccumulate].has_key("max_b_width")) or data[MultiplyAccumulate]["max_b_width"] < width:
+                data[MultiplyAccumulate]["max_b_width"] = width
+
+    def _vlog_gen_declare(self):
+        a, b, out = self.ab[0], self.ab[1], self.out
+        w = a.width + b.width
+        ow = out.width
+        signed = ""
+        if(out.signed):
+            signed = "signed"
+        s = []
+        if self.serial:
+            # the product is shifted into mac_prod a bit of 'b' at a time
+            product = "mac_next_%s_" % self.name
+            prod = "mac_prod_%s_" % self.name
+            a_shifted = "%s_%s_" % (a.name, self.name)
+            bit = "%s[mac_count_]" % b.name if b.width > 1 else b.name
+            s.append("wire mac_done_%s_;" % self.name)
+            s.append("reg [%d:0] %s;" % (w-1, prod))
+            if(out.signed):
+                s.append("wire [%d:0] %s = {%s, %s%s};" % (w-1, a_shifted, "%s[%d]" % (a.name, a.width-1) if a.width > 1 else a.name, a.name, ", {%d{1'b0}}" % (b.width-1) if b.width > 1 else ""))
+                s.append("wire [%d:0] mac_prod_by_2_%s_ = { %s[%d], %s[%d:1] };" % (w-1, self.name, prod, w-1, prod, w-1))
+                s.append("wire signed [%d:0] %s = !%s ? mac_prod_by_2_%s_ : (mac_count_ == %d) ? mac_prod_by_2_%s_ - %s : mac_prod_by_2_%s_ + %s;" % (w-1, product, bit, self.name, b.width-1, self.name, a_shifted, self.name, a_shifted))
+            else:
+                s.append("wire [%d:0] %s = {1'b0, %s%s};" % (w-1, a_shifted, a.name, ", {%d{1'b0}}" % (b.width-1) if b.width > 1 else ""))
+                s.append("wire [%d:0] mac_prod_by_2_%s_ = %s >> 1;" % (w-1, self.name, prod))
+                s.append("wire [%d:0] %s = %s ? mac_prod_by_2_%s_ + %s : mac_prod_by_2_%s_;" % (w-1, product, bit, self.name, a_shifted, self.name))
+        else:
+            product = "%s_%s_raw_" % (out.name, self.name)
+            s.append("wire %s [%d:0] %s = %s * %s;" % (signed, w-1, product, a.name, b.name))
+
+        # justify the product to 'out'
+        term = "mac_term_%s_" % self.name
+        if self.justify == "left" and w > ow:
+            tw = ow
+            s.append("wire %s [%d:0] %s = %s[%d:%d];" % (signed, tw-1, term, product, w-1, w-ow))
+        elif self.justify == "left" and w < ow:
+            tw = ow
+            s.append("wire %s [%d:0] %s = { %s, {%d{1'b0}}};" % (signed, tw-1, term, product, ow-w))
+        else:
+            tw = w
+            s.append("wire %s [%d:0] %s = %s;" % (signed, tw-1, term, product))
+
+        # accumulate one bit wider than either so the sum never overflows
+        sw = max(ow, tw) + 1
+        sum = "mac_sum_%s_" % self.name
+        s.append("/* verilator lint_off WIDTH */")
+        if self.clear is None:
+            s.append("wire %s [%d:0] %s = %s + %s;" % (signed, sw-1, sum, out.name, term))
+        else:
+            s.append("wire %s [%d:0] %s = (%s != 0) ? %s : %s + %s;" % (signed, sw-1, sum, self.clear.name, term, out.name, term))
+        s.append("/* verilator lint_on WIDTH */")
+        if not(self.clamp):
+            s.append("wire %s [%d:0] %s_%s_ = %s[%d:0];" % (signed, ow-1, out.name, self.name, sum, ow-1))
+        elif(out.signed):
+            s.append("wire [%d:0] %s_%s_ = (!%s[%d] & |%s[%d:%d]) ? %d : (%s[%d] & !(&%s[%d:%d])) ? %d : %s[%d:0];" % (ow-1, out.name, self.name, sum, sw-1, sum, sw-2, ow-1, 2**(ow-1)-1, sum, sw-1, sum, sw-2, ow-1, -(2**(ow-1)), sum, ow-1))
+        else:
+            s.append("wire [%d:0] %s_%s_ = (|%s[%d:%d]) ? %d : %s[%d:0]; //clamp accumulator" % (ow-1, out.name, self.name, sum, sw-1, ow, 2**ow-1, sum, ow-1))
+        return s
+
+    def _vlog_gen_reset(self):
+        if self.serial:
+            return [ "mac_prod_%s_ <= 0;" % self.name ]
+        return []
+
+    def _vlog_gen_seq(self, set_at_end=False):
+        if self.serial:
+            # the next start can come the cycle the product is added
+            return [ "if(%s) mac_prod_%s_ <= 0; else if(%s) mac_prod_%s_ <= mac_next_%s_;" % (self.start, self.name, self.running, self.name, self.name),
+                     "if(%s) %s <= %s_%s_;" % (self.done, self.out.name, self.out.name, self.name) ]
+        return ["  if(%s) %s <= %s_%s_;" % (self.start, self.out.name, self.out.name, self.name)]
+
+    def _vlog_gen_running(self):
+        if self.serial:
+            return [ "if(%s) %s <= 1; else if(%s || start) %s <= 0;" % (self.start, self.running, self.done, self.running)]
+        return [ "%s <= %s;" % (self.running, self.start,) ]
+
+    def _vlog_gen_done(self):
+        if self.serial:
+            return "%s & mac_done_%s_" % (self.running, self.name)
+        return self.running
+
+    @staticmethod
+    def vlog_gen_static_logic(data):
+        insts = [ inst for inst in data[MultiplyAccumulate]["insts"] if inst.serial ]
+        if not(insts):
+            return []
+        width = seq.calc_width(data[MultiplyAccumulate]["max_b_width"])
+        s = ["  reg  [%d:0] mac_count_;" % (width-1, ),
+             "  wire start_mac_count_ = %s;" % (" || ".join([inst.start for inst in insts])),
+             "  wire [%d:0] next_mac_count_ = (start_mac_count_) ? 0 : (&mac_count_) ? mac_count_ : mac_count_ + 1;" % (width-1, ),
+             "  /* verilator lint_off WIDTH */", ]
+        for inst in insts:
+            s.append("  assign mac_done_%s_ = mac_count_ >= %d;" % (inst.name, inst.ab[1].width-1))
+        s.append("  /* verilator lint_on WIDTH */" )
+        s.extend(["  always @(posedge clk or negedge reset_n) begin",
+                  "    if(!reset_n) begin",
+                  "      mac_count_ <= 0;",
+                  "    end else begin",
+                  "      mac_count_ <= next_mac_count_;",
+                  "    end",
+                  "  end\n",
+                  ])
+        return s
+
+    def _sim_declare(self, s):
+        if self.serial:
+            s.reg("mac_prod_%s_" % self.name, self.ab[0].width + self.ab[1].width)
+
+    def _sim_logic(self, s):
+        a, b, out = self.ab[0], self.ab[1], self.out
+        w = a.width + b.width
+        ow = out.width
+        if self.serial:
+            product = "mac_next_%s_" % self.name
+            prod = "mac_prod_%s_" % self.name
+            a_shifted = "%s_%s_" % (a.name, self.name)
+            if(out.signed):
+                s.wire(a_shifted, lambda: ((((s.operand(a)[0] >> (a.width-1)) & 1) << a.width) | (s.operand(a)[0] & s.mask(a.width))) << (b.width-1), w)
+                s.wire("mac_prod_by_2_%s_" % self.name, lambda: (s.get(prod) & (1 << (w-1))) | (s.get(prod) >> 1), w)
+            else:
+                s.wire(a_shifted, lambda: (s.operand(a)[0] & s.mask(a.width)) << (b.width-1), w)
+                s.wire("mac_prod_by_2_%s_" % self.name, lambda: s.get(prod) >> 1, w)
+            def next():
+                by_2 = s.get("mac_prod_by_2_%s_" % self.name)
+                a_ = s.get(a_shifted)
+                count = s.get("mac_count_")
+                bit = (s.operand(b)[0] >> count) & 1
+                if(out.signed):
+                    return s.mux(bit, s.mux(count == b.width-1, by_2 - a_, by_2 + a_), by_2)
+                return s.mux(bit, by_2 + a_, by_2)
+            s.wire(product, next, w)
+        else:
+            product = "%s_%s_raw_" % (out.name, self.name)
+            def raw():
+                a_, b_ = s.operands(a, b)
+                return a_ * b_
+            s.wire(product, raw, w)
+
+        def accumulate():
+            term = s.get(product)
+            acc = s.get(out.name)
+            if(out.signed):
+                term = s.to_signed(term, w)
+                acc = s.to_signed(acc, ow)
+            if self.justify == "left" and w > ow:
+                term = term >> (w-ow)
+            elif self.justify == "left" and w < ow:
+                term = term << (ow-w)
+            sum = acc + term
+            if self.clear is not None:
+                sum = s.mux(s.operand(self.clear)[0] != 0, term, sum)
+            if not(self.clamp):
+                return sum
+            if(out.signed):
+                return s.mux(sum > 2**(ow-1)-1, 2**(ow-1)-1, s.mux(sum < -(2**(ow-1)), -(2**(ow-1)), sum))
+            return s.mux(sum > 2**ow-1, 2**ow-1, sum)
+        s.wire("%s_%s_" % (out.name, self.name), accumulate, ow)
+
+    def _sim_seq(self, s):
+        if self.serial:
+            prod = "mac_prod_%s_" % self.name
+            with s.if_(s.get(self.start)):
+                s.assign(prod, 0)
+            with s.elif_(s.get(self.running)):
+                s.assign(prod, s.get("mac_next_%s_" % self.name))
+            with s.if_(s.get(self.done)):
+                s.assign(self.out.name, s.get("%s_%s_" % (self.out.name, self.name)))
+            return
+        with s.if_(s.get(self.start)):
+            s.assign(self.out.name, s.get("%s_%s_" % (self.out.name, self.name)))
+
+    def _sim_running(self, s):
+        if self.serial:
+            Sequence._sim_running(self, s)
+        else:
+            s.assign(self.running, s.get(self.start))
+
+    def _sim_done(self, s):
+        if self.serial:
+            return s.get(self.running) & s.get("mac_done_%s_" % self.name)
+        return s.get(self.running)
+
+    @staticmethod
+    def sim_static_logic(s, data):
+        insts = [ inst for inst in data[MultiplyAccumulate]["insts"] if inst.serial ]
+        if not(insts):
+            return
+        width = seq.calc_width(data[MultiplyAccumulate]["max_b_width"])
+        s.reg("mac_count_", width)
+        s.wire("start_mac_count_", lambda: s.lor(*[s.get(inst.start) for inst in insts]), 1)
+        def next_mac_count():
+            count = s.get("mac_count_")
+            return s.mux(s.get("start_mac_count_"), 0, s.mux(count == s.mask(width), count, count + 1))
+        s.wire("next_mac_count_", next_mac_count, width)
+        for inst in insts:
+            s.wire("mac_done_%s_" % inst.name, lambda inst=inst: s.get("mac_count_") >= inst.ab[1].width-1, 1)
+        s.always(lambda: s.assign("mac_count_", s.get("next_mac_count_")))
+
+    def _latency(self):
+        if self.serial:
+            return Latency.const(self.ab[1].width) # a cycle per bit of 'b'
+        return Latency.const(1)
+
+    def _done_depth(self):
+        if self.serial:
+            return 2
+        return 0
 ################################################################################
@@ -0,0 +1,1085 @@
+import seq
+from contextlib import contextmanager
+
+class Simulator(object):
+    """A Simulator executes a linked Bin hierarchy cycle by cycle in
+Python, directly from the Bin and its Sequences, without generating
+and compiling any HDL.  Each Sequence simulates itself through its
+sim_* methods, which mirror its vlog_gen_* methods one for one, so
+the Simulator reproduces the cycle behavior of the generated verilog.
+
+By default, the hierarchy is first compiled into a Python function
+that advances all of its registers by a clock cycle (see Program), so
+the Sequences are only consulted once rather than every cycle.  The
+compiled Program is cached on the structural hashes of the Bins, so
+any number of Simulators of the same design share it.
+
+The inputs of the top Bin ('start', 'seq' and any input ports) are
+set by name and its outputs ('running', 'done' and the registers) are
+read by name.  Signed Signals read back as signed integers.
+
+Example::
+
+    sim = Sim.Simulator(test1)
+    sim["a1"] = 3
+    sim["b1"] = 5
+    cycles = sim.run("mult")
+    print sim["out1"], cycles
+"""
+    def __init__(self, bin, compiled=True):
+        """:param bin: The linked top Bin to simulate.
+:param compiled: If True, the Bin is simulated by a compiled Program.
+Otherwise, the Sequences are interpreted every cycle, which is much
+slower but can be easier to debug."""
+        self.bin = bin
+        self.compiled = compiled
+        self.inputs = {}
+        self._inputs = None
+        if compiled:
+            self.top = BinCompile(bin, None, self)
+            self.program = Program.get(self.top)
+        else:
+            self.top = BinSim(bin, None, self)
+        self.reset()
+
+    def reset(self):
+        """Asserts reset: all registers go to their reset values.
+        Inputs keep their current values."""
+        if self.compiled:
+            self.state = list(self.program.inits)
+            self._wires = None
+        else:
+            self.top._reset()
+        self.cycle = 0
+
+    def __setitem__(self, name, value):
+        self.inputs[name] = value & _mask(self.top._input_width(name))
+        if self.compiled:
+            self._inputs = None
+            self._wires = None
+        else:
+            self.top._invalidate()
+
+    def __getitem__(self, name):
+        value = self.value((), name)
+        sig = self.top._sigs.get(name)
+        if sig is not None and sig.signed:
+            value = to_signed(value, sig.width)
+        return value
+
+    def value(self, path, name):
+        """Returns the bits of any register or wire 'name' of the Bin
+        at 'path' (a tuple of child Bin names) in the hierarchy."""
+        node = self.top
+        for child in path:
+            node = [c for c in node.children if c.bin.name == child][0]
+        if not self.compiled:
+            return node.get(name)
+
+        while node._outputs.has_key(name) and not node._regs.has_key(name):
+            node = node._outputs[name]
+        index = self.program.regs.get((node.path, name))
+        if index is not None:
+            return self.state[index]
+        if self._wires is None:
+            self._wires = self.program.peek(self.state, self._program_inputs())
+        if self._wires.has_key((node.path, name)):
+            return self._wires[(node.path, name)]
+        if node.parent is None and (node._inputs.has_key(name) or name in ["start", "seq"]):
+            return self.inputs.get(name, 0)
+        raise Exception("Unknown signal %s in %s" % (name, node))
+
+    def step(self, cycles=1):
+        """Advances the simulation by 'cycles' clock cycles."""
+        if self.compiled:
+            self.program.clock(self.state, self._program_inputs(), cycles, False)
+            self._wires = None
+        else:
+            for i in range(cycles):
+                self.top._clock()
+                self.top._commit()
+        self.cycle += cycles
+
+    def run(self, seq_, max_cycles=1000000, **inputs):
+        """Runs a Sequence of the top Bin to completion.  Pulses 'start'
+with 'seq' set to 'seq_' (a Sequence index or name) and then clocks
+until 'done' is asserted, or pulses 'push' with 'push_seq' set when
+the Bin has a queue.  Any other keyword arguments set inputs before
+starting.
+
+:returns: The number of clock cycles from the start pulse until done
+is asserted."""
+        if type(seq_) is str:
+            seq_ = [s.name for s in self.bin.seqs].index(seq_)
+        for name, value in inputs.items():
+            self[name] = value
+        seq_input, start_input = self.bin._control_inputs()
+        self[seq_input] = seq_
+        self[start_input] = 1
+        self.step()
+        self[start_input] = 0
+        cycles = 1
+        if self.compiled:
+            n = self.program.clock(self.state, self._program_inputs(), max_cycles-1, True)
+            self._wires = None
+            self.cycle += n
+            cycles += n
+        else:
+            while not self["done"] and cycles < max_cycles:
+                self.step()
+                cycles += 1
+        if not self["done"]:
+            raise Exception("Sequence %d of %s did not complete in %d cycles" % (seq_, self.bin.name, max_cycles))
+        return cycles
+
+    def _program_inputs(self):
+        if self._inputs is None:
+            self._inputs = [self.inputs.get(name, 0) for name in self.program.inputs]
+        return self._inputs
+
+
+class BatchSimulator(Simulator):
+    """A BatchSimulator simulates many independent instances, or
+lanes, of a linked Bin hierarchy at once, such as for a parameter sweep
+over thousands of input vectors.  It is used like a Simulator, but the
+state of every register lives in a NumPy array with one element per
+lane, and the lanes are advanced together by a BatchProgram.
+
+Inputs are set to either a single value for all the lanes or a
+sequence of per-lane values, so each lane can have its own 'seq' and
+'start' as well as its own data.  Reading a signal returns an array of
+its value in each lane.
+
+Example::
+
+    sim = Sim.BatchSimulator(test1, 1000)
+    sim["a1"] = numpy.random.randint(0, 16, 1000)
+    sim["b1"] = numpy.random.randint(0, 16, 1000)
+    cycles = sim.run("mult")
+    print sim["out1"], cycles
+"""
+    def __init__(self, bin, lanes):
+        """:param bin: The linked top Bin to simulate.
+:param lanes: The number of instances to simulate."""
+        self.bin = bin
+        self.lanes = lanes
+        self.compiled = True
+        self.inputs = {}
+        self._inputs = None
+        self.top = BinCompile(bin, None, self)
+        self.program = BatchProgram.get(self.top)
+        self.reset()
+
+    def reset(self):
+        """Asserts reset in all the lanes."""
+        self.state = [ self._array(init) for init in self.program.inits ]
+        self._wires = None
+        self.cycle = 0
+
+    def __setitem__(self, name, value):
+        self.inputs[name] = self._array(value) & _mask(self.top._input_width(name))
+        self._inputs = None
+        self._wires = None
+
+    def step(self, cycles=1):
+        """Advances all the lanes by 'cycles' clock cycles."""
+        self.program.clock(self.state, self._program_inputs(), cycles, False, None)
+        self._wires = None
+        self.cycle += cycles
+
+    def run(self, seq_, max_cycles=1000000, **inputs):
+        """Runs a Sequence of the top Bin to completion in every lane.
+'seq_' is a Sequence index or name, or a sequence of per-lane indices.
+Each lane stops being clocked on the cycle it asserts 'done', so its
+state is the same as if it were run by a Simulator.
+
+:returns: An array of the number of clock cycles from the start pulse
+until done was asserted in each lane."""
+        import numpy
+        if type(seq_) is str:
+            seq_ = [s.name for s in self.bin.seqs].index(seq_)
+        for name, value in inputs.items():
+            self[name] = value
+        seq_input, start_input = self.bin._control_inputs()
+        self[seq_input] = seq_
+        self[start_input] = 1
+        self.step()
+        self[start_input] = 0
+        done_at = numpy.zeros(self.lanes, "int64") - 1
+        n = self.program.clock(self.state, self._program_inputs(), max_cycles-1, True, done_at)
+        self._wires = None
+        self.cycle += n
+        if (done_at < 0).any():
+            raise Exception("Sequence %s of %s did not complete in %d cycles in %d lanes" % (seq_, self.bin.name, max_cycles, (done_at < 0).sum()))
+        return done_at + 1
+
+    def trace(self, names, cycles):
+        """Advances all the lanes by 'cycles' clock cycles, recording the
+value of each signal in 'names' on every cycle before the clock edge.
+
+:returns: A dict of the trace of each name, an array indexed by
+[cycle, lane]."""
+        import numpy
+        traces = dict([(name, []) for name in names])
+        for i in range(cycles):
+            for name in names:
+                traces[name].append(self[name])
+            self.step()
+        return dict([(name, numpy.array(t)) for name, t in traces.items()])
+
+    def _array(self, value):
+        import numpy
+        a = numpy.empty(self.lanes, self.program.dtype)
+        if self.program.dtype == "object" and isinstance(value, numpy.ndarray):
+            value = value.tolist() # Python ints rather than fixed width ones
+        a[:] = value
+        return a
+
+    def _program_inputs(self):
+        if self._inputs is None:
+            self._inputs = [self.inputs.get(name) for name in self.program.inputs]
+            for i, value in enumerate(self._inputs):
+                if value is None:
+                    self._inputs[i] = self._array(0)
+        return self._inputs
+
+
+class BinSim(object):
+    """Simulates one Bin of a hierarchy on behalf of a Simulator.  The
+construction of a BinSim mirrors Bin.vlog_gen_module(): registers and
+wires are declared by name, and always blocks are registered as
+functions that are called every clock to make non-blocking
+assignments.  The Sequences of the Bin are passed the BinSim as their
+simulation context.
+
+Values are unsigned integers holding the bits of the signal.  Wires
+are evaluated lazily and memoized until the next clock edge.  Within
+an always block, the context provides Python equivalents of the
+verilog control structures used by the generated HDL:
+
+    with s.if_(cond): ...
+    with s.elif_(cond): ...
+    with s.else_(): ...
+
+and assign() makes a non-blocking assignment.  The bodies of all
+branches are executed but only assignments on the taken branch take
+effect.
+"""
+    def __init__(self, bin, parent, sim):
+        self.bin = bin
+        self.parent = parent
+        self.sim = sim
+        self.children = []
+        self.state = {}      # current register values keyed on name
+        self._regs = {}      # register name -> (width, reset value)
+        self._wires = {}     # wire name -> (function, width)
+        self._sigs = {}      # name -> seq.Signal for registers and ports
+        self._outputs = {}   # name -> the child BinSim driving it
+        self._counters = {}  # register name -> function returning its limits
+        self._inputs = {}    # input name -> name of the driving signal in the parent
+        self._always = []
+        self._memo = {}
+        self._nxt = {}
+        self._active = True
+        self._depth = 0
+        self._taken = {}
+
+        b = bin
+        seq_input, start_input = b._control_inputs()
+        if parent is not None:
+            self._inputs[start_input] = "child_%s_start_" % b.name
+            if parent.bin.lookahead:
+                self._inputs[seq_input] = "child_%s_seq_in_" % b.name
+            else:
+                self._inputs[seq_input] = "child_%s_seq_" % b.name
+        elif b.queue:
+            self._inputs[seq_input] = seq_input
+            self._inputs[start_input] = start_input
+        for port in b.ports.values():
+            self._sigs[port.sig.name] = port.sig
+            if port.dir == "input":
+                self._inputs.setdefault(port.sig.name, port.sig.name)
+        for name, reg in b.regs.items():
+            self._sigs[name] = reg
+            self.reg(name, reg.width, reg.init or 0)
+
+        for child in b.children:
+            c = type(self)(child, self, sim)
+            self.children.append(c)
+            for port in child.ports.values():
+                if port.dir == "output":
+                    self._outputs[port.sig.name] = c
+            self.wire("child_%s_done_" % child.name, lambda c=c: c.get("done"))
+            self.wire("child_%s_running_" % child.name, lambda c=c: c.get("running"))
+            width = seq.calc_width(len(child.seqs))
+            self.reg("child_%s_seq_" % child.name, width)
+            if b.lookahead:
+                codes = b._children_codes[child.name]
+                self.wire("child_%s_start_" % child.name, lambda codes=codes: self.lor(*[self.get(x[0]) for x in codes]), 1)
+                def seq_in(child=child, codes=codes):
+                    v = self.get("child_%s_seq_" % child.name)
+                    for start, seq_ in reversed(codes):
+                        v = self.mux(self.get(start), seq_._sim_child_code(self, child), v)
+                    return v
+                self.wire("child_%s_seq_in_" % child.name, seq_in, width)
+            else:
+                self.reg("child_%s_start_" % child.name, 1)
+
+        if b.queue:
+            b._sim_queue(self)
+        b._sim_done(self)
+        b._sim_running(self)
+
+        for seq_ in b.allseqs.values():
+            seq_.sim_declare(self)
+            self.reg(seq_.running, 1)
+
+        for i, seq_ in enumerate(b.seqs):
+            seq_.sim_start_wire(self, lambda i=i: self.get("start") & (self.get("seq") == i))
+
+        for seq_ in b.allseqs.values():
+            self.wire(seq_.done, lambda seq_=seq_: seq_.sim_done(self), 1)
+
+        def done_():
+            v = 1 # default to 1 to prevent deadlocking when this bin is addressed out of range
+            for i in reversed(range(len(b.seqs))):
+                v = self.mux(self.get("seq") == i, self.get(b.seqs[i].done), v)
+            return self.mux(self.lor(self.get("start"), self.lnot(self.get("running"))), 0, v)
+        self.wire("done_", done_, 1)
+
+        for seq_ in b.allseqs.values():
+            seq_.sim_logic(self)
+
+        def state_machine():
+            for seq_ in b.allseqs.values():
+                seq_.sim_running(self)
+            # The inactive logic is shared as with Bin(shared_inactive=True),
+            # which produces the same cycle behavior either way.
+            for seq_ in b.seqs:
+                seq_.sim_inactive(self)
+            for i, seq_ in enumerate(b.seqs):
+                with (self.elif_ if i else self.if_)(self.get("seq") == i):
+                    seq_.sim_hold(self)
+                    seq_.sim_seq(self)
+            with self.else_():
+                for seq_ in b.seqs:
+                    seq_.sim_hold(self)
+        self.always(state_machine)
+
+        for seqtype in b._seqdata.keys():
+            seqtype.sim_static_logic(self, b._seqdata)
+
+        if not b.lookahead:
+            def child_starts():
+                for name, starts in b._children_starts.items():
+                    self.assign("child_%s_start_" % name, self.lor(*[self.get(x) for x in starts]))
+            self.always(child_starts)
+
+    def __str__(self):
+        return "<%s %s>" % (type(self), self.bin.name)
+
+    # The following methods are the simulation context used by the
+    # sim_* methods of Bins and Sequences.
+
+    def reg(self, name, width, init=0):
+        """Declares a register of 'width' bits that resets to 'init'."""
+        self._regs[name] = (width, init & _mask(width))
+
+    def wire(self, name, fn, width=None):
+        """Declares a wire whose value is computed by calling 'fn' with
+        no arguments.  When 'width' is given, the value is truncated to
+        that many bits."""
+        self._wires[name] = (fn, width)
+
+    def always(self, fn):
+        """Registers 'fn' to be called on every clock edge to make
+        non-blocking assignments."""
+        self._always.append(fn)
+
+    def counter(self, name, limits):
+        """Declares that the register 'name' is a counter that the logic
+only compares against the values returned by calling 'limits' with no
+arguments.  Its value matters only relative to those limits, which lets
+a Program fast-forward while it counts (see Program)."""
+        self._counters[name] = limits
+
+    def get(self, name):
+        """Returns the current value of the register, wire, or input 'name'."""
+        try:
+            return self.state[name]
+        except KeyError:
+            pass
+        try:
+            value = self._memo[name]
+        except KeyError:
+            pass
+        else:
+            if value is _evaluating:
+                raise Exception("Combinational loop through %s in %s" % (name, self))
+            return value
+
+        if self._wires.has_key(name):
+            fn, width = self._wires[name]
+            self._memo[name] = _evaluating
+            value = fn()
+            if width is not None:
+                value = value & _mask(width)
+            else:
+                value = int(value)
+            self._memo[name] = value
+            return value
+        elif self._outputs.has_key(name):
+            return self._outputs[name].get(name)
+        elif self._inputs.has_key(name) or name in ["start", "seq"]:
+            if self.parent is None:
+                return self.sim.inputs.get(name, 0)
+            return self.parent.get(self._inputs[name])
+        raise Exception("Unknown signal %s in %s" % (name, self))
+
+    def value(self, v):
+        """Returns the value of 'v', which is an int, a verilog literal, or
+        the name of a signal, as the right hand side of an assignment.
+        Signed signals are sign extended."""
+        if _is_literal(v):
+            return _literal(v)
+        value = self.get(v)
+        sig = self._sigs.get(v)
+        if sig is not None and sig.signed and sig.width > 1:
+            return to_signed(value, sig.width)
+        return value
+
+    def operand(self, sig):
+        """Returns (value, width, signed) for the Signal 'sig' as an
+        operand of a verilog expression.  Signals made from ints are
+        unsized, signed 32 bit literals."""
+        if _is_literal(sig.name):
+            return _literal(sig.name) & _mask(32), 32, True
+        return self.get(sig.name), sig.width, bool(sig.signed) and sig.width > 1
+
+    def operands(self, *sigs):
+        """Returns the values of the Signals 'sigs' as the operands of a
+        verilog arithmetic expression.  As in verilog, the operands are
+        treated as signed only when all of them are signed."""
+        ops = [self.operand(sig) for sig in sigs]
+        if all([signed for value, width, signed in ops]):
+            return [to_signed(value, width) for value, width, signed in ops]
+        return [value for value, width, signed in ops]
+
+    def assign(self, name, value):
+        """Makes a non-blocking assignment to register 'name'."""
+        if self._active:
+            self._nxt[name] = value & _mask(self._regs[name][0])
+
+    def if_(self, cond):
+        self._taken[self._depth] = bool(cond)
+        return self._block(cond)
+
+    def elif_(self, cond):
+        taken = self._taken[self._depth]
+        cond = not(taken) and bool(cond)
+        self._taken[self._depth] = taken or cond
+        return self._block(cond)
+
+    def else_(self):
+        return self.elif_(True)
+
+    @contextmanager
+    def _block(self, cond):
+        active = self._active
+        self._active = active and bool(cond)
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self._active = active
+
+    def mux(self, sel, a, b):
+        """Verilog's sel ? a : b"""
+        if sel:
+            return a
+        return b
+
+    def rom(self, values, index):
+        """Returns the word at 'index' of the ROM holding the list of
+        ints 'values'."""
+        return values[index]
+
+    def mask(self, width):
+        """Returns the value of a 'width' bit signal with all bits set."""
+        return _mask(width)
+
+    def to_signed(self, value, width):
+        """Returns the bits of 'value' as a two's complement 'width' bit number."""
+        return to_signed(value, width)
+
+    def lnot(self, a):
+        return int(not a)
+
+    def lor(self, *args):
+        for a in args:
+            if a:
+                return 1
+        return 0
+
+    def land(self, *args):
+        for a in args:
+            if not a:
+                return 0
+        return 1
+
+    # internal methods used by the Simulator
+
+    def _input_width(self, name):
+        seq_input, start_input = self.bin._control_inputs()
+        if name in [ "start", start_input ]:
+            return 1
+        elif name in [ "seq", seq_input ]:
+            return seq.calc_width(len(self.bin.seqs))
+        elif self._inputs.has_key(name):
+            return self._sigs[name].width
+        raise Exception("%s is not an input of %s" % (name, self))
+
+    def _reset(self):
+        for name, (width, init) in self._regs.items():
+            self.state[name] = init
+        self._memo.clear()
+        for c in self.children:
+            c._reset()
+
+    def _invalidate(self):
+        self._memo.clear()
+        for c in self.children:
+            c._invalidate()
+
+    def _clock(self):
+        self._nxt = {}
+        for fn in self._always:
+            fn()
+        for c in self.children:
+            c._clock()
+
+    def _commit(self):
+        self.state.update(self._nxt)
+        self._nxt = {}
+        self._memo.clear()
+        for c in self.children:
+            c._commit()
+
+
+class Program(object):
+    """A Program is a linked Bin hierarchy compiled into Python source.
+The BinSims of the whole hierarchy are flattened into two functions:
+
+    clock(state, inputs, cycles, until_done)
+
+advances the registers in the 'state' list by up to 'cycles' clock
+cycles given the values of the top level inputs in the 'inputs' list,
+stopping early when 'until_done' is True and 'done' is asserted.  It
+returns the number of cycles it advanced.
+
+    peek(state, inputs)
+
+returns a dict of the current values of all the wires keyed on
+(path, name), where path is the tuple of the child Bin names leading to
+the Bin of the wire.
+
+Within the functions, every register, wire and input of the hierarchy
+is a Python local, so all the Sequences are flattened into straight
+line code with only the if statements of the always blocks left.
+Programs are cached on the structural hashes of the Bins they are
+compiled from (see Program.get).
+
+The clock function fast-forwards through steady states.  The inputs
+cannot change within a call, so when a clock edge leaves every register
+unchanged except for counters (see BinSim.counter) that count up by
+one, every following edge does the same until a counter reaches one of
+its limits.  The clock function then jumps straight to that cycle, so
+long Stalls and Repeats of single cycle Sequences cost one cycle of
+simulation each, and a hierarchy that has gone completely idle costs
+nothing.  The cycle counts are the same as when clocking cycle by
+cycle.
+"""
+    _cache = {}
+    _int = "int(%s)"
+
+    @classmethod
+    def get(cls, top):
+        """Returns the Program for the BinCompile 'top', compiling it
+        unless a Program of a structurally identical hierarchy exists."""
+        bins = top.bin.descendants() + [top.bin]
+        key = tuple([b.structural_hash() for b in bins])
+        if not cls._cache.has_key(key):
+            cls._cache[key] = cls(top)
+        return cls._cache[key]
+
+    def __init__(self, top):
+        """:param top: The BinCompile of the top Bin to compile."""
+        # number all the registers of the hierarchy
+        self.regs = {}     # (path, name) -> index into the state list
+        self.inits = []
+        nodes = []
+        def visit(node):
+            nodes.append(node)
+            for name in sorted(node._regs):
+                self.regs[(node.path, name)] = len(self.inits)
+                self.inits.append(node._regs[name][1])
+            for c in node.children:
+                visit(c)
+        visit(top)
+        self.inputs = [ "start", "seq" ] + sorted([n for n in top._inputs if not n in ["start", "seq"]])
+        self._roms = {}    # tuple of the ROM words -> its name
+
+        load = [ "(%s,) = state" % ", ".join(["r%d" % i for i in range(len(self.inits))]),
+                 "(%s,) = inputs" % ", ".join(["i_%s" % n for n in self.inputs]), ]
+
+        # compile the clock function
+        self._begin(nodes)
+        for node in nodes:
+            for fn in node._always:
+                fn()
+        self.counters = []  # (register index, codes of the limits)
+        for node in nodes:
+            for name in sorted(node._counters):
+                limits = [ _code(v) for v in node._counters[name]() ]
+                self.counters.append((self.regs[(node.path, name)], limits))
+        s = self._clock_source(load, _code(top.get("done")))
+
+        # compile the peek function
+        self._begin(nodes)
+        wires = []
+        for node in nodes:
+            for name in sorted(node._wires):
+                wires.append("(%r, %s)" % ((node.path, name), _code(node.get(name))))
+        s.append("def peek(state, inputs):")
+        s.extend(["  " + x for x in load + self.comb])
+        s.append("  return dict([%s])" % ", ".join(wires))
+        self.source = "\n".join(s) + "\n"
+
+        env = self._env()
+        for values, name in self._roms.items():
+            env[name] = self._rom_table(values)
+        exec compile(self.source, "<seq.Sim.%s %s>" % (type(self).__name__, top.bin.name), "exec") in env
+        self.clock = env["clock"]
+        self.peek = env["peek"]
+
+    def _clock_source(self, load, done):
+        update = [ "r%d = n%d" % (i, i) for i in sorted(self.assigned) ]
+        hold = [ "n%d = r%d" % (i, i) for i in sorted(self.assigned) ]
+        s = [ "def clock(state, inputs, cycles, until_done):" ]
+        s.extend(["  " + x for x in load])
+        s.append("  n = 0")
+        s.append("  while n < cycles:")
+        s.extend(["    " + x for x in self.comb])
+        s.append("    if until_done and %s:" % done)
+        s.append("      break")
+        s.extend(["    " + x for x in hold + self.body + self._fast_forward() + update])
+        s.append("    n += 1")
+        s.append("  state[:] = (%s,)" % ", ".join(["r%d" % i for i in range(len(self.inits))]))
+        s.append("  return n")
+        s.append("")
+        return s
+
+    def _fast_forward(self):
+        # k is the number of clock edges, starting with this one, that
+        # behave the same as this one
+        counters = [ (i, limits) for i, limits in self.counters if i in self.assigned ]
+        others = sorted(self.assigned - set([i for i, limits in counters]))
+        s = [ "if %s:" % (" and ".join(["n%d == r%d" % (i, i) for i in others]) or "True"),
+              "  k = cycles - n", ]
+        for i, limits in counters:
+            s.extend([ "  if n%d == r%d + 1:" % (i, i),
+                       "    k = _ahead(k, r%d, %s)" % (i, ", ".join(limits)),
+                       "  elif n%d != r%d:" % (i, i),
+                       "    k = 0", ])
+        s.append("  if k > 1:")
+        for i, limits in counters:
+            s.append("    if n%d != r%d: n%d = r%d + k" % (i, i, i, i))
+        s.append("    n += k - 1")
+        return s
+
+    def _env(self):
+        return dict(_ahead=_ahead)
+
+    def _begin(self, nodes):
+        self.comb = []
+        self.body = []
+        self.assigned = set()
+        self._level = 0
+        self._count = 0
+        self._codes = {}  # code -> the wire computing it
+        for node in nodes:
+            node._program = self
+            node._memo = {}
+
+    def _wire(self, value, width):
+        if not isinstance(value, Expr):
+            value = int(value)
+            if width is not None:
+                value &= _mask(width)
+            return value
+        if width is None:
+            if value.atom:
+                return value # just an alias
+            code = self._int % value.code
+        else:
+            code = "%s & %d" % (value.code, _mask(width))
+        if self._codes.has_key(code):
+            return self._codes[code] # already computed by another wire
+        name = "w%d" % self._count
+        self._count += 1
+        self.comb.append("%s = %s" % (name, code))
+        self._codes[code] = Expr(name, True)
+        return self._codes[code]
+
+    def _assign(self, index, value, width):
+        if isinstance(value, Expr):
+            code = "%s & %d" % (value.code, _mask(width))
+        else:
+            code = str(int(value) & _mask(width))
+        self.body.append("  " * self._level + "n%d = %s" % (index, code))
+        self.assigned.add(index)
+
+    @contextmanager
+    def _block(self, line):
+        self.body.append("  " * self._level + line)
+        self._level += 1
+        length = len(self.body)
+        try:
+            yield
+        finally:
+            if len(self.body) == length:
+                self.body.append("  " * self._level + "pass")
+            self._level -= 1
+
+    def _if(self, cond):
+        return self._block("if %s:" % _code(cond))
+
+    def _elif(self, cond):
+        return self._block("elif %s:" % _code(cond))
+
+    def _else(self):
+        return self._block("else:")
+
+    def _mux(self, sel, a, b):
+        return Expr("(%s if %s else %s)" % (a, sel, b))
+
+    def _rom(self, values, index):
+        values = tuple(values)
+        if not self._roms.has_key(values):
+            self._roms[values] = "_rom%d" % len(self._roms)
+        return Expr("%s[%s]" % (self._roms[values], index))
+
+    def _rom_table(self, values):
+        return values
+
+    def _lnot(self, a):
+        return Expr("(0 if %s else 1)" % a)
+
+    def _lor(self, args):
+        return Expr("(1 if %s else 0)" % " or ".join(args))
+
+    def _land(self, args):
+        return Expr("(1 if %s else 0)" % " and ".join(args))
+
+
+class BatchProgram(Program):
+    """A Program that simulates many independent instances, or lanes,
+of a hierarchy at once.  Every register, wire and input is a NumPy
+array holding its value in each lane, so the Python code of the Program
+advances all the lanes a clock cycle with vectorized operations.
+
+The if statements of the always blocks become boolean masks over the
+lanes, and an assignment within them only takes effect in the lanes
+where its mask is set.  The clock function takes one more argument:
+
+    clock(state, inputs, cycles, until_done, done_at)
+
+When 'until_done' is True, the cycle on which each lane first asserts
+'done' is recorded in the 'done_at' array, which holds -1 for the lanes
+that have not finished yet.  A lane stops being clocked once it
+finishes, so it ends up in the same state as if it were simulated on
+its own, and the clock function returns once all the lanes finish.
+
+Values are 64 bit integers when every register and port of the
+hierarchy is at most 31 bits wide, so products cannot overflow.
+Otherwise they are Python ints in object arrays, which is slower.
+"""
+    _cache = {}
+    _int = "(%s + 0)"
+
+    def __init__(self, top):
+        """:param top: The BinCompile of the top Bin to compile."""
+        width = 1
+        nodes = [ top ]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children)
+            width = max([width] + [w for w, init in node._regs.values()] + [sig.width for sig in node._sigs.values()])
+        if width <= 31:
+            self.dtype = "int64"
+        else:
+            self.dtype = "object"
+        Program.__init__(self, top)
+
+    def _clock_source(self, load, done):
+        update = [ "r%d = _where(active, n%d, r%d)" % (i, i, i) for i in sorted(self.assigned) ]
+        hold = [ "n%d = r%d" % (i, i) for i in sorted(self.assigned) ]
+        s = [ "def clock(state, inputs, cycles, until_done, done_at):" ]
+        s.extend(["  " + x for x in load])
+        s.append("  active = True")
+        s.append("  n = 0")
+        s.append("  while n < cycles:")
+        s.extend(["    " + x for x in self.comb])
+        s.append("    if until_done:")
+        s.append("      done_at[_and(%s != 0, done_at < 0)] = n" % done)
+        s.append("      active = done_at < 0")
+        s.append("      if not active.any():")
+        s.append("        break")
+        s.extend(["    " + x for x in hold + self.body + update])
+        s.append("    n += 1")
+        s.append("  state[:] = (%s,)" % ", ".join(["r%d" % i for i in range(len(self.inits))]))
+        s.append("  return n")
+        s.append("")
+        return s
+
+    def _env(self):
+        import numpy
+        return dict(_where=numpy.where, _and=numpy.logical_and, _or=numpy.logical_or, _not=numpy.logical_not)
+
+    def _begin(self, nodes):
+        Program._begin(self, nodes)
+        self._masks = [ "True" ]
+        self._taken = {}
+
+    def _assign(self, index, value, width):
+        if isinstance(value, Expr):
+            code = "%s & %d" % (value.code, _mask(width))
+        else:
+            code = str(int(value) & _mask(width))
+        if len(self._masks) > 1:
+            code = "_where(%s, %s, n%d)" % (self._masks[-1], code, index)
+        self.body.append("n%d = %s" % (index, code))
+        self.assigned.add(index)
+
+    @contextmanager
+    def _mask_block(self, cond, chained):
+        # the mask of a branch is that of the enclosing block, less the
+        # lanes taking an earlier branch of the if statement, and with
+        # the condition set
+        level = len(self._masks)
+        mask = self._masks[-1]
+        if chained:
+            mask = "_and(%s, _not(%s))" % (mask, self._taken[level])
+        if cond is not None:
+            mask = "_and(%s, %s)" % (mask, _code(cond))
+        name = "m%d" % self._count
+        self._count += 1
+        self.body.append("%s = %s" % (name, mask))
+        if not chained:
+            self._taken[level] = name
+        elif cond is not None:
+            taken = "t%d" % self._count
+            self._count += 1
+            self.body.append("%s = _or(%s, %s)" % (taken, self._taken[level], name))
+            self._taken[level] = taken
+        self._masks.append(name)
+        try:
+            yield
+        finally:
+            self._masks.pop()
+
+    def _if(self, cond):
+        return self._mask_block(cond, False)
+
+    def _elif(self, cond):
+        return self._mask_block(cond, True)
+
+    def _else(self):
+        return self._mask_block(None, True)
+
+    def _mux(self, sel, a, b):
+        return Expr("_where(%s, %s, %s)" % (sel, a, b))
+
+    def _rom_table(self, values):
+        import numpy
+        return numpy.array(values, dtype=self.dtype)
+
+    def _lnot(self, a):
+        return Expr("_not(%s)" % a)
+
+    def _lor(self, args):
+        code = "(%s != 0)" % args[0]
+        for a in args[1:]:
+            code = "_or(%s, %s)" % (code, a)
+        return Expr(code)
+
+    def _land(self, args):
+        code = "(%s != 0)" % args[0]
+        for a in args[1:]:
+            code = "_and(%s, %s)" % (code, a)
+        return Expr(code)
+
+
+class BinCompile(BinSim):
+    """A BinSim that compiles its Bin for a Program rather than
+simulating it.  It is constructed exactly like a BinSim and the sim_*
+methods of the Sequences run on it unchanged, but values are Exprs
+holding the Python code that computes them rather than numbers, and
+the control structures and assignments write the Python code of the
+always blocks into the Program.
+"""
+    def __init__(self, bin, parent, sim):
+        if parent is None:
+            self.path = ()
+        else:
+            self.path = parent.path + (bin.name, )
+        BinSim.__init__(self, bin, parent, sim)
+
+    def get(self, name):
+        if self._regs.has_key(name):
+            return Expr("r%d" % self._program.regs[(self.path, name)], True)
+        try:
+            value = self._memo[name]
+        except KeyError:
+            pass
+        else:
+            if value is _evaluating:
+                raise Exception("Combinational loop through %s in %s" % (name, self))
+            return value
+
+        if self._wires.has_key(name):
+            fn, width = self._wires[name]
+            self._memo[name] = _evaluating
+            value = self._program._wire(fn(), width)
+            self._memo[name] = value
+            return value
+        elif self._outputs.has_key(name):
+            return self._outputs[name].get(name)
+        elif self._inputs.has_key(name) or name in ["start", "seq"]:
+            if self.parent is None:
+                return Expr("i_%s" % name, True)
+            return self.parent.get(self._inputs[name])
+        raise Exception("Unknown signal %s in %s" % (name, self))
+
+    def assign(self, name, value):
+        self._program._assign(self._program.regs[(self.path, name)], value, self._regs[name][0])
+
+    def if_(self, cond):
+        return self._program._if(cond)
+
+    def elif_(self, cond):
+        return self._program._elif(cond)
+
+    def else_(self):
+        return self._program._else()
+
+    def mux(self, sel, a, b):
+        if not isinstance(sel, Expr):
+            return BinSim.mux(self, sel, a, b)
+        return self._program._mux(sel.code, _code(a), _code(b))
+
+    def rom(self, values, index):
+        if not isinstance(index, Expr):
+            return BinSim.rom(self, values, index)
+        return self._program._rom(values, index.code)
+
+    def lnot(self, a):
+        if not isinstance(a, Expr):
+            return BinSim.lnot(self, a)
+        return self._program._lnot(a.code)
+
+    def lor(self, *args):
+        exprs = []
+        for a in args:
+            if isinstance(a, Expr):
+                exprs.append(a.code)
+            elif a:
+                return 1
+        if not exprs:
+            return 0
+        return self._program._lor(exprs)
+
+    def land(self, *args):
+        exprs = []
+        for a in args:
+            if isinstance(a, Expr):
+                exprs.append(a.code)
+            elif not a:
+                return 0
+        if not exprs:
+            return 1
+        return self._program._land(exprs)
+
+
+class Expr(object):
+    """The Python code computing a value in a Program.  Exprs support
+the Python operators used by the sim_* methods, so the same sim_*
+code that computes numbers in a BinSim generates code in a
+BinCompile.  'atom' is True when the code is a single name."""
+    def __init__(self, code, atom=False):
+        self.code = code
+        self.atom = atom
+
+    def __nonzero__(self):
+        raise Exception("The value of %s is not known until simulation" % (self.code, ))
+
+    def __str__(self):
+        return self.code
+
+def _code(v):
+    if isinstance(v, Expr):
+        return v.code
+    return str(int(v))
+
+def _binary_op(op):
+    def fn(self, other):
+        return Expr("(%s %s %s)" % (self.code, op, _code(other)))
+    def rfn(self, other):
+        return Expr("(%s %s %s)" % (_code(other), op, self.code))
+    return fn, rfn
+
+for _name, _op in [ ("add", "+"), ("sub", "-"), ("mul", "*"), ("and", "&"), ("or", "|"),
+                    ("xor", "^"), ("lshift", "<<"), ("rshift", ">>"), ]:
+    _fn, _rfn = _binary_op(_op)
+    setattr(Expr, "__%s__" % _name, _fn)
+    setattr(Expr, "__r%s__" % _name, _rfn)
+for _name, _op in [ ("eq", "=="), ("ne", "!="), ("lt", "<"), ("le", "<="), ("gt", ">"), ("ge", ">="), ]:
+    setattr(Expr, "__%s__" % _name, _binary_op(_op)[0])
+Expr.__neg__ = lambda self: Expr("(-%s)" % self.code)
+Expr.__invert__ = lambda self: Expr("(~%s)" % self.code)
+Expr.__hash__ = object.__hash__
+
+
+_evaluating = object()
+
+def _ahead(k, count, *limits):
+    """Returns the number of cycles, at most k, until 'count' counting up
+    by one reaches the next of its 'limits'."""
+    for limit in limits:
+        if limit > count and limit - count < k:
+            k = limit - count
+    return k
+
+def _mask(width):
+    return (1 << width) - 1
+
+def _is_literal(v):
+    v = str(v)
+    return v.lstrip("-").isdigit() or "'" in v
+
+def _literal(v):
+    """Returns the int value of an int or verilog literal such as 4'b1010"""
+    v = str(v).replace("_", "")
+    if "'" not in v:
+        return int(v)
+    width, v = v.split("'")
+    v = v.lower().lstrip("s")
+    value = int(v[1:], dict(b=2, o=8, d=10, h=16)[v[0]])
+    if width:
+        value &= _mask(int(width))
+    return value
+
+def to_signed(value, width):
+    """Interprets the bits of 'value' as a two's complement 'width' bit number."""
+    return value - (((value >> (width-1)) & 1) << width)
@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+
+class Writer(object):
+    """A Writer streams generated HDL out to a file.  Rather than
+building the whole module up as a list of lines in memory and dumping
+it at the end, a Bin writes each part of its module into the Writer as
+it is generated.  A part, such as the logic of one Sequence of the Bin
+along with its sub-Sequences, is still built as a list of lines, so
+peak memory follows the largest part rather than the whole module.
+The Writer keeps track of the current indentation level as a context
+so lines do not need to be re-prefixed, and it flushes the text out to
+the file in buffered chunks.
+
+Example::
+
+    w = Writer("foo.v")
+    w.write("always @(posedge clk) begin")
+    with w.indent():
+        w.write("x <= y;")
+    w.write("end")
+    w.close()
+"""
+
+    def __init__(self, filename, comment="//", header=True, stamp=True, chunk_size=1<<16):
+        """
+:param filename: The file to write.
+:param comment: The comment string of the language being written.  Used for the header.
+:param header: If True, the autogenerated 'DO NOT EDIT' header is written at the top of the file.
+:param stamp: If True, the header records when and by whom the file was generated.  Set this to False when the file contents must depend only on what generated it (see seq.Manifest).
+:param chunk_size: Approximate number of characters buffered before they are flushed to the file.
+"""
+        self.filename = filename
+        self.comment = comment
+        self.chunk_size = chunk_size
+        self._f = open(filename, "w")
+        self._buf = []
+        self._buf_size = 0
+        self._level = 0
+        self._prefix = ""
+        self.stamp = stamp
+        if header:
+            self.write_header()
+
+    def write_header(self):
+        from datetime import datetime
+        import os
+        self.write("%s %s" % (self.comment, "*"*70))
+        if self.stamp:
+            self.write("%s This file was automatically generated on %s by %s." % (self.comment, datetime.now().strftime("%b %d, %Y at %H:%M"), os.environ["USER"]))
+        else:
+            self.write("%s This file was automatically generated." % (self.comment, ))
+        self.write("%s DO NOT EDIT THIS FILE BY HAND!!!!  Your changes will be overwritten" % (self.comment, ))
+        self.write("%s %s" % (self.comment, "*"*70))
+
+    @contextmanager
+    def indent(self, levels=1):
+        """Context manager that indents all lines written within it by
+        'levels' additional indentation levels (two spaces each)."""
+        self._level += levels
+        self._prefix = "  " * self._level
+        try:
+            yield self
+        finally:
+            self._level -= levels
+            self._prefix = "  " * self._level
+
+    def write(self, line):
+        """Writes a single line at the current indentation level."""
+        self._buf.append(self._prefix)
+        self._buf.append(line)
+        self._buf.append("\n")
+        self._buf_size += len(line) + len(self._prefix) + 1
+        if self._buf_size >= self.chunk_size:
+            self.flush()
+
+    def extend(self, lines):
+        """Writes each line in the iterable 'lines'."""
+        for l in lines:
+            self.write(l)
+
+    def flush(self):
+        self._f.write("".join(self._buf))
+        self._buf = []
+        self._buf_size = 0
+
+    def close(self):
+        self.flush()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -56,3 +56,88 @@ def calc_width(num):
     import math
     width = int(math.ceil(math.log(num, 2)))
     return width
+
+def vlog_mux_tree(sel, width, values, default, sel_width=1):
+    """Returns a verilog expression that is values[i] when the low
+    'width' bits of the signal named 'sel' are i, or 'default' when they
+    are past the end of 'values'.  The expression is a balanced tree of
+    ternaries on the bits of 'sel', so it is 'width' ternaries deep
+    rather than the len(values) of a chain of (sel == i) compares.
+    'sel_width' is the width 'sel' is declared with."""
+    values = values + [ default ] * ((1 << width) - len(values))
+    def tree(bit, values):
+        if bit < 0:
+            return values[0]
+        half = len(values) / 2
+        lo, hi = tree(bit-1, values[:half]), tree(bit-1, values[half:])
+        if lo == hi:
+            return lo
+        if max(width, sel_width) > 1:
+            bit = "%s[%d]" % (sel, bit)
+        else:
+            bit = sel
+        return "%s ? %s : %s" % (bit, paren(hi), paren(lo))
+    def paren(x):
+        if "?" in x:
+            return "(%s)" % x
+        return x
+    return tree(width-1, values)
+
+def vlog_eq(sel, width, value):
+    """Returns a verilog expression that is true when the signal named
+    'sel' of 'width' bits is 'value', simplified when it is trivial."""
+    if sel.isdigit():
+        return "1" if int(sel) == value else "0"
+    if value >= (1 << width):
+        return "0"
+    if width == 1:
+        return sel if value else "!%s" % sel
+    return "(%s==%d)" % (sel, value)
+
+def vlog_and(*terms):
+    """Returns the verilog expression that ANDs the 1 bit 'terms',
+    dropping the terms that are 1 and repeated terms."""
+    s = []
+    for t in terms:
+        if t == "0":
+            return "0"
+        if t != "1" and not(t in s):
+            s.append(t)
+    if not s:
+        return "1"
+    return " & ".join([ x if _vlog_atom(x) else "(%s)" % x for x in s ])
+
+def _vlog_atom(x):
+    """True when the expression 'x' needs no parentheses as an operand."""
+    if x.startswith("!"):
+        x = x[1:]
+    if not x.startswith("("):
+        return not(" " in x)
+    depth = 0
+    for i, c in enumerate(x):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i == len(x)-1
+    return False
+
+
+class Wires(object):
+    """A hash-consed table of the wires declared for the combinational
+logic of a module.  Each distinct expression is built only once: a
+later wire of an expression that an earlier wire already computes is
+declared as an alias of the earlier one.  Sequences pass the names of
+these wires down to their subseqs rather than the expressions, so the
+expressions stay short however deeply the Sequences nest."""
+    def __init__(self):
+        self._names = {}
+
+    def wire(self, name, expr):
+        """Returns the declaration of the 1 bit wire 'name' computing 'expr'."""
+        if self._names.has_key(expr):
+            expr = self._names[expr]
+        elif not _vlog_atom(expr):
+            self._names[expr] = name
+        return "wire %s = %s;" % (name, expr)
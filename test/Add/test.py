@@ -14,10 +14,8 @@ out5 = seq.Signal("out5", width=3, signed=True)
 out6 = seq.Signal("out6", width=4, signed=True)
 out7 = seq.Signal("out7", width=20, signed=True)
 
-test1 = Bin.Bin(
-    name = "test1",
-    regs = [ out1, out2, out3, out4, out5, out6, out7 ],
-    seqs = [
+def adds():
+    return [
         Sequence.Add(a=a1, b=b1, out="out1"),
         Sequence.Add(a=a2, b=b2, out="out2"),
         Sequence.Add(a=a1, b=b1, out="out3"),
@@ -26,5 +24,48 @@ test1 = Bin.Bin(
         Sequence.Add(a=a2, b=b2, out=out6,   clamp=True),
         Sequence.Add(a=a2, b=b2, out=out7,   clamp=True),
         ]
+
+test1 = Bin.Bin(
+    name = "test1",
+    regs = [ out1, out2, out3, out4, out5, out6, out7 ],
+    seqs = adds(),
     )
 test1.vlog_dump()
+
+# the same Bin with a shared inactive arm in its state machine, which
+# must run cycle for cycle the same
+test3 = Bin.Bin(
+    name = "test3",
+    shared_inactive = True,
+    regs = [ out1, out2, out3, out4, out5, out6, out7 ],
+    seqs = adds(),
+    )
+test3.vlog_dump()
+
+# the same sums from adders shared between the Sequences, including
+# mixed signed and unsigned operands and int operands
+out8  = seq.Signal("out8",  width=5, signed=False)
+out9  = seq.Signal("out9",  width=4, signed=False)
+out10 = seq.Signal("out10", width=5, signed=True)
+out11 = seq.Signal("out11", width=3, signed=True)
+out12 = seq.Signal("out12", width=5, signed=True)
+out13 = seq.Signal("out13", width=5, signed=False)
+out14 = seq.Signal("out14", width=5, signed=True)
+out15 = seq.Signal("out15", width=5, signed=True)
+
+test2 = Bin.Bin(
+    name = "test2",
+    share_units = True,
+    regs = [ out8, out9, out10, out11, out12, out13, out14, out15 ],
+    seqs = [
+        Sequence.Add(a=a1, b=b1, out=out8),
+        Sequence.Add(a=a1, b=b1, out=out9,  clamp=True),
+        Sequence.Add(a=a2, b=b2, out=out10),
+        Sequence.Add(a=a2, b=b2, out=out11, clamp=True),
+        Sequence.Add(a=a1, b=b2, out=out12),
+        Sequence.Add(a=a1, b=b2, out=out13),
+        Sequence.Add(a=a2, b=5,  out=out14),
+        Sequence.Add(a=a2, b=6,  out=out15),
+        ]
+    )
+test2.vlog_dump()
@@ -1,7 +1,7 @@
 module test_tb();
-   reg clk, reset_n, start, runA, runB, passing;
-   reg [2:0] seq;
-   wire running, running1, done1;
+   reg clk, reset_n, start, start2, runA, runB, passing;
+   reg [3:0] seq;
+   wire running, running1, done1, running2, done2, running3, done3;
    reg [3:0]  a1, b1;
    wire [4:0] out1;
    reg [4:0]  out1_should_be;
@@ -25,8 +25,33 @@ module test_tb();
    wire signed [19:0] out7;
    reg signed [19:0]  out7_should_be;
 
+   // from the shared adders of test2
+   wire [4:0] out8, out13;
+   reg [4:0]  out8_should_be, out13_should_be;
 
-   assign running = running1; // || running2;
+   wire [3:0] out9;
+   reg [3:0]  out9_should_be;
+
+   wire signed [4:0] out10, out12, out14, out15;
+   reg signed [4:0]  out10_should_be, out12_should_be, out14_should_be, out15_should_be;
+
+   wire signed [2:0] out11;
+   reg signed [2:0]  out11_should_be;
+
+   // from test3, which runs the Sequences of test1 with shared_inactive
+   wire [4:0] out1_3;
+   wire signed [4:0] out2_3;
+   wire [3:0] out3_3, out4_3;
+   wire signed [2:0] out5_3;
+   wire signed [3:0] out6_3;
+   wire signed [19:0] out7_3;
+
+   assign running = running1 || running2;
+
+   // test3 is started with test1 and must run cycle for cycle the same
+   always @(posedge clk) begin
+      if(reset_n && (running3 != running1 || done3 != done1)) passing = 0;
+   end
    
    always #1 clk = !clk;
    
@@ -35,6 +60,7 @@ module test_tb();
       reset_n = 0;
       seq = 0;
       start = 0;
+      start2 = 0;
       passing = 1;
       a1 = 0;
       b1 = 0;
@@ -59,6 +85,15 @@ module test_tb();
 	    out6_should_be = (a2+b2 > 7)  ? 7  : 
 			     (a2+b2 < -8) ? -8 : a2+b2;
 	    out7_should_be = a2+b2;
+	    out8_should_be = a1+b1;
+	    out9_should_be = (a1+b1 > 15) ? 15 : a1+b1;
+	    out10_should_be = a2+b2;
+	    out11_should_be = (a2+b2 > 3)  ? 3  : 
+			      (a2+b2 < -4) ? -4 : a2+b2;
+	    out12_should_be = a1+b2; // unsigned, as one operand is
+	    out13_should_be = a1+b2;
+	    out14_should_be = a2+5;
+	    out15_should_be = a2+6;
 	    passing = (out1 == out1_should_be) && passing;
 	    passing = (out2 == out2_should_be) && passing;
 	    passing = (out3 == out3_should_be) && passing;	    
@@ -66,6 +101,16 @@ module test_tb();
 	    passing = (out5 == out5_should_be) && passing;	    
 	    passing = (out6 == out6_should_be) && passing;	    
 	    passing = (out7 == out7_should_be) && passing;	    
+	    passing = (out8 == out8_should_be) && passing;
+	    passing = (out9 == out9_should_be) && passing;
+	    passing = (out10 == out10_should_be) && passing;
+	    passing = (out11 == out11_should_be) && passing;
+	    passing = (out12 == out12_should_be) && passing;
+	    passing = (out13 == out13_should_be) && passing;
+	    passing = (out14 == out14_should_be) && passing;
+	    passing = (out15 == out15_should_be) && passing;
+	    passing = (out1_3 == out1) && (out2_3 == out2) && (out3_3 == out3) && (out4_3 == out4) && passing;
+	    passing = (out5_3 == out5) && (out6_3 == out6) && (out7_3 == out7) && passing;
 	    //$display("a1=%d b1=%d out1=%d (%d) a2=%d b2=%d out2=%d (%d) out3=%d (%d) out4=%d (%d) out5=%d, out6=%d out7=%d PASS=%d", a1, b1, out1, out1_should_be, a2, b2, out2, out2_should_be, out3, out3_should_be, out4, out4_should_be, out5, out6, out7, passing);
 
 	    if(b1==15) runB=0;
@@ -86,7 +131,7 @@ module test_tb();
       .b1				(b1),
       .a2				(a2),
       .b2				(b2),
-      .seq				(seq),
+      .seq				(seq[2:0]),
       .start				(start),
       .out1				(out1),
       .out2				(out2),
@@ -98,6 +143,49 @@ module test_tb();
       .running				(running1),
       .done				(done1)
       );
+
+   test3 test3
+     (
+      .clk				(clk),
+      .reset_n				(reset_n),
+      .a1				(a1),
+      .b1				(b1),
+      .a2				(a2),
+      .b2				(b2),
+      .seq				(seq[2:0]),
+      .start				(start),
+      .out1				(out1_3),
+      .out2				(out2_3),
+      .out3				(out3_3),
+      .out4				(out4_3),
+      .out5				(out5_3),
+      .out6				(out6_3),
+      .out7				(out7_3),
+      .running				(running3),
+      .done				(done3)
+      );
+
+   test2 test2
+     (
+      .clk				(clk),
+      .reset_n				(reset_n),
+      .a1				(a1),
+      .b1				(b1),
+      .a2				(a2),
+      .b2				(b2),
+      .seq				(seq[2:0]),
+      .start				(start2),
+      .out8				(out8),
+      .out9				(out9),
+      .out10				(out10),
+      .out11				(out11),
+      .out12				(out12),
+      .out13				(out13),
+      .out14				(out14),
+      .out15				(out15),
+      .running				(running2),
+      .done				(done2)
+      );
    
    task doit;
       begin
@@ -114,6 +202,17 @@ module test_tb();
    	      @(posedge clk);
             @(posedge clk);
 	 end
+
+	 for(seq=0; seq<8; seq=seq+1) begin
+            start2 <= 1;
+            @(posedge clk) 
+   	      start2 <= 0;
+            @(posedge clk);
+   
+            while(running)
+   	      @(posedge clk);
+            @(posedge clk);
+	 end
       end
    endtask
 endmodule
\ No newline at end of file
@@ -49,5 +49,31 @@ test1 = Bin.Bin(
     )
 test1.vlog_dump()
 
+# the same products from multipliers shared between the Sequences,
+# including mixed signed and unsigned operands, int operands and
+# pipelined Multiplys
+out15 = seq.Signal("out15", width=8, signed=False)
+out16 = seq.Signal("out16", width=8, signed=False)
+out17 = seq.Signal("out17", width=8, signed=True)
+out18 = seq.Signal("out18", width=6, signed=True)
+out19 = seq.Signal("out19", width=8, signed=True)
+out20 = seq.Signal("out20", width=8, signed=False)
+out21 = seq.Signal("out21", width=8, signed=True)
+out22 = seq.Signal("out22", width=8, signed=True)
 
-#Bin.Bin(name="test2", 
+test2 = Bin.Bin(
+    name = "test2",
+    share_units = True,
+    regs = [ out15, out16, out17, out18, out19, out20, out21, out22, ],
+    seqs = [
+        Sequence.Multiply(a=a1, b=b1, out=out15),
+        Sequence.Multiply(a=a1, b=b1, out=out16, pipeline=2),
+        Sequence.Multiply(a=a2, b=b2, out=out17, pipeline=3),
+        Sequence.Multiply(a=a2, b=b2, out=out18, justify="right", clamp=True, pipeline=2),
+        Sequence.Multiply(a=a1, b=b2, out=out19),
+        Sequence.Multiply(a=a1, b=b2, out=out20, pipeline=2),
+        Sequence.Multiply(a=a2, b=5,  out=out21, justify="right"),
+        Sequence.Multiply(a=a2, b=6,  out=out22, justify="right", pipeline=2),
+        ]
+    )
+test2.vlog_dump()
@@ -1,7 +1,7 @@
 module test_tb();
-   reg clk, reset_n, start, runA, runB, passing;
+   reg clk, reset_n, start, start2, runA, runB, passing;
    reg [3:0] seq;
-   wire running, running1, done1;
+   wire running, running1, done1, running2, done2;
    reg [3:0]  a1, b1;
    reg signed [3:0]  a2, b2;
 
@@ -23,7 +23,17 @@ module test_tb();
    wire signed [9:0] out14, out12;
    reg signed [9:0]  out14_should_be, out12_should_be;
 
-   assign running = running1; // || running2;
+   // from the shared multipliers of test2
+   wire [7:0] out15, out16, out20;
+   reg [7:0]  out15_should_be, out16_should_be, out20_should_be;
+
+   wire signed [7:0] out17, out19, out21, out22;
+   reg signed [7:0]  out17_should_be, out19_should_be, out21_should_be, out22_should_be;
+
+   wire signed [5:0] out18;
+   reg signed [5:0]  out18_should_be;
+
+   assign running = running1 || running2;
    
    always #1 clk = !clk;
    
@@ -32,6 +42,7 @@ module test_tb();
       reset_n = 0;
       seq = 0;
       start = 0;
+      start2 = 0;
       passing = 1;
       a1 = 0;
       b1 = 0;
@@ -61,6 +72,14 @@ module test_tb();
 	    out12_should_be= a2*b2;
 	    out13_should_be= { out1_should_be, 2'b0 };
 	    out14_should_be= { out2_should_be, 2'b0 };
+	    out15_should_be= a1*b1;
+	    out16_should_be= a1*b1;
+	    out17_should_be= a2*b2;
+	    out18_should_be= (a2*b2 > 31) ? 31 : (a2*b2 < -32) ? -32 : a2*b2;
+	    out19_should_be= a1*b2; // unsigned, as one operand is
+	    out20_should_be= a1*b2;
+	    out21_should_be= a2*5;
+	    out22_should_be= a2*6;
 	    
 	    passing = (out1 == out1_should_be) && passing;
 	    passing = (out2 == out2_should_be) && passing;
@@ -76,6 +95,14 @@ module test_tb();
 	    passing = (out12 == out12_should_be) && passing;	    
 	    passing = (out13 == out13_should_be) && passing;	    
 	    passing = (out14 == out14_should_be) && passing;	    
+	    passing = (out15 == out15_should_be) && passing;
+	    passing = (out16 == out16_should_be) && passing;
+	    passing = (out17 == out17_should_be) && passing;
+	    passing = (out18 == out18_should_be) && passing;
+	    passing = (out19 == out19_should_be) && passing;
+	    passing = (out20 == out20_should_be) && passing;
+	    passing = (out21 == out21_should_be) && passing;
+	    passing = (out22 == out22_should_be) && passing;
 	    //$display("a1=%d b1=%d out1=%d (%d) a2=%d b2=%d out2=%d (%d) out3=%d (%d) PASS=%d", a1, b1, out1, out1_should_be, a2, b2, out2, out2_should_be, out3, out3_should_be, passing);
 	    if(b1==15) runB=0;
 	    b1=b1+1;
@@ -114,6 +141,28 @@ module test_tb();
       .running				(running1),
       .done				(done1)
       );
+
+   test2 test2
+     (
+      .clk				(clk),
+      .reset_n				(reset_n),
+      .a1				(a1),
+      .b1				(b1),
+      .a2				(a2),
+      .b2				(b2),
+      .seq				(seq[2:0]),
+      .start				(start2),
+      .out15				(out15),
+      .out16				(out16),
+      .out17				(out17),
+      .out18				(out18),
+      .out19				(out19),
+      .out20				(out20),
+      .out21				(out21),
+      .out22				(out22),
+      .running				(running2),
+      .done				(done2)
+      );
    
    task doit;
       begin
@@ -130,6 +179,17 @@ module test_tb();
    	      @(posedge clk);
             @(posedge clk);
 	 end
+
+	 for(seq=0; seq<8; seq=seq+1) begin
+            start2 <= 1;
+            @(posedge clk) 
+   	      start2 <= 0;
+            @(posedge clk);
+
+            while(running)
+   	      @(posedge clk);
+            @(posedge clk);
+	 end
       end
    endtask
    
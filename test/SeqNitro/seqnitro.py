@@ -12,6 +12,7 @@ bin1 = Bin.Bin(
     children=[],
     seqs = [
         SeqNitro.Set(name="abc", terminal=term, set=dict(a=1, b=300,c=1)),
+        SeqNitro.Set(name="abc4", terminal=term, set=dict(a=0, b=7,c=1), shadow="commit"),
         Seq.Set(name="abc2", set=dict(a=0, b=101, c=1)),
         Seq.Set(name="abc3", set=dict(a=1, b=222, c=0)),
         ]
@@ -25,11 +26,23 @@ bin2 = Bin.Bin(
     seqs = [
         SeqNitro.Serial(name="bin1_seqs", terminal=term, 
                         subseqs=["abc2", "abc3",],
-                        extra=2)
+                        extra=2),
+        SeqNitro.Serial(name="bin1_shadow", terminal=term,
+                        subseqs=["abc2", "abc4",],
+                        shadow="done"),
+        SeqNitro.SerialRAM(name="bin1_prog", terminal=term,
+                           subseqs=["abc2", "abc3", "abc2"],
+                           depth=64),
         ]
     )
 
-bin2.vlog_dump(recurse=True)
+SeqNitro.add_counters(term, bin2, counters=["bin1_seqs", "abc", "bin1"], counter_width=16)
+bin2.vlog_dump(recurse=True, counters=["bin1_seqs", "abc", "bin1"], counter_width=16)
 
 di = nitro.DeviceInterface(name="test_di", terminal_list=[term,])
 nitro.XmlWriter("test.xml").write(di)
+
+# reprogram bin1_seqs with only the registers that change
+bin1_seqs = bin2.seqs[0]
+loaded = bin1_seqs.program_image(["abc2", "abc3"])
+print bin1_seqs.program_writes(["abc2", "abc", "abc3"], loaded)
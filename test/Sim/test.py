@@ -0,0 +1,633 @@
+import seq
+from seq import Bin, Sequence, Sim
+
+# Simulates Bins in Python with seq.Sim and checks the results without
+# generating any verilog.  See the Add, Multiply, and SerialMultiply
+# tests for the same checks done in verilog.
+
+def signed(x, width):
+    return Sim.to_signed(x & ((1 << width)-1), width)
+
+a1 = seq.Signal("a1", width=4)
+b1 = seq.Signal("b1", width=4)
+a2 = seq.Signal("a2", width=4, signed=True)
+b2 = seq.Signal("b2", width=4, signed=True)
+
+out1 = seq.Signal("out1", width=8, signed=False)
+out2 = seq.Signal("out2", width=8, signed=True)
+out3 = seq.Signal("out3", width=6, signed=False)
+out4 = seq.Signal("out4", width=6, signed=True)
+out5 = seq.Signal("out5", width=4, signed=False)
+out6 = seq.Signal("out6", width=3, signed=True)
+
+test1 = Bin.Bin(
+    name = "test1",
+    regs = [ out1, out2, out3, out4, out5, out6, ],
+    seqs = [
+        Sequence.SerialMultiply(a=a1, b=b1, out="out1"),
+        Sequence.SerialMultiply(a=a2, b=b2, out=out2),
+        Sequence.SerialMultiply(a=a1, b=b1, out="out3"),
+        Sequence.Multiply(a=a2, b=b2, out=out4, justify="right", clamp=True),
+        Sequence.Add(a=a1, b=b1, out=out5, clamp=True),
+        Sequence.Add(a=a2, b=b2, out=out6, clamp=True),
+        ]
+    )
+
+sim = Sim.Simulator(test1)
+passing = True
+for a in range(16):
+    for b in range(16):
+        sim["a1"] = a
+        sim["b1"] = b
+        sim["a2"] = a
+        sim["b2"] = b
+        for i in range(len(test1.seqs)):
+            sim.run(i)
+            sim.step()
+        sa, sb = signed(a, 4), signed(b, 4)
+        passing = (sim["out1"] == a*b) and passing
+        passing = (sim["out2"] == sa*sb) and passing
+        passing = (sim["out3"] == (a*b) >> 2) and passing
+        passing = (sim["out4"] == max(-32, min(31, sa*sb))) and passing
+        passing = (sim["out5"] == min(15, a+b)) and passing
+        passing = (sim["out6"] == max(-4, min(3, sa+sb))) and passing
+
+# radix 4 SerialMultiplys give the same products in about half the cycles
+a3 = seq.Signal("a3", width=5, signed=True)
+b3 = seq.Signal("b3", width=3, signed=True)
+out7 = seq.Signal("out7", width=6, signed=True)
+test1r4 = Bin.Bin(
+    name = "test1r4",
+    regs = [ out1, out2, out3, out7, ],
+    seqs = [
+        Sequence.SerialMultiply(a=a1, b=b1, out="out1", radix=4),
+        Sequence.SerialMultiply(a=a2, b=b2, out=out2, radix=4),
+        Sequence.SerialMultiply(a=a1, b=b1, out="out3", radix=4),
+        Sequence.SerialMultiply(a=a3, b=b3, out=out7, radix=4),
+        ]
+    )
+sim = Sim.Simulator(test1r4)
+for a in range(32):
+    for b in range(16):
+        sim["a1"] = sim["a2"] = a & 15
+        sim["b1"] = sim["b2"] = b
+        sim["a3"] = a
+        sim["b3"] = b & 7
+        passing = ([ sim.run(i) for i in range(4) ] == [ 4, 3, 4, 3 ]) and passing
+        sa, sb = signed(a, 4), signed(b, 4)
+        passing = (sim["out1"] == (a & 15)*b) and passing
+        passing = (sim["out2"] == sa*sb) and passing
+        passing = (sim["out3"] == ((a & 15)*b) >> 2) and passing
+        passing = (sim["out7"] == (signed(a, 5)*signed(b, 3)) >> 2) and passing
+
+# pipelined Multiplys are done after 'pipeline' cycles with the same
+# products, and a Repeat starts them every cycle
+outs = [ seq.Signal("p%d" % i, width=6, signed=True) for i in range(4) ]
+test1p = Bin.Bin(
+    name = "test1p",
+    regs = outs + [ out1, ],
+    seqs = [ Sequence.Multiply(a=a2, b=b2, out=outs[i], justify="right", clamp=True, pipeline=i+1) for i in range(4) ] +
+           [ Sequence.Repeat(subseq=Sequence.Multiply(a=a1, b=3, out=out1, justify="right", pipeline=3), count=b1) ]
+    )
+sim = Sim.Simulator(test1p)
+for a in range(16):
+    for b in range(16):
+        sim["a2"] = a
+        sim["b2"] = b
+        passing = ([ sim.run(i) for i in range(4) ] == [ 2, 3, 4, 5 ]) and passing
+        passing = ([ sim["p%d" % i] for i in range(4) ] == [ max(-32, min(31, signed(a, 4)*signed(b, 4))) ]*4) and passing
+    sim["a1"] = a
+    passing = (sim.run(4, b1=a) == (a or 16) + 3 and sim["out1"] == 3*a) and passing
+
+# MultiplyAccumulates add the products to out, in one cycle or a cycle
+# per bit of b, and start over when cleared
+clear = seq.Signal("clear", width=1)
+acc1 = seq.Signal("acc1", width=7)
+acc2 = seq.Signal("acc2", width=6, signed=True)
+test1m = Bin.Bin(
+    name = "test1m",
+    regs = [ acc1, acc2, ],
+    seqs = [ Sequence.MultiplyAccumulate(a=a1, b=b1, out=acc1, justify="right", clamp=True, clear=clear, serial=serial) for serial in [False, True] ] +
+           [ Sequence.MultiplyAccumulate(a=a2, b=b2, out=acc2, clamp=True, clear=clear, serial=serial) for serial in [False, True] ]
+    )
+sim = Sim.Simulator(test1m)
+for i, serial in enumerate([False, True]):
+    x1 = x2 = 0
+    for a in range(16):
+        for b in range(0, 16, 3):
+            cycles = [ sim.run(i, a1=a, b1=b, clear=(b == 0)), sim.run(i+2, a2=a, b2=b, clear=(b == 0)) ]
+            passing = (cycles == [ 5 if serial else 2 ]*2) and passing
+            x1 = min(127, a*b + (x1 if b else 0))
+            x2 = max(-32, min(31, ((signed(a, 4)*signed(b, 4)) >> 2) + (x2 if b else 0)))
+            passing = (sim["acc1"] == x1 and sim["acc2"] == x2) and passing
+
+# check the cycle counts of some Sequences that take many cycles
+count = seq.Signal("count", width=4)
+x = seq.Signal("x", width=4, init=0)
+test2 = Bin.Bin(
+    name = "test2",
+    regs = [ x, ],
+    seqs = [
+        Sequence.Stall(name="stall", count=10),
+        Sequence.Repeat(name="repeat", subseq=Sequence.Set(set=dict(x=1)), count=count),
+        Sequence.CountUp(name="count", reg="x", stop=12, skip=3),
+        ]
+    )
+# check both the compiled Program and the interpreter
+for compiled in [True, False]:
+    sim = Sim.Simulator(test2, compiled=compiled)
+    passing = (sim.run("stall") == 11) and passing
+    for c in range(1, 16):
+        passing = (sim.run("repeat", count=c) == c+1) and passing
+    sim["count"] = 0 # runs the max number of times
+    passing = (sim.run("repeat") == 17) and passing
+    sim.reset()
+    sim.run("count")
+    passing = (sim["x"] == 12) and passing
+
+# long Stalls and Repeats are fast-forwarded by the compiled Program
+count16 = seq.Signal("count16", width=16)
+test3 = Bin.Bin(
+    name = "test3",
+    regs = [ x, ],
+    seqs = [
+        Sequence.Stall(name="stall", count=1000000),
+        Sequence.Repeat(name="repeat", subseq=Sequence.Set(set=dict(x=2)), count=count16),
+        Sequence.Repeat(name="repeat_stall", subseq=Sequence.Stall(count=5000), count=300),
+        ]
+    )
+sim = Sim.Simulator(test3)
+passing = (sim.run("stall", max_cycles=2000000) == 1000001) and passing
+sim["count16"] = 0 # runs the max number of times
+passing = (sim.run("repeat") == 65537) and passing
+passing = (sim["x"] == 2) and passing
+passing = (sim.run("repeat_stall", max_cycles=2000000) == 300*5000 + 1) and passing
+sim["seq"] = 0
+sim["start"] = 1
+sim.step()
+sim["start"] = 0
+sim.step(999999)
+passing = (sim["running"] == 1 and sim["done"] == 0) and passing
+sim.step()
+passing = (sim["done"] == 1) and passing
+
+# check the static latency analysis against the simulated cycle counts
+y = seq.Signal("y", width=4, init=0)
+trig = seq.Signal("trig", width=1, init=0)
+sel = seq.Signal("sel", width=2)
+term = seq.Signal("term", width=2)
+test4 = Bin.Bin(
+    name = "test4",
+    regs = [ y, trig, ],
+    children = [ test2, ],
+    seqs = [
+        Sequence.Serial(name="serial", term=term, subseqs=[
+            Sequence.Child(sequence="stall"),
+            Sequence.Repeat(subseq=Sequence.Stall(count=count), count=3),
+            Sequence.Parallel(subseqs=[Sequence.Set(set=dict(y=13)), Sequence.Child(sequence="repeat")]),
+            Sequence.Select(sel=sel, subseqs=[Sequence.Nop(), Sequence.Stall(count=4), Sequence.Trigger(reg="trig")]),
+            ]),
+        Sequence.CountDown(name="down", reg="y", stop=1, skip=2),
+        ]
+    )
+latency = test4.latency()
+passing = (str(latency["down"]) == "max(1, ceil((y - 1)/2)) + 1") and passing
+passing = (latency["down"].min == 2 and latency["down"].max == 8) and passing
+sim = Sim.Simulator(test4)
+for term_ in range(4):
+    for count_ in range(16):
+        for sel_ in range(3):
+            values = dict(term=term_, count=count_, sel=sel_)
+            passing = (sim.run("serial", **values) == latency["serial"].eval(values)) and passing
+values = dict(y=sim["y"])
+passing = (sim.run("down") == latency["down"].eval(values)) and passing
+passing = (sim["y"] == 1) and passing
+
+# unrolled Repeats run rounds of loops in lanes at the same time
+lanes = [ seq.Signal("lane%d" % i, width=3) for i in range(3) ]
+count3 = seq.Signal("count3", width=3)
+test4u = Bin.Bin(
+    name = "test4u",
+    seqs = [ Sequence.Repeat(subseq=Sequence.Stall(count=3), count=count3, unroll=k) for k in [ 1, 2, 8 ] ] +
+           [ Sequence.Repeat(subseq=Sequence.Stall(count=2), count=5, unroll=3, counter=lanes) ],
+    )
+latency = test4u.latency()
+passing = (str(latency[test4u.seqs[1].name]) == "3*ceil((count3 ? count3 : 8)/2) + 1") and passing
+sim = Sim.Simulator(test4u)
+for count_ in range(8):
+    passing = ([ sim.run(i, count3=count_) for i in range(3) ] == [ latency[x.name].eval(dict(count3=count_)) for x in test4u.seqs[:3] ]) and passing
+passing = (sim.run(3) == 5 and [ sim["lane%d" % i] for i in range(3) ] == [ 3, 4, 2 ]) and passing
+try:
+    Sequence.Repeat(subseq=Sequence.Child(sequence="stall"), count=2, unroll=2)
+    passing = False
+except Exception:
+    pass
+
+# Bins with lookahead start their children in the cycle a Child starts,
+# which saves a cycle on every Child
+h = seq.Signal("h", width=4, init=0)
+test4h = Bin.Bin(
+    name = "test4h",
+    regs = [ h, ],
+    seqs = [ Sequence.Set(name="h_set", set=dict(h=9)), Sequence.Toggle(name="h_toggle", reg="h") ],
+    )
+pick = seq.Signal("pick", width=3)
+def handoff(lookahead):
+    return Bin.Bin(
+        name = "test4l%d" % lookahead,
+        children = [ test2, test4h, ],
+        lookahead = lookahead,
+        seqs = [
+            Sequence.Serial(name="chain", subseqs=[ "stall", "repeat", "h_set" ]),
+            Sequence.Repeat(name="loop", subseq=Sequence.Serial(subseqs=[ "h_toggle", "repeat" ]), count=count),
+            Sequence.Child(name="prog", sequence=pick),
+            ]
+        )
+bins = [ handoff(False), handoff(True) ]
+for count_ in range(4):
+    for pick_ in [ 0, 1, 4, 5 ]:
+        values = dict(count=count_, pick=pick_)
+        cycles = []
+        for bin in bins:
+            latency = bin.latency()
+            sim = Sim.Simulator(bin)
+            cycles.append([ sim.run(n, **values) for n in [ "chain", "loop", "prog" ] ])
+            passing = (cycles[-1] == [ latency[n].eval(values) for n in [ "chain", "loop", "prog" ] ]) and passing
+            h_ = 9 ^ 15*((count_ or 16) & 1)
+            if pick_ == 4:
+                h_ = 9
+            elif pick_ == 5:
+                h_ ^= 15
+            passing = (sim["x"] == 1 and sim["h"] == h_) and passing
+        saved = [ 3, 2*(count_ or 16), 1 ]
+        passing = ([ cycles[0][i] - cycles[1][i] for i in range(3) ] == saved) and passing
+test4n = Bin.Bin(name="test4n", register_done=False, seqs=[ Sequence.Stall(name="n_stall", count=2) ])
+try:
+    Bin.Bin(name="test4m", children=[ test4n, ], lookahead=True, seqs=[ Sequence.Child(sequence="n_stall") ])
+    passing = False
+except Exception:
+    pass
+
+# a Bin with a queue starts the pushed Sequences back to back, each in
+# the cycle the one before it is done, and counts the pushes it drops
+q = seq.Signal("q", width=4, init=0)
+test4q = Bin.Bin(
+    name = "test4q",
+    regs = [ q, ],
+    queue = 2,
+    overflow_width = 2,
+    seqs = [ Sequence.Stall(name="q_stall", count=3), Sequence.Toggle(name="q_tog", reg="q") ],
+    )
+test4p = Bin.Bin(name="test4p", children=[ test4q, ], seqs=[ Sequence.Serial(name="p_ser", subseqs=[ "q_stall", "q_tog" ]) ])
+for compiled in [True, False]:
+    sim = Sim.Simulator(test4q, compiled=compiled)
+    passing = (sim.run("q_stall") == test4q.latency()["q_stall"].eval({}) == 5) and passing
+    dones = []
+    for c in range(16):
+        sim["push"] = int(c < 6)
+        sim["push_seq"] = c % 2
+        sim.step()
+        if sim["done"]:
+            dones.append(c+1)
+        if c == 3:
+            passing = (sim["test4q_full"] == 1 and sim["test4q_ready"] == 0) and passing
+    passing = (dones == [ 5, 7, 11 ] and sim["q"] == 15 and sim["test4q_overflow"] == 3 and sim["test4q_ready"] == 1) and passing
+    sim = Sim.Simulator(test4p, compiled=compiled)
+    passing = (sim.run("p_ser") == test4p.latency()["p_ser"].eval({}) == 11 and sim["q"] == 15) and passing
+# the depth of the queue is part of the structure of the Bin
+def queued(depth):
+    return Bin.Bin(name="test4d", queue=depth, seqs=[ Sequence.Stall(name="d_stall", count=3) ])
+passing = (queued(2).structural_hash() != queued(8).structural_hash() and queued(2).structural_hash() == queued(2).structural_hash()) and passing
+try:
+    Bin.Bin(name="test4r", queue=-1, seqs=[ Sequence.Nop() ])
+    passing = False
+except Exception:
+    pass
+
+# a Microcode runs the same program as a Serial from a ROM
+m = seq.Signal("m", width=4, init=0)
+mt = seq.Signal("mt", width=1, init=0)
+def mprog():
+    return [ Sequence.Set(set=dict(m=3)), Sequence.Stall(count=1000, set=dict(m=5)), Sequence.Trigger(reg="mt"),
+             Sequence.Serial(subseqs=[ Sequence.Nop(), Sequence.Set(set=dict(m=-1)) ], set=dict(m=2)),
+             Sequence.Trigger(reg="mt", count=3) ]
+test4w = Bin.Bin(
+    name = "test4w",
+    regs = [ m, mt, ],
+    seqs = [
+        Sequence.Serial(name="u_ser", subseqs=mprog(), set=dict(m=1)),
+        Sequence.Microcode(name="u_rom", subseqs=mprog(), set=dict(m=1)),
+        ]
+    )
+latency = test4w.latency()
+for compiled in [True, False]:
+    traces = []
+    for i, n in enumerate([ "u_ser", "u_rom" ]):
+        sim = Sim.Simulator(test4w, compiled=compiled)
+        passing = (sim.run(n) == latency[n].eval({}) == 1009 and sim["m"] == 15 and sim["mt"] == 0) and passing
+        sim.reset()
+        sim["seq"] = i
+        sim["start"] = 1
+        trace = []
+        for c in range(1012):
+            sim.step()
+            sim["start"] = 0
+            trace.append((sim["m"], sim["mt"], sim["running"], sim["done"]))
+        traces.append(trace)
+    passing = (traces[0] == traces[1]) and passing
+try:
+    Bin.Bin(name="test4v", regs=[ m, ], seqs=[ Sequence.Microcode(subseqs=[ Sequence.Stall(count="m") ]) ])
+    passing = False
+except Exception:
+    pass
+
+# Bins of single cycle Sequences become Len1Bins
+test5 = Bin.Bin(
+    name = "test5",
+    regs = [ y, ],
+    seqs = [ Sequence.Set(set=dict(y=5)), Sequence.Toggle(reg="y"), Sequence.Select(sel=sel, subseqs=[Sequence.Nop(), Sequence.Reset()]) ],
+    )
+passing = (test5.len1 and not(test4.len1) and not(test1.len1)) and passing
+sim = Sim.Simulator(test5)
+passing = (sim.run(0) == 1 and sim["y"] == 5 and sim.run(1) == 1 and sim["y"] == 10) and passing
+try:
+    Bin.Len1Bin(name="test6", regs=[ y, ], seqs=[ Sequence.Set(set=dict(y=5)), Sequence.Stall(count=2) ])
+    passing = False
+except Exception:
+    pass
+
+# register the done of just enough Bins to meet a logic depth
+z = seq.Signal("z", width=4, init=0)
+d1 = Bin.Bin(name="d1", regs=[ z, ], register_done=False,
+             seqs=[ Sequence.Stall(name="d1_stall", count=3), Sequence.Set(name="d1_set", set=dict(z=1)) ])
+d2 = Bin.Bin(name="d2", children=[ d1, ], register_done=False,
+             seqs=[ Sequence.Serial(name="d2_ser", subseqs=[ "d1_stall", "d1_set" ]) ])
+d3 = Bin.Bin(name="d3", children=[ d2, ], register_done=False,
+             seqs=[ Sequence.Stall(name="d3_stall", count=2), Sequence.Child(name="d3_run", sequence="d2_ser") ])
+passing = ([ x.logic_depth() for x in [d1, d2, d3] ] == [ 6, 11, 16 ]) and passing
+passing = (d3.limit_logic_depth(16) == [] and d3.limit_logic_depth(8) == [ d1, d2 ]) and passing
+passing = ([ x.logic_depth() for x in [d1, d2, d3] ] == [ 6, 6, 6 ]) and passing
+passing = (d3.limit_logic_depth(6) == []) and passing
+try:
+    d3.limit_logic_depth(5)
+    passing = False
+except Exception:
+    pass
+
+# a balanced tree for the done_ selection is log2 deep in the Sequences
+passing = (seq.vlog_mux_tree("seq", 2, ["d0", "d1", "d2"], "1") == "seq[1] ? (seq[0] ? 1 : d2) : (seq[0] ? d1 : d0)") and passing
+chain = Bin.Bin(name="chain", seqs=[ Sequence.Stall(name="chain%d" % i, count=i+1) for i in range(32) ])
+tree = Bin.Bin(name="tree", seqs=[ Sequence.Stall(name="tree%d" % i, count=i+1) for i in range(32) ], mux_tree=True)
+passing = (chain.logic_depth() == 37 and tree.logic_depth() == 9) and passing
+# and only covers the bits of a Select 'sel' narrower than its subseqs need
+def narrow(width):
+    sel1 = seq.Signal("sel1", width=width)
+    bin = Bin.Bin(name="narrow", mux_tree=True, seqs=[ Sequence.Select(name="ns", sel=sel1, subseqs=[ Sequence.Stall(name="ns%d" % i, count=i+1) for i in range(4) ]) ])
+    return bin.seqs[0]
+passing = (narrow(1)._vlog_mux_tree() == "sel1 ? seq_ns1_done_ : seq_ns0_done_") and passing
+passing = (narrow(3)._vlog_mux_tree() == "(|sel1[2:2]) ? seq_ns3_done_ : (sel1[1] ? (sel1[0] ? seq_ns3_done_ : seq_ns2_done_) : (sel1[0] ? seq_ns1_done_ : seq_ns0_done_))") and passing
+passing = ([ narrow(w).done_depth() for w in [ 1, 2, 3 ] ] == [ 4, 5, 6 ]) and passing
+
+# start wires are simplified and each expression is built only once
+passing = (seq.vlog_and("start", seq.vlog_eq("seq", 1, 0), "1") == "start & !seq") and passing
+passing = (seq.vlog_and("a", seq.vlog_eq("sel", 2, 1), seq.vlog_eq("3", 2, 2)) == "0") and passing
+wires = seq.Wires()
+passing = (wires.wire("a", "x & (y==2)") == "wire a = x & (y==2);" and wires.wire("b", "x & (y==2)") == "wire b = a;") and passing
+
+# simulate all the operand pairs at once in the lanes of a BatchSimulator
+try:
+    import numpy
+except ImportError:
+    numpy = None
+if numpy is not None:
+    sim = Sim.BatchSimulator(test1, 256)
+    a = numpy.arange(256) >> 4
+    b = numpy.arange(256) & 15
+    sa, sb = signed(a, 4), signed(b, 4)
+    sim["a1"] = a
+    sim["b1"] = b
+    sim["a2"] = a
+    sim["b2"] = b
+    for i in range(len(test1.seqs)):
+        sim.run(i)
+        sim.step()
+    passing = (sim["out1"] == a*b).all() and passing
+    passing = (sim["out2"] == sa*sb).all() and passing
+    passing = (sim["out3"] == (a*b) >> 2).all() and passing
+    passing = (sim["out4"] == numpy.clip(sa*sb, -32, 31)).all() and passing
+    passing = (sim["out5"] == numpy.minimum(15, a+b)).all() and passing
+    passing = (sim["out6"] == numpy.clip(sa+sb, -4, 3)).all() and passing
+
+    # each lane runs its own Sequence and count
+    sim = Sim.BatchSimulator(test2, 16)
+    cycles = sim.run(numpy.arange(16) % 2, count=numpy.arange(16))
+    expect = numpy.where(numpy.arange(16) % 2, numpy.arange(16) + 1, 11)
+    passing = (cycles == expect).all() and passing
+
+    # and reads the ROMs of a Microcode at its own address
+    sim = Sim.BatchSimulator(test4w, 4)
+    passing = (sim.run(numpy.arange(4) % 2) == 1009).all() and (sim["m"] == 15).all() and passing
+
+# SeqNitro adds its registers to a nitro terminal.  nitro is only
+# needed for the register objects, which a stand-in records when it is
+# not installed.
+import os, sys, re, shutil, tempfile
+try:
+    import nitro
+except ImportError:
+    import types
+    nitro = types.ModuleType("nitro")
+    class _Register(object):
+        def __init__(self, **kw):
+            self.__dict__.update(kw)
+    nitro.Register = nitro.SubReg = _Register
+    sys.modules["nitro"] = nitro
+from seq import SeqNitro, Writer, Manifest
+
+class Terminal(object):
+    def __init__(self):
+        self.regs = {}
+    def add_child(self, reg):
+        self.regs[reg.name] = reg
+
+tmp = tempfile.mkdtemp()
+def vlog_module(bin, **kw):
+    """Returns the lines of the verilog module of 'bin'."""
+    filename = os.path.join(tmp, bin.name + ".v")
+    w = Writer.Writer(filename, stamp=False)
+    bin.vlog_gen_module(w, **kw)
+    w.close()
+    return open(filename).read().split("\n")
+
+def vlog_balanced(lines):
+    """True when the always blocks of the module 'lines' are not nested
+    and their begins and ends balance."""
+    depth = 0
+    for line in lines:
+        line = line.split("//")[0]
+        if re.search(r"\balways\b", line) and depth:
+            return False
+        depth += len(re.findall(r"\bbegin\b", line)) - len(re.findall(r"\bend\b", line))
+        if depth < 0:
+            return False
+    return depth == 0
+
+# shadow registers committed while a Serial runs are loaded between runs
+term = Terminal()
+sx = seq.Signal("sx", width=4, init=0)
+sy = seq.Signal("sy", width=4, init=0)
+sleaf = Bin.Bin(name="sleaf", regs=[ sx, sy, ],
+                seqs=[ SeqNitro.Set(terminal=term, name="sxy", set=dict(sx=1, sy=2), shadow="commit"),
+                       Sequence.Set(name="sx3", set=dict(sx=3)), Sequence.Stall(name="swait", count=3) ])
+stop = Bin.Bin(name="stop", children=[ sleaf, ],
+               seqs=[ SeqNitro.Serial(terminal=term, name="sprog", subseqs=[ "sxy", "swait", "sx3" ], shadow="commit") ])
+passing = (vlog_balanced(vlog_module(sleaf)) and vlog_balanced(vlog_module(stop))) and passing
+passing = (term.regs.has_key("sprog_commit") and term.regs.has_key("sxy_commit")) and passing
+codes = stop.seqs[0].valuemap
+for compiled in [True, False]:
+    sim = Sim.Simulator(stop, compiled=compiled)
+    sim["sprog_sprog0"], sim["sprog_sprog1"], sim["sprog_sprog2"] = codes["sx3"], codes["swait"], codes["sxy"]
+    sim["sprog_term_num"] = 2
+    sim["sxy_sx"], sim["sxy_sy"] = 7, 8
+    sim["seq"] = 0
+    sim["start"] = 1
+    sim.step()
+    sim["start"] = 0
+    sim.step(3)
+    sim["sprog_commit"] = sim["sxy_commit"] = 1
+    sim.step()
+    sim["sprog_commit"] = sim["sxy_commit"] = 0
+    while not sim["done"]:
+        sim.step()
+    # the run finishes the old program: sxy, swait, sx3
+    passing = ((sim["sx"], sim["sy"]) == (3, 2)) and passing
+    # and the next one runs the new one: sx3, swait, sxy
+    sim.run(0)
+    passing = ((sim["sx"], sim["sy"]) == (7, 8)) and passing
+
+# a SerialRAM runs the words of its RAM, so only the bounds of its
+# latency are known ahead
+rx = seq.Signal("rx", width=4, init=0)
+rleaf = Bin.Bin(name="rleaf", regs=[ rx, ],
+                seqs=[ Sequence.Set(name="rx1", set=dict(rx=1)), Sequence.Stall(name="rwait", count=4),
+                       Sequence.Set(name="rx2", set=dict(rx=2)), ])
+rtop = Bin.Bin(name="rtop", children=[ rleaf, ],
+               seqs=[ SeqNitro.SerialRAM(terminal=Terminal(), name="rprog", subseqs=[ "rx1", "rwait", "rx2" ], depth=5) ])
+latency = rtop.latency()["rprog"]
+passing = (latency.eval(dict(rprog_len=3, rprog_word_=1)) is None and (latency.min, latency.max) == (4, 49)) and passing
+for compiled in [True, False]:
+    sim = Sim.Simulator(rtop, compiled=compiled)
+    for len_ in range(1, 6):
+        cycles = sim.run(0, rprog_len=len_)
+        passing = (latency.min <= cycles <= latency.max) and passing
+
+# steps past the end of the RAM read a word of 0 in the RTL and the Sim
+rtop = Bin.Bin(name="rtop", children=[ rleaf, ],
+               seqs=[ SeqNitro.SerialRAM(terminal=Terminal(), name="rprog", subseqs=[ "rx2" ] * 4) ])
+passing = ("assign rprog_word_ = (ram_rprog_addr_ < 4) ? ram_rprog_mem_[ram_rprog_addr_] : 0;" in [ x.strip() for x in vlog_module(rtop) ]) and passing
+for compiled in [True, False]:
+    sim = Sim.Simulator(rtop, compiled=compiled)
+    sim.run(0, rprog_len=4)
+    passing = (sim["rx"] == 2) and passing
+    sim.run(0, rprog_len=5)
+    passing = (sim["rx"] == 1) and passing
+
+# the host reloads the RAM through the write port
+codes = rtop.seqs[0].valuemap
+for compiled in [True, False]:
+    sim = Sim.Simulator(rtop, compiled=compiled)
+    sim["rprog_we"] = 1
+    for addr, name in enumerate([ "rx2", "rwait", "rx1" ]):
+        sim["rprog_waddr"], sim["rprog_wdata"] = addr, codes[name]
+        sim.step()
+    sim["rprog_we"] = 0
+    passing = (sim.run(0, rprog_len=3) == 13 and sim["rx"] == 1) and passing
+    passing = (sim.run(0, rprog_len=2) == 10 and sim["rx"] == 2) and passing
+    passing = (sim.run(0, rprog_len=1) == 4 and sim["rx"] == 2) and passing
+
+# only the registers that differ from the loaded image are written
+ram = rtop.seqs[0]
+image = ram.program_image([ "rx2" ] * 4)
+writes = [ ("rprog", 1, codes["rwait"]), ("rprog", 2, 0), ("rprog", 3, 0), ("rprog_len", None, 2) ]
+passing = (ram.program_writes([ "rx2", "rwait" ], image) == writes) and passing
+passing = (len(ram.program_writes([ "rx2", "rwait" ])) == 5 and ram.program_writes([ "rx2" ] * 4, image) == []) and passing
+if numpy is not None:
+    programs = [ [ "rx2" ] * 4, [ "rx2", "rwait" ], [ "rx1" ] ]
+    images = ram.program_images(programs)
+    passing = (images.tolist() == [ list(ram.program_image(x)) for x in programs ]) and passing
+    passing = (ram.program_changes(images, images[0]).tolist() == [ 0, 4, 5 ]) and passing
+    # the rows of program_images() are images too
+    passing = (ram.program_writes([ "rx2", "rwait" ], images[0]) == writes and ram.program_writes(programs[1], images[1]) == []) and passing
+    for programs in [ [ [] ], [ [ "rx1" ] * 5 ], [ [ "rx1", "nope" ] ] ]:
+        try:
+            ram.program_images(programs)
+            passing = False
+        except Exception:
+            pass
+
+# performance counters are saturating output registers of their Bin,
+# which the Bins above pass up to the terminal
+term = Terminal()
+SeqNitro.add_counters(term, rtop, True, 8)
+passing = (sorted(term.regs.keys()) == sorted([ "perf_rtop_rprog_starts", "perf_rtop_rprog_busy", "perf_rtop_idle", "perf_rleaf_idle" ] + [ "perf_rleaf_%s_%s" % (x, y) for x in [ "rx1", "rwait", "rx2" ] for y in [ "starts", "busy" ] ])) and passing
+passing = ([ (x.mode, x.width) for x in term.regs.values() ] == [ ("read", 8) ] * 10) and passing
+lines = [ x.strip() for x in vlog_module(rtop, counters=True, counter_width=8) ]
+passing = (vlog_balanced(lines) and "output reg  [7:0] perf_rtop_rprog_starts," in lines and "output  [7:0] perf_rleaf_rx2_busy," in lines) and passing
+passing = (".perf_rleaf_rx2_busy(perf_rleaf_rx2_busy)," in lines) and passing
+passing = ("if(seq_rprog_start_ && !(&perf_rtop_rprog_starts)) perf_rtop_rprog_starts <= perf_rtop_rprog_starts + 1;" in lines) and passing
+passing = ("if(!running && !(&perf_rtop_idle)) perf_rtop_idle <= perf_rtop_idle + 1;" in lines) and passing
+lines = [ x.strip() for x in vlog_module(rleaf, counters=[ "rx2" ], counter_width=8) ]
+passing = ([ x for x in lines if "perf_" in x and "<= 0" not in x ] == [ "output reg  [7:0] perf_rleaf_rx2_starts,", "output reg  [7:0] perf_rleaf_rx2_busy,",
+                                                                            "if(seq_rx2_start_ && !(&perf_rleaf_rx2_starts)) perf_rleaf_rx2_starts <= perf_rleaf_rx2_starts + 1;",
+                                                                            "if(seq_rx2_running_ && !(&perf_rleaf_rx2_busy)) perf_rleaf_rx2_busy <= perf_rleaf_rx2_busy + 1;" ]) and passing
+passing = (not([ x for x in vlog_module(rtop) if "perf_" in x ])) and passing
+
+# the ROM images a Bin reads are regenerated with it
+outdir = os.path.join(tmp, "rom") + os.sep
+os.mkdir(outdir)
+for bin, hexfile in [ (test4w, "test4w_u_rom.hex"), (rtop, "rtop_rprog.hex") ]:
+    bin.vlog_dump(outdir, incremental=True)
+    passing = (os.path.exists(outdir + hexfile) and Manifest.Manifest(outdir).entries.has_key(hexfile)) and passing
+    os.remove(outdir + hexfile)
+    bin.vlog_dump(outdir, incremental=True)
+    passing = os.path.exists(outdir + hexfile) and passing
+
+# an incremental dump only rewrites the Bins that changed
+def dbins(count):
+    dx = seq.Signal("dx", width=4, init=0)
+    dleaf = Bin.Bin(name="dleaf", regs=[ dx, ], seqs=[ Sequence.Set(name="dx1", set=dict(dx=1)), Sequence.Stall(name="dwait", count=count) ])
+    dmid = Bin.Bin(name="dmid", children=[ dleaf, ], seqs=[ Sequence.Serial(name="dser", subseqs=[ "dx1", "dwait" ]) ])
+    return Bin.Bin(name="dtop", children=[ dmid, rleaf, ], seqs=[ Sequence.Serial(name="dall", subseqs=[ "dser", "rx2" ]) ])
+def dumped(outdir):
+    """Returns a dict of the contents of the generated files in 'outdir'."""
+    files = {}
+    for name in os.listdir(outdir):
+        if name != ".seq_manifest":
+            files[name] = open(os.path.join(outdir, name), "rb").read()
+    return files
+def rewritten(outdir):
+    """Returns the generated files in 'outdir' written since they were
+    stamped with an mtime of 1000."""
+    return sorted([ name for name in dumped(outdir) if os.path.getmtime(outdir + name) != 1000 ])
+outdir = os.path.join(tmp, "incr") + os.sep
+os.mkdir(outdir)
+dtop = dbins(4)
+dtop.vlog_dump(outdir, recurse=True, incremental=True)
+for name in os.listdir(outdir):
+    os.utime(outdir + name, (1000, 1000))
+dtop.vlog_dump(outdir, recurse=True, incremental=True)
+passing = (rewritten(outdir) == []) and passing
+# a changed Bin is rewritten, but not a Bin that is not below it.  The
+# Bins above it are, as their Serials name their Child Sequences anew.
+dbins(5).vlog_dump(outdir, recurse=True, incremental=True)
+passing = ("dleaf.v" in rewritten(outdir) and not("rleaf.v" in rewritten(outdir))) and passing
+
+# and a dump across a process pool is the same as a serial one
+for jobs in [ 1, 3 ]:
+    os.mkdir(os.path.join(tmp, "jobs%d" % jobs))
+    dtop.vlog_dump(os.path.join(tmp, "jobs%d" % jobs) + os.sep, recurse=True, incremental=True, jobs=jobs)
+files = dumped(os.path.join(tmp, "jobs1"))
+passing = (sorted(files.keys()) == [ "dleaf.v", "dmid.v", "dtop.v", "rleaf.v" ] and files == dumped(os.path.join(tmp, "jobs3"))) and passing
+
+shutil.rmtree(tmp)
+print "ALL PASSED=%d" % passing